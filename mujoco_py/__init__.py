@@ -12,6 +12,9 @@ load_model_from_xml = cymj.load_model_from_xml
 load_model_from_mjb = cymj.load_model_from_mjb
 MjSim = cymj.MjSim
 MjSimState = cymj.MjSimState
+MjSimStateWithWarmstart = cymj.MjSimStateWithWarmstart
+StateLayout = cymj.StateLayout
+MjSimStateBatch = cymj.MjSimStateBatch
 MjRenderContext = cymj.MjRenderContext
 MjRenderContextOffscreen = cymj.MjRenderContextOffscreen
 MjRenderContextWindow = cymj.MjRenderContextWindow
@@ -20,7 +23,8 @@ GlfwContext = cymj.GlfwContext
 
 
 # Public API:
-__all__ = ['MjSim', 'MjSimState',
+__all__ = ['MjSim', 'MjSimState', 'MjSimStateWithWarmstart', 'StateLayout',
+           'MjSimStateBatch',
            'MjRenderContextOffscreen', 'MjRenderContextWindow',
            'MjRenderContext', 'MjViewer', 'MjViewerBasic',
            'MujocoException', 'MjRenderPool', 'MjBatchRenderer', 'GlfwContext',
@@ -0,0 +1,232 @@
+"""
+Pruning of collision pairs that can't happen.
+
+On articulated robots, broadphase and narrowphase collision often dominate
+the step time, yet many geom pairs never come close, e.g. links far apart
+in the kinematic chain. :func:`prune_collision_pairs` runs collision
+detection with an enlarged margin over sampled configurations (from joint
+ranges or from rollouts), finds the body pairs that never had a contact and
+recompiles the model with ``<exclude>`` entries for them.
+"""
+import time
+from collections import namedtuple
+from xml.dom import minidom
+
+import numpy as np
+from mujoco_py import cymj
+from mujoco_py.generated import const
+from mujoco_py.utils import remove_empty_lines
+
+CollisionPruning = namedtuple('CollisionPruning', [
+    'pairs', 'model', 'step_time', 'pruned_step_time', 'speedup'])
+CollisionPruning.__doc__ = """
+Result of :func:`prune_collision_pairs`.
+
+- pairs (list of (str, str)): names of the excluded body pairs.
+- model (PyMjModel): model with the exclusions.
+- step_time (float): seconds per step of the original model.
+- pruned_step_time (float): seconds per step of the new model.
+- speedup (float): ``step_time / pruned_step_time``.
+"""
+
+
+def sample_joint_qpos(model, num_samples, seed=None):
+    """
+    Samples configurations uniformly within the joint ranges.
+
+    Limited hinge and slide joints are sampled within their range, and
+    unlimited hinges within [-pi, pi]. Unlimited ball joints get uniformly
+    random orientations. Unlimited slide joints, limited ball joints and
+    free joints stay at ``qpos0``, so pairs that depend on them are better
+    checked on rollouts.
+
+    Returns an array of shape (num_samples, nq).
+    """
+    rng = np.random.RandomState(seed)
+    qpos = np.tile(model.qpos0, (num_samples, 1))
+    for j in range(model.njnt):
+        adr = model.jnt_qposadr[j]
+        jnt_type = model.jnt_type[j]
+        limited = model.jnt_limited[j]
+        if jnt_type in (const.JNT_HINGE, const.JNT_SLIDE) and limited:
+            low, high = model.jnt_range[j]
+            qpos[:, adr] = rng.uniform(low, high, num_samples)
+        elif jnt_type == const.JNT_HINGE:
+            qpos[:, adr] = rng.uniform(-np.pi, np.pi, num_samples)
+        elif jnt_type == const.JNT_BALL and not limited:
+            quat = rng.randn(num_samples, 4)
+            qpos[:, adr:adr + 4] = quat / np.linalg.norm(quat, axis=1)[:, None]
+    return qpos
+
+
+def _excluded_body_pairs(model):
+    """ Body pairs of the model's existing ``<exclude>`` entries. """
+    excluded = set()
+    for signature in model.exclude_signature[:model.nexclude]:
+        b1 = (signature >> 16) - 1
+        b2 = (signature & 0xFFFF) - 1
+        excluded.add((min(b1, b2), max(b1, b2)))
+    return excluded
+
+
+def candidate_body_pairs(model, self_collisions_only=True):
+    """
+    Body pairs that MuJoCo checks for collisions: those with a geom pair
+    whose contype and conaffinity match, which aren't welded together or
+    (unless disabled) parent and child, and aren't excluded already.
+    Explicit ``<pair>`` elements are always checked and aren't considered.
+
+    Args:
+    - model (PyMjModel): the model.
+    - self_collisions_only (bool): only keep pairs within the same
+        kinematic tree, i.e. below the same child of the world body. The
+        relative pose of different trees usually depends on free joints,
+        which :func:`sample_joint_qpos` doesn't sample.
+
+    Returns a sorted list of (body1, body2) ids with body1 < body2.
+    """
+    opt = model.opt
+    if (opt.disableflags & const.DSBL_CONTACT or
+            opt.collision == const.COL_PAIR or model.ngeom == 0):
+        return []
+    contype = model.geom_contype
+    conaffinity = model.geom_conaffinity
+    compatible = (((contype[:, None] & conaffinity[None, :]) != 0) |
+                  ((conaffinity[:, None] & contype[None, :]) != 0))
+    weld = model.body_weldid[model.geom_bodyid]
+    parent_weld = model.body_weldid[model.body_parentid[weld]]
+    w1, w2 = weld[:, None], weld[None, :]
+    compatible &= w1 != w2
+    if not opt.disableflags & const.DSBL_FILTERPARENT:
+        compatible &= ((w1 == 0) | (w2 == 0) |
+                       ((w1 != parent_weld[None, :]) &
+                        (w2 != parent_weld[:, None])))
+
+    bodies = model.geom_bodyid
+    excluded = _excluded_body_pairs(model)
+    pairs = set()
+    for g1, g2 in zip(*np.nonzero(np.triu(compatible, 1))):
+        b1, b2 = sorted((bodies[g1], bodies[g2]))
+        if (b1, b2) in excluded:
+            continue
+        if self_collisions_only:
+            root = model.body_rootid[b1]
+            if root == 0 or root != model.body_rootid[b2]:
+                continue
+        pairs.add((int(b1), int(b2)))
+    return sorted(pairs)
+
+
+def find_prunable_pairs(sim, qpos=None, num_samples=1000, margin=0.01,
+                        self_collisions_only=True, seed=None, nconmax=None,
+                        nthreads=None):
+    """
+    Finds the candidate body pairs (see :func:`candidate_body_pairs`) that
+    never come within ``margin`` of each other.
+
+    Args:
+    - sim (MjSim): simulation of the model. Mocap poses are taken from
+        ``sim.data``, which isn't modified.
+    - qpos (array of shape (n, nq)): configurations to check, e.g. the
+        states of recorded or sampled rollouts. Defaults to
+        ``num_samples`` configurations from :func:`sample_joint_qpos`.
+    - num_samples (int): number of sampled configurations.
+    - margin (float): distance below which a pair is kept. Geoms with a
+        larger margin of their own keep it.
+    - self_collisions_only (bool): see :func:`candidate_body_pairs`.
+    - seed (int): seed of the sampling.
+    - nconmax (int): room for contacts during the check. Defaults to
+        enough for a few contacts per candidate geom pair; overflowing it
+        raises the MuJoCo warning.
+    - nthreads (int): number of threads, defaults to OpenMP's maximum.
+
+    Returns a sorted list of (body1, body2) ids. A pair is only as safe to
+    exclude as the configurations cover the motions of the robot.
+    """
+    model = sim.model
+    candidates = candidate_body_pairs(model, self_collisions_only)
+    if not candidates:
+        return []
+    if qpos is None:
+        qpos = sample_joint_qpos(model, num_samples, seed)
+    if nconmax is None:
+        nconmax = max(model.nconmax, min(8 * model.ngeom ** 2, 20000))
+    near = cymj._near_body_pairs(sim, qpos, margin, nconmax, nthreads)
+    return [(b1, b2) for b1, b2 in candidates if not near[b1, b2]]
+
+
+def exclude_pairs_xml(model, pairs):
+    """
+    Returns the XML of the last loaded model (see :meth:`MjSim.save`) with
+    an ``<exclude>`` entry for each (body1, body2) pair of ids. Both bodies
+    must have names.
+    """
+    dom = minidom.parseString(model.get_xml())
+    mujoco_node = dom.childNodes[0]
+    assert mujoco_node.tagName == 'mujoco'
+    contact_elements = [node for node in mujoco_node.childNodes
+                        if getattr(node, 'tagName', None) == 'contact']
+    if contact_elements:
+        contact_el = contact_elements[0]
+    else:
+        contact_el = dom.createElement('contact')
+        mujoco_node.appendChild(contact_el)
+    for b1, b2 in pairs:
+        names = model.body_id2name(b1), model.body_id2name(b2)
+        if not all(names):
+            raise ValueError("Body %d or %d has no name to exclude it by" %
+                             (b1, b2))
+        exclude_el = dom.createElement('exclude')
+        exclude_el.setAttribute('body1', names[0])
+        exclude_el.setAttribute('body2', names[1])
+        contact_el.appendChild(exclude_el)
+    return remove_empty_lines(dom.toprettyxml(indent=" " * 4))
+
+
+def measure_step_time(model, nsteps=1000, repeats=3):
+    """
+    Measures the time of ``mj_step`` from the initial state of ``model``,
+    in seconds per step: the best of ``repeats`` runs of ``nsteps`` steps.
+    """
+    sim = cymj.MjSim(model, nsubsteps=nsteps)
+    best = np.inf
+    for _ in range(repeats):
+        sim.reset()
+        start = time.perf_counter()
+        sim.step()
+        best = min(best, time.perf_counter() - start)
+    return best / nsteps
+
+
+def prune_collision_pairs(sim, qpos=None, num_samples=1000, margin=0.01,
+                          self_collisions_only=True, seed=None, nsteps=1000,
+                          nthreads=None):
+    """
+    Excludes the body pairs found by :func:`find_prunable_pairs` and
+    measures the step time of the original and the new model. Pairs with
+    an unnamed body can't be excluded and are skipped.
+
+    The arguments are those of :func:`find_prunable_pairs` and ``nsteps``,
+    the number of steps timed per model.
+
+    Returns a :class:`CollisionPruning`.
+
+    Example::
+
+        result = prune_collision_pairs(sim, qpos=rollout_qpos)
+        print('%d pairs excluded, %.2fx faster' %
+              (len(result.pairs), result.speedup))
+        sim = MjSim(result.model)
+    """
+    model = sim.model
+    pairs = [(b1, b2) for b1, b2 in find_prunable_pairs(
+                 sim, qpos, num_samples, margin, self_collisions_only, seed,
+                 nthreads=nthreads)
+             if model.body_id2name(b1) and model.body_id2name(b2)]
+    pruned_model = cymj.load_model_from_xml(exclude_pairs_xml(model, pairs))
+    step_time = measure_step_time(model, nsteps)
+    pruned_step_time = measure_step_time(pruned_model, nsteps)
+    names = [(model.body_id2name(b1), model.body_id2name(b2))
+             for b1, b2 in pairs]
+    return CollisionPruning(names, pruned_model, step_time, pruned_step_time,
+                            step_time / pruned_step_time)
@@ -1,28 +1,37 @@
 # cython: language_level=3
-import copy
+from copy import deepcopy
 import logging
 import os
 import platform
-import tempfile
 import sys
 from collections import namedtuple
-from libc.stdlib cimport malloc, free
-from libc.string cimport strncpy
+from libc.stdlib cimport malloc, realloc, free
+from libc.string cimport strncpy, memcpy, memcmp
 from numbers import Number
 from tempfile import TemporaryDirectory
 
 import numpy as np
 from cython cimport view
-from cython.parallel import parallel, prange
+from cython.parallel import parallel, prange, threadid
 from mujoco_py.generated import const
 
 include "generated/wrappers.pxi"
 include "opengl_context.pyx"
+include "mjcontactevents.pyx"
 include "mjsim.pyx"
 include "mjsimstate.pyx"
 include "mjrendercontext.pyx"
 include "mjbatchrenderer.pyx"
 include "mjpid.pyx"
+include "mjpickle.pyx"
+include "mjderivatives.pyx"
+include "mjbatch.pyx"
+include "mjjacobian.pyx"
+include "mjsparse.pyx"
+include "mjik.pyx"
+include "mjrollout.pyx"
+include "mjsizing.pyx"
+include "mjcollision.pyx"
 
 cdef extern from "gl/glshim.h":
 
@@ -159,9 +168,34 @@ class wrap_mujoco_warning(object):
             raise py_error_exception
 
 
-def load_model_from_path(str path):
-    """Loads model from path."""
+cdef _load_with_cache(cache, key, load):
+    """
+    Returns the model stored under ``key`` in ``cache``. On a miss the model
+    is compiled with ``load()`` and its MJB is stored. A None key (source
+    that can't be hashed) bypasses the cache.
+    """
+    if key is not None:
+        mjb = cache.get(key)
+        if mjb is not None:
+            return load_model_from_mjb(mjb)
+    model = load()
+    if key is not None:
+        cache.put(key, model.get_mjb())
+    return model
+
+
+def load_model_from_path(str path, cache=None):
+    """
+    Loads model from path.
+
+    ``cache`` is an optional :class:`mujoco_py.modelcache.ModelCache`. For XML
+    files, the compiled model is then looked up by the hash of the XML and
+    all its referenced assets, skipping compilation on a hit.
+    """
     cdef char errstr[300]
+    if cache is not None and path.endswith(".xml"):
+        return _load_with_cache(cache, cache.key_for_path(path),
+                                lambda: load_model_from_path(path))
     cdef mjModel *model
     with wrap_mujoco_warning():
         if (path.endswith(".mjb")):
@@ -175,35 +209,105 @@ def load_model_from_path(str path):
         raise Exception('Failed to load XML file: %s. mj_loadXML error: %s' % (path, errstr,))
     return WrapMjModel(model)
 
-def load_model_from_xml(str xml_str):
+
+# Names under which in-memory models are placed in the VFS. Assets are looked
+# up by file name, so these are chosen to not collide with user assets.
+_VFS_XML_NAME = '__mujoco_py_model__.xml'
+_VFS_MJB_NAME = '__mujoco_py_model__.mjb'
+
+
+cdef _vfs_add_buffer(PyMjVFS vfs, str filename, data):
+    """
+    Adds an in-memory file to the VFS. The file is allocated with
+    ``mj_makeEmptyFileVFS`` and the contents are copied straight into it,
+    so nothing touches the disk.
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    cdef const unsigned char[::1] buf = data
+    cdef bytes name = filename.encode()
+    cdef int ret
+    if len(name) >= mjMAXVFSNAME:
+        raise ValueError('VFS file name too long (max %d characters): %s' %
+                         (mjMAXVFSNAME - 1, filename))
+    if buf.shape[0] == 0:
+        raise ValueError('Cannot add empty file to VFS: %s' % filename)
+    ret = mj_makeEmptyFileVFS(vfs.ptr, name, buf.shape[0])
+    if ret == 1:
+        raise RuntimeError('VFS is full (max %d files), cannot add %s' %
+                           (mjMAXVFS, filename))
+    elif ret == 2:
+        raise ValueError('Duplicate file name in VFS: %s' % filename)
+    memcpy(vfs.ptr.filedata[vfs.ptr.nfile - 1], &buf[0], buf.shape[0])
+
+
+cdef PyMjVFS _make_vfs(dict assets):
+    """
+    Returns an initialized VFS holding ``assets``, a dict mapping file names
+    to their contents (bytes-like or str). Callers must ``mj_deleteVFS`` it.
+    """
+    cdef PyMjVFS vfs = PyMjVFS()
+    mj_defaultVFS(vfs.ptr)
+    if assets is not None:
+        try:
+            for filename, data in assets.items():
+                _vfs_add_buffer(vfs, filename, data)
+        except:
+            mj_deleteVFS(vfs.ptr)
+            raise
+    return vfs
+
+
+def load_model_from_xml(str xml_str, dict assets=None, cache=None):
     """
     Loads and returns a PyMjModel model from a string containing XML markup.
     Saves the XML string used to create the returned model in `model.xml`.
+
+    The XML is compiled from memory through a MuJoCo VFS, so no temporary
+    files are written. ``assets`` optionally maps file names referenced by
+    the XML (meshes, textures, included files) to their contents as
+    bytes; these are looked up before falling back to the disk.
+
+    ``cache`` is an optional :class:`mujoco_py.modelcache.ModelCache`; see
+    :func:`load_model_from_path`. Relative asset paths are resolved against
+    the current working directory. Note that ``get_xml()`` is not available
+    for models served from the cache, as they were never parsed from XML.
     """
     cdef char errstr[300]
     cdef mjModel *model
-    with wrap_mujoco_warning():
-        with tempfile.NamedTemporaryFile(suffix=".xml", delete=True) as fp:
-            fp.write(xml_str.encode())
-            fp.flush()
-            model = mj_loadXML(fp.name.encode(), NULL, errstr, 300)
+    cdef PyMjVFS vfs
+    if cache is not None:
+        return _load_with_cache(cache, cache.key_for_xml(xml_str, assets=assets),
+                                lambda: load_model_from_xml(xml_str, assets))
+    vfs = _make_vfs(assets)
+    try:
+        _vfs_add_buffer(vfs, _VFS_XML_NAME, xml_str)
+        with wrap_mujoco_warning():
+            model = mj_loadXML(_VFS_XML_NAME.encode(), vfs.ptr, errstr, 300)
+    finally:
+        mj_deleteVFS(vfs.ptr)
     if model == NULL:
         raise Exception('%s\nFailed to load XML from string. mj_loadXML error: %s' % (xml_str, errstr,))
     return WrapMjModel(model)
 
 
-def load_model_from_mjb(bytes mjb_bytes):
+def load_model_from_mjb(mjb_bytes, dict assets=None):
     """
     Loads and returns a PyMjModel model from bytes encoded MJB.
     MJB is a MuJoCo-custom format that includes assets like meshes/textures.
+
+    ``mjb_bytes`` may be any bytes-like object (``bytes``, ``bytearray``,
+    ``memoryview``). It is loaded from memory through a MuJoCo VFS, along
+    with the optional ``assets`` dict, so no temporary files are written.
     """
     cdef mjModel *model
-    with wrap_mujoco_warning():
-        with TemporaryDirectory() as td:
-            filename = os.path.join(td, 'model.mjb')
-            with open(filename, 'wb') as f:
-                f.write(mjb_bytes)
-            model = mj_loadModel(filename.encode(), NULL)
+    cdef PyMjVFS vfs = _make_vfs(assets)
+    try:
+        _vfs_add_buffer(vfs, _VFS_MJB_NAME, mjb_bytes)
+        with wrap_mujoco_warning():
+            model = mj_loadModel(_VFS_MJB_NAME.encode(), vfs.ptr)
+    finally:
+        mj_deleteVFS(vfs.ptr)
     if model == NULL:
-        raise Exception('%s\nFailed to load MJB')
+        raise Exception('Failed to load MJB')
     return WrapMjModel(model)
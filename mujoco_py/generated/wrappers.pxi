@@ -4,6 +4,7 @@
 include "../pxd/mujoco.pxd"
 from libc.stdint cimport uintptr_t
 from cpython.mem cimport PyMem_Malloc, PyMem_Free
+from cpython.bytes cimport PyBytes_FromStringAndSize, PyBytes_AS_STRING
 cimport numpy as np
 import numpy as np
 from tempfile import TemporaryDirectory
@@ -1111,6 +1112,7 @@ cdef class PyMjModel(object):
     cdef public tuple userdata_names
     cdef public dict _userdata_id2name
     cdef public dict _userdata_name2id
+    cdef tuple _qM_csr_structure
 
     def userdata_id2name(self, id):
         if id not in self._userdata_id2name:
@@ -1141,23 +1143,56 @@ cdef class PyMjModel(object):
         # sort names by increasing id to keep order deterministic
         return tuple(id2name[id] for id in sorted(name2id.values())), name2id, id2name
 
-    def get_xml(self):
+    cdef _save_last_xml(self, str filename):
         cdef char errstr[300]
         cdef int ret
-        with TemporaryDirectory() as td:
-            filename = os.path.join(td, 'model.xml')
-            with wrap_mujoco_warning():
-                ret = mj_saveLastXML(filename.encode(), self.ptr, errstr, 300)
-            if ret == 0:
-                raise Exception('Failed to save XML: {}'.format(errstr))
-            return open(filename).read()
+        with wrap_mujoco_warning():
+            ret = mj_saveLastXML(filename.encode(), self.ptr, errstr, 300)
+        if ret == 0:
+            raise Exception('Failed to save XML: {}'.format(errstr))
 
-    def get_mjb(self):
+    def get_xml(self):
+        """
+        Returns the XML of the last loaded model as a string.
+
+        MuJoCo can only save XML to a named file. Where available (Linux), the
+        file is an anonymous in-memory file, so no disk I/O happens.
+        """
+        if hasattr(os, 'memfd_create'):
+            fd = os.memfd_create('model.xml')
+            with open(fd) as f:
+                self._save_last_xml('/proc/self/fd/%d' % fd)
+                return f.read()
         with TemporaryDirectory() as td:
-            filename = os.path.join(td, 'model.mjb')
+            filename = os.path.join(td, 'model.xml')
+            self._save_last_xml(filename)
+            with open(filename) as f:
+                return f.read()
+
+    def get_mjb(self, out=None):
+        """
+        Returns the model serialized in the MJB format.
+
+        The model is saved straight into memory with ``mj_saveModel``. If
+        ``out`` is None, a new ``bytes`` object is returned. Otherwise ``out``
+        must be a writable bytes-like object (e.g. ``bytearray``) of at least
+        ``functions.mj_sizeModel(model)`` bytes; the MJB is written into it
+        and a memoryview of the written prefix is returned.
+        """
+        cdef int size = mj_sizeModel(self.ptr)
+        cdef unsigned char[::1] buf
+        if out is None:
+            mjb = PyBytes_FromStringAndSize(NULL, size)
             with wrap_mujoco_warning():
-                mj_saveModel(self.ptr, filename.encode(), NULL, 0)
-            return open(filename, 'rb').read()
+                mj_saveModel(self.ptr, NULL, PyBytes_AS_STRING(mjb), size)
+            return mjb
+        buf = out
+        if buf.shape[0] < size:
+            raise ValueError('Buffer too small for MJB: need %d bytes, got %d' %
+                             (size, buf.shape[0]))
+        with wrap_mujoco_warning():
+            mj_saveModel(self.ptr, NULL, &buf[0], size)
+        return memoryview(out)[:size]
 
     def set_userdata_names(self, userdata_names):
         assert isinstance(userdata_names, (list, tuple)), 'bad userdata names'
@@ -1170,6 +1205,9 @@ cdef class PyMjModel(object):
             self._userdata_id2name[i] = name
             self._userdata_name2id[name] = i
 
+    def __reduce_ex__(self, protocol):
+        return _reduce_model(self, protocol)
+
     def __dealloc__(self):
         mj_deleteModel(self.ptr)
 
@@ -2596,6 +2634,78 @@ cdef class PyMjData(object):
     def active_contacts_efc_pos(self):
         return self._efc_pos[self.ne:self.nefc]
 
+    def jacobians(self, kind, ids=None, part='pos', out=None):
+        """
+        Computes the Jacobians of many bodies, geoms or sites in one call.
+
+        Args:
+        - kind (str): 'body', 'geom' or 'site'.
+        - ids (list): ids or names of the objects. All objects if None.
+        - part (str): 'pos' for the translational Jacobians (like
+            ``body_jacp``), 'rot' for the rotational ones (like
+            ``body_jacr``), or 'both' for the rotational part stacked on top
+            of the translational one, as in :meth:`velocities`.
+        - out (array): optional output of shape (len(ids), 3, nv), or
+            (len(ids), 6, nv) for 'both'. Reusing it avoids allocations.
+
+        Returns:
+        - Jacobians as array of shape (len(ids), 3 or 6, nv).
+        """
+        return _jacobians(self, kind, ids, part, out)
+
+    def velocities(self, kind, ids=None, local=False, out=None):
+        """
+        Computes the 6D velocities (rotational, then translational) of many
+        bodies, geoms or sites with ``mj_objectVelocity``. Requires the
+        velocity-dependent quantities of ``forward()``.
+
+        Args:
+        - kind (str): 'body', 'geom' or 'site'. Body velocities are those of
+            the body frame (``body_xpos``).
+        - ids (list): ids or names of the objects. All objects if None.
+        - local (bool): if True, in the object's frame instead of the world
+            frame.
+        - out (array): optional output of shape (len(ids), 6).
+
+        Returns:
+        - velocities as array of shape (len(ids), 6).
+        """
+        return _velocities(self, kind, ids, local, out)
+
+    def mass_matrix(self, format='csr', out=None):
+        """
+        Returns the (symmetric) joint-space inertia matrix ``M``.
+
+        Args:
+        - format (str): 'csr' for a sparse matrix, 'dense' for an (nv, nv)
+            array.
+        - out (array): optional output for the nonzero values (for 'csr')
+            or the dense matrix.
+
+        Returns:
+        - for 'csr', a ``(data, indices, indptr)`` tuple. The structure is
+            computed once per model and shared; only ``data`` is refreshed.
+            ``scipy.sparse.csr_matrix(result, shape=(nv, nv))`` wraps it
+            without copying.
+        - for 'dense', the (nv, nv) array.
+        """
+        return _mass_matrix(self, format, out)
+
+    def constraint_jacobian(self, format='csr', out=None):
+        """
+        Returns the constraint Jacobian ``efc_J`` of the active constraints,
+        from either the dense or the sparse representation MuJoCo uses.
+
+        Args:
+        - format (str): 'csr' for a ``(data, indices, indptr)`` tuple (see
+            :meth:`mass_matrix`), 'dense' for an (nefc, nv) array.
+        - out (array): optional (nefc, nv) output for 'dense'.
+        """
+        return _constraint_jacobian(self, format, out)
+
+    def __reduce_ex__(self, protocol):
+        return _reduce_data(self, protocol)
+
     def __dealloc__(self):
         mj_deleteData(self.ptr)
 
@@ -3210,21 +3320,13 @@ cdef class PyMjData(object):
     def energy(self): return self._energy
     @property
     def body_jacp(self):
-        jacps = np.zeros((self._model.nbody, 3 * self._model.nv))
-        cdef double [:] jacp_view
-        for i, jacp in enumerate(jacps):
-            jacp_view = jacp
-            mj_jacBody(self._model.ptr, self.ptr, &jacp_view[0], NULL, i)
-        return jacps
+        jacps = _jacobians(self, 'body', None, 'pos', None)
+        return jacps.reshape((self._model.nbody, 3 * self._model.nv))
 
     @property
     def body_jacr(self):
-        jacrs = np.zeros((self._model.nbody, 3 * self._model.nv))
-        cdef double [:] jacr_view
-        for i, jacr in enumerate(jacrs):
-            jacr_view = jacr
-            mj_jacBody(self._model.ptr, self.ptr, NULL, &jacr_view[0], i)
-        return jacrs
+        jacrs = _jacobians(self, 'body', None, 'rot', None)
+        return jacrs.reshape((self._model.nbody, 3 * self._model.nv))
 
     @property
     def body_xvelp(self):
@@ -3240,21 +3342,13 @@ cdef class PyMjData(object):
 
     @property
     def geom_jacp(self):
-        jacps = np.zeros((self._model.ngeom, 3 * self._model.nv))
-        cdef double [:] jacp_view
-        for i, jacp in enumerate(jacps):
-            jacp_view = jacp
-            mj_jacGeom(self._model.ptr, self.ptr, &jacp_view[0], NULL, i)
-        return jacps
+        jacps = _jacobians(self, 'geom', None, 'pos', None)
+        return jacps.reshape((self._model.ngeom, 3 * self._model.nv))
 
     @property
     def geom_jacr(self):
-        jacrs = np.zeros((self._model.ngeom, 3 * self._model.nv))
-        cdef double [:] jacr_view
-        for i, jacr in enumerate(jacrs):
-            jacr_view = jacr
-            mj_jacGeom(self._model.ptr, self.ptr, NULL, &jacr_view[0], i)
-        return jacrs
+        jacrs = _jacobians(self, 'geom', None, 'rot', None)
+        return jacrs.reshape((self._model.ngeom, 3 * self._model.nv))
 
     @property
     def geom_xvelp(self):
@@ -3270,21 +3364,13 @@ cdef class PyMjData(object):
 
     @property
     def site_jacp(self):
-        jacps = np.zeros((self._model.nsite, 3 * self._model.nv))
-        cdef double [:] jacp_view
-        for i, jacp in enumerate(jacps):
-            jacp_view = jacp
-            mj_jacSite(self._model.ptr, self.ptr, &jacp_view[0], NULL, i)
-        return jacps
+        jacps = _jacobians(self, 'site', None, 'pos', None)
+        return jacps.reshape((self._model.nsite, 3 * self._model.nv))
 
     @property
     def site_jacr(self):
-        jacrs = np.zeros((self._model.nsite, 3 * self._model.nv))
-        cdef double [:] jacr_view
-        for i, jacr in enumerate(jacrs):
-            jacr_view = jacr
-            mj_jacSite(self._model.ptr, self.ptr, NULL, &jacr_view[0], i)
-        return jacrs
+        jacrs = _jacobians(self, 'site', None, 'rot', None)
+        return jacrs.reshape((self._model.nsite, 3 * self._model.nv))
 
     @property
     def site_xvelp(self):
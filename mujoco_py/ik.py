@@ -0,0 +1,122 @@
+"""
+Damped least-squares inverse kinematics for sites.
+
+The iterations (``mj_kinematics``, ``mj_jacSite``, the damped least-squares
+step and ``mj_integratePos``) run in C on private copies of the simulation
+data, so ``sim.data`` is left untouched. :func:`solve_batch` solves many
+problems in parallel, e.g. for grasp-pose or reachability sampling.
+"""
+from collections import namedtuple
+
+import numpy as np
+from mujoco_py import cymj
+
+IKResult = namedtuple('IKResult', ['qpos', 'success', 'error', 'iterations'])
+IKResult.__doc__ = """
+Result of :func:`solve` or :func:`solve_batch`.
+
+- qpos: solution(s), of shape (nq,) or (n, nq).
+- success: whether the error norm is below the tolerance.
+- error: norm of the position (and orientation) error of all sites.
+- iterations: number of iterations taken.
+"""
+
+
+def _site_ids(model, site_names):
+    if isinstance(site_names, str):
+        site_names = [site_names]
+    return [model.site_name2id(name) if isinstance(name, str) else name
+            for name in site_names]
+
+
+def _dof_mask(model, joint_names):
+    if joint_names is None:
+        return None
+    mask = np.zeros(model.nv)
+    for name in joint_names:
+        addr = model.get_joint_qvel_addr(name)
+        if isinstance(addr, tuple):
+            mask[addr[0]:addr[1]] = 1
+        else:
+            mask[addr] = 1
+    return mask
+
+
+def solve_batch(sim, site_names, target_pos, target_quat=None, qpos_init=None,
+                joint_names=None, tol=1e-6, max_iter=100, damping=1e-4,
+                max_step=0.5, nthreads=None):
+    """
+    Solves many inverse kinematics problems for the same sites in parallel.
+
+    Args:
+    - sim (MjSim): simulation whose model is used. Mocap poses and other
+        state that isn't solved for are taken from ``sim.data``.
+    - site_names (list of str): sites to move to the targets.
+    - target_pos (array of shape (n, nsites, 3)): target positions.
+    - target_quat (array of shape (n, nsites, 4)): optional target
+        orientations. If None, only positions are matched.
+    - qpos_init (array of shape (nq,) or (n, nq)): initial guesses. Defaults
+        to ``sim.data.qpos``.
+    - joint_names (list of str): joints that may move. All if None.
+    - tol (float): tolerance on the norm of the stacked site errors.
+    - max_iter (int): maximum number of iterations.
+    - damping (float): damping of the least-squares steps, which keeps them
+        bounded near singularities.
+    - max_step (float): maximum norm of a step in joint space, or 0 for
+        no limit.
+    - nthreads (int): number of threads, defaults to OpenMP's maximum.
+
+    Limited hinge and slide joints are kept within ``jnt_range``.
+
+    Returns an :class:`IKResult` with arrays of length n.
+    """
+    model = sim.model
+    site_ids = _site_ids(model, site_names)
+    target_pos = np.array(target_pos, dtype=np.float64, order='C')
+    if target_pos.ndim != 3 or target_pos.shape[1:] != (len(site_ids), 3):
+        raise ValueError("target_pos must have shape (n, %d, 3)" % len(site_ids))
+    n = target_pos.shape[0]
+    if target_quat is not None:
+        target_quat = np.array(target_quat, dtype=np.float64, order='C')
+        if target_quat.shape != (n, len(site_ids), 4):
+            raise ValueError("target_quat must have shape %s"
+                             % ((n, len(site_ids), 4),))
+        target_quat /= np.linalg.norm(target_quat, axis=-1, keepdims=True)
+    if qpos_init is None:
+        qpos_init = sim.data.qpos
+    qpos = np.array(np.broadcast_to(qpos_init, (n, model.nq)),
+                    dtype=np.float64, order='C')
+    error, iterations = cymj._ik_solve(
+        sim, site_ids, target_pos, target_quat, qpos,
+        _dof_mask(model, joint_names), tol, max_iter, damping, max_step,
+        nthreads)
+    return IKResult(qpos, error < tol, error, iterations)
+
+
+def solve(sim, site_names, target_pos, target_quat=None, qpos_init=None,
+          **kwargs):
+    """
+    Solves inverse kinematics for one set of site targets.
+
+    Args:
+    - target_pos (array of shape (nsites, 3)): target positions.
+    - target_quat (array of shape (nsites, 4)): optional target orientations.
+    - qpos_init (array of shape (nq,)): initial guess, defaults to
+        ``sim.data.qpos``.
+
+    The other arguments are those of :func:`solve_batch`. Returns an
+    :class:`IKResult` for the single problem.
+
+    Example::
+
+        result = ik.solve(sim, ['gripper'], [[.5, 0, .3]])
+        if result.success:
+            sim.data.qpos[:] = result.qpos
+    """
+    target_pos = np.reshape(target_pos, (1, -1, 3))
+    if target_quat is not None:
+        target_quat = np.reshape(target_quat, (1, -1, 4))
+    result = solve_batch(sim, site_names, target_pos, target_quat,
+                         qpos_init, **kwargs)
+    return IKResult(result.qpos[0], bool(result.success[0]),
+                    float(result.error[0]), int(result.iterations[0]))
@@ -0,0 +1,162 @@
+# Batched evaluation of MuJoCo functions over many states, e.g. whole
+# trajectories. The states are split between threads, each working on a
+# private mjData of the MjSim (see MjSim._get_workers), which is first
+# copied from sim.data so that everything not given per state (mocap
+# poses, applied forces, ...) matches the simulation.
+
+
+cdef _check_batch(name, array, int ncol, n=None):
+    """ Returns ``array`` as a C-contiguous float64 (n, ncol) array. """
+    array = np.ascontiguousarray(array, dtype=np.float64)
+    if array.ndim != 2 or array.shape[1] != ncol:
+        raise ValueError("%s must have shape (n, %d), got %s" %
+                         (name, ncol, array.shape))
+    if n is not None and array.shape[0] != n:
+        raise ValueError("%s must have %d rows, got %d" %
+                         (name, n, array.shape[0]))
+    return array
+
+
+cdef _out_array(name, out, tuple shape):
+    """ Allocates a float64 output array or checks the given one. """
+    if out is None:
+        return np.empty(shape)
+    if (not isinstance(out, np.ndarray) or out.dtype != np.float64 or
+            out.shape != shape or not out.flags['C_CONTIGUOUS']):
+        raise ValueError("%s must be a C-contiguous float64 array of shape %s"
+                         % (name, shape))
+    return out
+
+
+cdef mjData** _prepare_workers(MjSim sim, int nthread) except NULL:
+    cdef mjData** workers = sim._get_workers(nthread)
+    cdef const mjModel* m = sim.model.ptr
+    cdef mjData* d = sim.data.ptr
+    cdef int t
+    with nogil:
+        for t in prange(nthread, schedule='static', num_threads=nthread):
+            mj_copyData(workers[t], m, d)
+    return workers
+
+
+cdef _inverse_dynamics(MjSim sim, qpos, qvel, qacc, out,
+                       bint constraint_forces, constraint_out, nthreads):
+    cdef const mjModel* m = sim.model.ptr
+    cdef int nq = m.nq, nv = m.nv
+    cdef int i, tid, nthread, n
+    cdef mjData** workers
+    cdef mjData* w
+    cdef mjtNum* qpos_ptr
+    cdef mjtNum* qvel_ptr
+    cdef mjtNum* qacc_ptr
+    cdef mjtNum* out_ptr
+    cdef mjtNum* constraint_ptr = NULL
+
+    qpos = _check_batch('qpos', qpos, nq)
+    n = qpos.shape[0]
+    qvel = _check_batch('qvel', qvel, nv, n)
+    qacc = _check_batch('qacc', qacc, nv, n)
+    out = _out_array('out', out, (n, nv))
+    if constraint_forces:
+        constraint_out = _out_array('constraint_out', constraint_out, (n, nv))
+        constraint_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> constraint_out)
+    if n == 0:
+        return (out, constraint_out) if constraint_forces else out
+
+    qpos_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> qpos)
+    qvel_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> qvel)
+    qacc_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> qacc)
+    out_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> out)
+    nthread = _num_threads(nthreads, n)
+    with wrap_mujoco_warning():
+        workers = _prepare_workers(sim, nthread)
+        with nogil:
+            for i in prange(n, schedule='static', num_threads=nthread):
+                tid = threadid()
+                w = workers[tid]
+                memcpy(w.qpos, qpos_ptr + i * nq, nq * sizeof(mjtNum))
+                memcpy(w.qvel, qvel_ptr + i * nv, nv * sizeof(mjtNum))
+                memcpy(w.qacc, qacc_ptr + i * nv, nv * sizeof(mjtNum))
+                mj_inverse(m, w)
+                memcpy(out_ptr + i * nv, w.qfrc_inverse, nv * sizeof(mjtNum))
+                if constraint_ptr != NULL:
+                    memcpy(constraint_ptr + i * nv, w.qfrc_constraint,
+                           nv * sizeof(mjtNum))
+    return (out, constraint_out) if constraint_forces else out
+
+
+# PyMjData fields computed by mj_kinematics, by mj_comPos and by
+# mj_camlight (which needs subtree_com from mj_comPos).
+_KINEMATICS_FIELDS = frozenset([
+    'body_xpos', 'body_xquat', 'body_xmat', 'xipos', 'ximat', 'xanchor',
+    'xaxis', 'geom_xpos', 'geom_xmat', 'site_xpos', 'site_xmat'])
+_COM_POS_FIELDS = frozenset(['subtree_com', 'cinert', 'cdof'])
+_CAMLIGHT_FIELDS = frozenset(['cam_xpos', 'cam_xmat', 'light_xpos',
+                              'light_xdir'])
+
+
+cdef _kinematics_batch(MjSim sim, qpos, fields, out, nthreads):
+    cdef const mjModel* m = sim.model.ptr
+    cdef mjData* d = sim.data.ptr
+    cdef int nq = m.nq
+    cdef int i, f, tid, nthread, n
+    cdef int nfield = len(fields)
+    cdef bint com_pos = False
+    cdef bint camlight = False
+    cdef mjData** workers
+    cdef mjData* w
+    cdef mjtNum* qpos_ptr
+    cdef Py_ssize_t[::1] offsets = np.empty(nfield, dtype=np.intp)
+    cdef Py_ssize_t[::1] sizes = np.empty(nfield, dtype=np.intp)
+    cdef char** out_ptrs
+
+    qpos = _check_batch('qpos', qpos, nq)
+    n = qpos.shape[0]
+    result = {}
+    for f, name in enumerate(fields):
+        if name in _COM_POS_FIELDS:
+            com_pos = True
+        elif name in _CAMLIGHT_FIELDS:
+            com_pos = camlight = True
+        elif name not in _KINEMATICS_FIELDS:
+            raise ValueError("%s isn't computed by mj_kinematics, mj_comPos "
+                             "or mj_camlight" % name)
+        value = getattr(sim.data, name)
+        if value is None:
+            raise ValueError("Field %s is empty for this model" % name)
+        # Every mjData of a model has its arrays at the same offsets
+        # in its buffer.
+        offsets[f] = <char*> np.PyArray_DATA(<np.ndarray> value) - <char*> d.buffer
+        sizes[f] = value.nbytes
+        result[name] = _out_array('out[%r]' % name,
+                                  None if out is None else out.get(name),
+                                  (n,) + value.shape)
+    if n == 0 or nfield == 0:
+        return result
+
+    qpos_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> qpos)
+    out_ptrs = <char**> malloc(nfield * sizeof(char*))
+    if out_ptrs == NULL:
+        raise MemoryError()
+    try:
+        for f, name in enumerate(fields):
+            out_ptrs[f] = <char*> np.PyArray_DATA(<np.ndarray> result[name])
+        nthread = _num_threads(nthreads, n)
+        with wrap_mujoco_warning():
+            workers = _prepare_workers(sim, nthread)
+            with nogil:
+                for i in prange(n, schedule='static', num_threads=nthread):
+                    tid = threadid()
+                    w = workers[tid]
+                    memcpy(w.qpos, qpos_ptr + i * nq, nq * sizeof(mjtNum))
+                    mj_kinematics(m, w)
+                    if com_pos:
+                        mj_comPos(m, w)
+                    if camlight:
+                        mj_camlight(m, w)
+                    for f in range(nfield):
+                        memcpy(out_ptrs[f] + i * sizes[f],
+                               <char*> w.buffer + offsets[f], sizes[f])
+    finally:
+        free(out_ptrs)
+    return result
@@ -0,0 +1,79 @@
+from libc.math cimport fmax
+from libc.stdlib cimport calloc
+
+# Collision detection over many configurations, for finding the geom pairs
+# that never come close (see mujoco_py.collision).
+
+
+def _near_body_pairs(MjSim sim, qpos, mjtNum margin, int nconmax,
+                     nthreads=None):
+    """
+    Runs ``mj_kinematics`` and ``mj_collision`` on every configuration in
+    ``qpos`` (n, nq), with the margin of every geom raised to at least
+    ``margin``, and returns a boolean (nbody, nbody) array, symmetric, of
+    the body pairs that had a contact in any of them. Mocap poses are taken
+    from ``sim.data``.
+
+    The collisions run on a copy of the model with room for ``nconmax``
+    contacts, so that the raised margins don't overflow the contact buffer
+    of the simulation. Overflowing it anyway raises the MuJoCo warning
+    rather than silently missing pairs.
+    """
+    cdef const mjModel* m = sim.model.ptr
+    cdef const mjData* d = sim.data.ptr
+    cdef int nq = m.nq, nbody = m.nbody
+    cdef int n, i, j, b1, b2, tid, nthread
+    cdef mjModel* mc = NULL
+    cdef mjData** workers = NULL
+    cdef mjData* w
+    cdef mjtNum* qpos_ptr
+    cdef unsigned char[:, :, ::1] near
+
+    qpos = _check_batch('qpos', qpos, nq)
+    n = qpos.shape[0]
+    nthread = _num_threads(nthreads, n)
+    near = np.zeros((nthread, nbody, nbody), dtype=np.uint8)
+    if n == 0:
+        return np.zeros((nbody, nbody), dtype=bool)
+    qpos_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> qpos)
+
+    try:
+        with wrap_mujoco_warning():
+            mc = mj_copyModel(NULL, m)
+            if mc == NULL:
+                raise MemoryError()
+            for i in range(mc.ngeom):
+                mc.geom_margin[i] = fmax(mc.geom_margin[i], margin)
+            mc.nconmax = max(mc.nconmax, nconmax)
+            workers = <mjData**> calloc(nthread, sizeof(mjData*))
+            if workers == NULL:
+                raise MemoryError()
+            for i in range(nthread):
+                workers[i] = mj_makeData(mc)
+                if workers[i] == NULL:
+                    raise MemoryError()
+                memcpy(workers[i].mocap_pos, d.mocap_pos,
+                       3 * m.nmocap * sizeof(mjtNum))
+                memcpy(workers[i].mocap_quat, d.mocap_quat,
+                       4 * m.nmocap * sizeof(mjtNum))
+            with nogil:
+                for i in prange(n, schedule='static', num_threads=nthread):
+                    tid = threadid()
+                    w = workers[tid]
+                    memcpy(w.qpos, qpos_ptr + i * nq, nq * sizeof(mjtNum))
+                    mj_kinematics(mc, w)
+                    mj_collision(mc, w)
+                    for j in range(w.ncon):
+                        b1 = mc.geom_bodyid[w.contact[j].geom1]
+                        b2 = mc.geom_bodyid[w.contact[j].geom2]
+                        near[tid, b1, b2] = 1
+                        near[tid, b2, b1] = 1
+    finally:
+        if workers != NULL:
+            for i in range(nthread):
+                if workers[i] != NULL:
+                    mj_deleteData(workers[i])
+            free(workers)
+        if mc != NULL:
+            mj_deleteModel(mc)
+    return np.asarray(near).any(axis=0)
@@ -0,0 +1,148 @@
+from libc.stdlib cimport qsort
+
+# Contact begin/end events, recorded in C after every substep by diffing the
+# geom pairs in contact with those of the previous substep, see
+# MjSim.enable_contact_events.
+
+cdef struct _ContactEvent:
+    mjtNum time
+    int geom1
+    int geom2
+    int begin
+    mjtNum dist
+    mjtNum normal_force
+
+# Same layout as _ContactEvent, for the arrays returned to Python.
+CONTACT_EVENT_DTYPE = np.dtype([
+    ('time', np.float64), ('geom1', np.intc), ('geom2', np.intc),
+    ('begin', np.intc), ('dist', np.float64), ('normal_force', np.float64)],
+    align=True)
+
+# A geom pair in contact: the smallest distance and total normal force of
+# its contacts.
+cdef struct _ContactPair:
+    int geom1
+    int geom2
+    mjtNum dist
+    mjtNum normal_force
+
+cdef struct _ContactRecorder:
+    # Ring buffer of events
+    _ContactEvent* events
+    int capacity
+    int start
+    int count
+    int dropped
+    # Pairs in contact after the previous substep (sorted), and scratch
+    # space for the current ones
+    _ContactPair* pairs
+    _ContactPair* next_pairs
+    int npairs
+    int maxpairs
+
+
+cdef _ContactRecorder* _new_contact_recorder(int capacity, int maxpairs) except NULL:
+    cdef _ContactRecorder* r = <_ContactRecorder*> malloc(sizeof(_ContactRecorder))
+    if r == NULL:
+        raise MemoryError()
+    r.capacity = capacity
+    r.maxpairs = max(maxpairs, 1)
+    r.start = r.count = r.dropped = r.npairs = 0
+    r.events = <_ContactEvent*> malloc(capacity * sizeof(_ContactEvent))
+    r.pairs = <_ContactPair*> malloc(r.maxpairs * sizeof(_ContactPair))
+    r.next_pairs = <_ContactPair*> malloc(r.maxpairs * sizeof(_ContactPair))
+    if r.events == NULL or r.pairs == NULL or r.next_pairs == NULL:
+        _free_contact_recorder(r)
+        raise MemoryError()
+    return r
+
+
+cdef void _free_contact_recorder(_ContactRecorder* r):
+    if r != NULL:
+        free(r.events)
+        free(r.pairs)
+        free(r.next_pairs)
+        free(r)
+
+
+cdef int _compare_pairs(const void* a, const void* b) nogil:
+    cdef const _ContactPair* p = <const _ContactPair*> a
+    cdef const _ContactPair* q = <const _ContactPair*> b
+    if p.geom1 != q.geom1:
+        return -1 if p.geom1 < q.geom1 else 1
+    if p.geom2 != q.geom2:
+        return -1 if p.geom2 < q.geom2 else 1
+    return 0
+
+
+cdef void _push_event(_ContactRecorder* r, mjtNum time, const _ContactPair* pair,
+                      int begin) nogil:
+    # Appends an event, overwriting the oldest one if the buffer is full.
+    cdef _ContactEvent* event
+    if r.count == r.capacity:
+        r.start = (r.start + 1) % r.capacity
+        r.count -= 1
+        r.dropped += 1
+    event = r.events + (r.start + r.count) % r.capacity
+    r.count += 1
+    event.time = time
+    event.geom1 = pair.geom1
+    event.geom2 = pair.geom2
+    event.begin = begin
+    event.dist = pair.dist
+    event.normal_force = pair.normal_force
+
+
+cdef void _record_contacts(const mjModel* m, const mjData* d, mjtNum time,
+                           _ContactRecorder* r) nogil:
+    # Records the events between the previous substep and the contacts of
+    # the one that started at time. End events carry the last values seen.
+    cdef _ContactPair* cur = r.next_pairs
+    cdef _ContactPair* prev = r.pairs
+    cdef const mjContact* con
+    cdef mjtNum force[6]
+    cdef int i, j, n, cmp
+    n = 0
+    for i in range(min(d.ncon, r.maxpairs)):
+        con = d.contact + i
+        cur[n].geom1 = min(con.geom1, con.geom2)
+        cur[n].geom2 = max(con.geom1, con.geom2)
+        cur[n].dist = con.dist
+        cur[n].normal_force = 0
+        if con.efc_address >= 0:
+            mj_contactForce(m, d, i, force)
+            cur[n].normal_force = force[0]
+        n += 1
+    if n > 1:
+        qsort(cur, n, sizeof(_ContactPair), _compare_pairs)
+        # Merge the contacts of each pair.
+        j = 0
+        for i in range(1, n):
+            if _compare_pairs(cur + i, cur + j) == 0:
+                cur[j].dist = min(cur[j].dist, cur[i].dist)
+                cur[j].normal_force += cur[i].normal_force
+            else:
+                j += 1
+                cur[j] = cur[i]
+        n = j + 1
+
+    i = j = 0
+    while i < n or j < r.npairs:
+        if i == n:
+            cmp = 1
+        elif j == r.npairs:
+            cmp = -1
+        else:
+            cmp = _compare_pairs(cur + i, prev + j)
+        if cmp < 0:
+            _push_event(r, time, cur + i, 1)
+            i += 1
+        elif cmp > 0:
+            _push_event(r, time, prev + j, 0)
+            j += 1
+        else:
+            i += 1
+            j += 1
+    r.pairs = cur
+    r.next_pairs = prev
+    r.npairs = n
@@ -0,0 +1,179 @@
+cimport openmp
+
+# Finite-difference derivatives of the dynamics, computed in parallel over
+# the perturbed dimensions on private mjData copies of an MjSim.
+#
+# Columns are ordered as qpos (in tangent space, nv), qvel (nv), act (na),
+# ctrl (nu). Perturbations of qvel only need the velocity and acceleration
+# stages to be recomputed, and perturbations of act and ctrl only the
+# acceleration stage, so mj_forwardSkip skips the rest.
+
+DynamicsDerivatives = namedtuple('DynamicsDerivatives', [
+    'dqacc_dqpos', 'dqacc_dqvel', 'dqacc_dact', 'dqacc_dctrl', 'A', 'B'])
+
+
+cdef int _num_threads(nthreads, int njobs):
+    """ Number of threads to use for ``njobs`` parallel jobs. """
+    cdef int n = openmp.omp_get_max_threads() if nthreads is None else nthreads
+    return max(1, min(n, njobs))
+
+
+cdef void _integrate(const mjModel* m, mjData* d) nogil:
+    # Second half of mj_step, after mj_forward.
+    if m.opt.integrator == mjINT_RK4:
+        mj_RungeKutta(m, d, 4)
+    else:
+        mj_Euler(m, d)
+
+
+cdef void _difference_pos(const mjModel* m, mjtNum* res,
+                          const mjtNum* qpos2, const mjtNum* qpos1) nogil:
+    # Velocity res (nv) that mj_integratePos integrates from qpos1 to qpos2
+    # in unit time.
+    cdef int j, k, padr, vadr
+    cdef mjtNum neg[4]
+    cdef mjtNum dif[4]
+    for j in range(m.njnt):
+        padr = m.jnt_qposadr[j]
+        vadr = m.jnt_dofadr[j]
+        if m.jnt_type[j] == mjJNT_FREE:
+            for k in range(3):
+                res[vadr + k] = qpos2[padr + k] - qpos1[padr + k]
+            padr += 3
+            vadr += 3
+        if m.jnt_type[j] == mjJNT_FREE or m.jnt_type[j] == mjJNT_BALL:
+            mju_negQuat(neg, qpos1 + padr)
+            mju_mulQuat(dif, neg, qpos2 + padr)
+            mju_quat2Vel(res + vadr, dif, 1)
+        else:
+            res[vadr] = qpos2[padr] - qpos1[padr]
+
+
+cdef void _fd_evaluate(const mjModel* m, mjData* d, const mjData* nominal,
+                       int col, mjtNum delta, mjtNum* qacc, mjtNum* next_state,
+                       int* valid_stage, mjtNum* dq) nogil:
+    # Evaluates qacc (and the next state, if next_state isn't NULL) with
+    # column col of the state/control perturbed by delta.
+    # valid_stage tracks up to which stage the results in d belong to the
+    # nominal inputs, so stages can be skipped.
+    cdef int nv = m.nv
+    cdef int na = m.na
+    cdef int skipstage
+    if col < nv:
+        skipstage = mjSTAGE_NONE
+    elif col < 2 * nv:
+        skipstage = mjSTAGE_POS
+    else:
+        skipstage = mjSTAGE_VEL
+
+    d.time = nominal.time
+    memcpy(d.qpos, nominal.qpos, m.nq * sizeof(mjtNum))
+    memcpy(d.qvel, nominal.qvel, nv * sizeof(mjtNum))
+    memcpy(d.act, nominal.act, na * sizeof(mjtNum))
+    memcpy(d.ctrl, nominal.ctrl, m.nu * sizeof(mjtNum))
+    memcpy(d.qacc_warmstart, nominal.qacc_warmstart, nv * sizeof(mjtNum))
+    if valid_stage[0] < skipstage:
+        mj_forwardSkip(m, d, valid_stage[0], 1)
+        valid_stage[0] = mjSTAGE_ACC
+
+    if col < nv:
+        mju_zero(dq, nv)
+        dq[col] = 1
+        mj_integratePos(m, d.qpos, dq, delta)
+    elif col < 2 * nv:
+        d.qvel[col - nv] += delta
+    elif col < 2 * nv + na:
+        d.act[col - 2 * nv] += delta
+    else:
+        d.ctrl[col - 2 * nv - na] += delta
+
+    mj_forwardSkip(m, d, skipstage, 1)
+    valid_stage[0] = skipstage
+    memcpy(qacc, d.qacc, nv * sizeof(mjtNum))
+
+    if next_state != NULL:
+        _integrate(m, d)
+        if m.opt.integrator == mjINT_RK4:
+            # RK4 runs full forward passes at the intermediate states.
+            valid_stage[0] = mjSTAGE_NONE
+        memcpy(next_state, d.qpos, m.nq * sizeof(mjtNum))
+        memcpy(next_state + m.nq, d.qvel, nv * sizeof(mjtNum))
+        memcpy(next_state + m.nq + nv, d.act, na * sizeof(mjtNum))
+
+
+cdef _dynamics_derivatives(MjSim sim, mjtNum eps, bint centered,
+                           bint transition, nthreads):
+    cdef const mjModel* m = sim.model.ptr
+    cdef mjData* d = sim.data.ptr
+    cdef int nq = m.nq, nv = m.nv, na = m.na, nu = m.nu
+    cdef int ncol = 2 * nv + na + nu
+    cdef int nx = 2 * nv + na
+    cdef int nstate = nq + nv + na
+    cdef int col, t, tid
+    cdef int nthread
+    cdef mjData** workers
+    cdef mjtNum[:, ::1] qacc_plus, qacc_minus, next_plus, next_minus, dnext
+    cdef int[::1] valid_stage
+    cdef mjtNum[:, ::1] dq
+    cdef mjtNum* nominal_next
+
+    if nv == 0:
+        raise ValueError("Model has no degrees of freedom")
+    sim.forward()
+    nthread = _num_threads(nthreads, ncol)
+    workers = sim._get_workers(nthread)
+
+    qacc_plus = np.empty((ncol, nv))
+    qacc_minus = np.empty((ncol, nv))
+    next_plus = np.empty((ncol, nstate))
+    next_minus = np.empty((ncol, nstate))
+    valid_stage = np.full(nthread, mjSTAGE_ACC, dtype=np.intc)
+    dq = np.empty((nthread, nv))
+
+    with wrap_mujoco_warning():
+        if not centered:
+            np.asarray(qacc_minus)[:] = sim.data.qacc
+            if transition:
+                mj_copyData(workers[0], m, d)
+                _integrate(m, workers[0])
+                nominal_next = &next_minus[0, 0]
+                memcpy(nominal_next, workers[0].qpos, nq * sizeof(mjtNum))
+                memcpy(nominal_next + nq, workers[0].qvel, nv * sizeof(mjtNum))
+                memcpy(nominal_next + nq + nv, workers[0].act, na * sizeof(mjtNum))
+                np.asarray(next_minus)[1:] = np.asarray(next_minus)[0]
+        with nogil:
+            for t in prange(nthread, schedule='static', num_threads=nthread):
+                mj_copyData(workers[t], m, d)
+            for col in prange(ncol, schedule='static', num_threads=nthread):
+                tid = threadid()
+                _fd_evaluate(m, workers[tid], d, col, eps,
+                             &qacc_plus[col, 0],
+                             &next_plus[col, 0] if transition else NULL,
+                             &valid_stage[tid], &dq[tid, 0])
+                if centered:
+                    _fd_evaluate(m, workers[tid], d, col, -eps,
+                                 &qacc_minus[col, 0],
+                                 &next_minus[col, 0] if transition else NULL,
+                                 &valid_stage[tid], &dq[tid, 0])
+
+    scale = 1 / (2 * eps) if centered else 1 / eps
+    # Rows of the differences are derivatives w.r.t. one column, so the
+    # Jacobians are their transposes.
+    dqacc = ((np.asarray(qacc_plus) - np.asarray(qacc_minus)) * scale).T
+    A = B = None
+    if transition:
+        dnext = np.empty((ncol, nx))
+        for col in range(ncol):
+            _difference_pos(m, &dnext[col, 0], &next_plus[col, 0], &next_minus[col, 0])
+        dnext_arr = np.asarray(dnext)
+        dnext_arr[:, nv:] = (np.asarray(next_plus)[:, nq:] -
+                             np.asarray(next_minus)[:, nq:])
+        dnext_arr = (dnext_arr * scale).T
+        A = np.ascontiguousarray(dnext_arr[:, :nx])
+        B = np.ascontiguousarray(dnext_arr[:, nx:])
+    return DynamicsDerivatives(
+        np.ascontiguousarray(dqacc[:, :nv]),
+        np.ascontiguousarray(dqacc[:, nv:2 * nv]),
+        np.ascontiguousarray(dqacc[:, 2 * nv:nx]),
+        np.ascontiguousarray(dqacc[:, nx:]),
+        A, B)
@@ -0,0 +1,128 @@
+from libc.math cimport fmax, fmin
+
+# Damped least-squares inverse kinematics for sites, iterated in C on the
+# private mjData of an MjSim. See mujoco_py.ik for the Python interface.
+
+
+cdef int _ik_iterate(const mjModel* m, mjData* d, int nsite,
+                     const int* site_ids, const mjtNum* target_pos,
+                     const mjtNum* target_quat, const mjtNum* dof_mask,
+                     mjtNum tol, int max_iter, mjtNum damping,
+                     mjtNum max_step, mjtNum* scratch, mjtNum* error) nogil:
+    # Moves d.qpos towards the targets. target_quat and dof_mask may be
+    # NULL. Returns the number of iterations; the final error norm is
+    # written to error.
+    cdef int per_site = 3 if target_quat == NULL else 6
+    cdef int nrow = nsite * per_site
+    cdef int nv = m.nv
+    cdef mjtNum* J = scratch
+    cdef mjtNum* H = J + nrow * nv
+    cdef mjtNum* e = H + nrow * nrow
+    cdef mjtNum* y = e + nrow
+    cdef mjtNum* dq = y + nrow
+    cdef mjtNum quat[4]
+    cdef mjtNum neg[4]
+    cdef mjtNum dif[4]
+    cdef mjtNum norm
+    cdef int it, s, k, r, j, sid, padr
+    for it in range(max_iter + 1):
+        mj_kinematics(m, d)
+        mj_comPos(m, d)
+        for s in range(nsite):
+            sid = site_ids[s]
+            r = s * per_site
+            for k in range(3):
+                e[r + k] = target_pos[3 * s + k] - d.site_xpos[3 * sid + k]
+            if target_quat != NULL:
+                # Rotation from the current to the target orientation, as
+                # world-frame rotation vector like the rotational Jacobian.
+                mju_mat2Quat(quat, d.site_xmat + 9 * sid)
+                mju_negQuat(neg, quat)
+                mju_mulQuat(dif, target_quat + 4 * s, neg)
+                mju_quat2Vel(e + r + 3, dif, 1)
+                mj_jacSite(m, d, J + r * nv, J + (r + 3) * nv, sid)
+            else:
+                mj_jacSite(m, d, J + r * nv, NULL, sid)
+        error[0] = mju_norm(e, nrow)
+        if error[0] < tol or it == max_iter:
+            break
+
+        if dof_mask != NULL:
+            for r in range(nrow):
+                for j in range(nv):
+                    J[r * nv + j] *= dof_mask[j]
+        # dq = J' (J J' + damping I)^-1 e
+        mju_mulMatMatT(H, J, J, nrow, nv, nrow)
+        for r in range(nrow):
+            H[r * nrow + r] += damping
+        mju_cholFactor(H, nrow, 0)
+        mju_cholSolve(y, H, e, nrow)
+        mju_mulMatTVec(dq, J, y, nrow, nv)
+        norm = mju_norm(dq, nv)
+        if max_step > 0 and norm > max_step:
+            mju_scl(dq, dq, max_step / norm, nv)
+        mj_integratePos(m, d.qpos, dq, 1)
+
+        for j in range(m.njnt):
+            if m.jnt_limited[j] and (m.jnt_type[j] == mjJNT_HINGE or
+                                     m.jnt_type[j] == mjJNT_SLIDE):
+                padr = m.jnt_qposadr[j]
+                d.qpos[padr] = fmax(m.jnt_range[2 * j],
+                                    fmin(m.jnt_range[2 * j + 1], d.qpos[padr]))
+    return it
+
+
+def _ik_solve(MjSim sim, site_ids, target_pos, target_quat, qpos, dof_mask,
+             mjtNum tol, int max_iter, mjtNum damping, mjtNum max_step,
+             nthreads):
+    """
+    Solves the IK problems given by the rows of target_pos (n, nsite, 3),
+    target_quat (n, nsite, 4) or None, starting from and writing to the
+    rows of qpos (n, nq). Returns the errors and numbers of iterations.
+    """
+    cdef const mjModel* m = sim.model.ptr
+    cdef int nq = m.nq, nv = m.nv
+    cdef int[::1] site_ids_view = np.ascontiguousarray(site_ids, dtype=np.intc)
+    cdef int nsite = site_ids_view.shape[0]
+    cdef int nrow = nsite * (3 if target_quat is None else 6)
+    cdef int nscratch = nrow * nv + nrow * nrow + 2 * nrow + nv
+    cdef int n = qpos.shape[0]
+    cdef int i, tid, nthread
+    cdef mjData** workers
+    cdef mjtNum* qpos_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> qpos)
+    cdef mjtNum* pos_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> target_pos)
+    cdef mjtNum* quat_ptr = NULL
+    cdef mjtNum* mask_ptr = NULL
+    cdef mjtNum[:, ::1] scratch
+    cdef mjtNum[::1] error = np.zeros(n)
+    cdef int[::1] iterations = np.zeros(n, dtype=np.intc)
+
+    if nsite == 0 or n == 0:
+        return np.asarray(error), np.asarray(iterations)
+    if target_pos.shape != (n, nsite, 3) or qpos.shape != (n, nq):
+        raise ValueError("target_pos and qpos don't match")
+    if target_quat is not None:
+        if target_quat.shape != (n, nsite, 4):
+            raise ValueError("target_quat doesn't match target_pos")
+        quat_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> target_quat)
+    if dof_mask is not None:
+        mask_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> dof_mask)
+    if np.min(site_ids) < 0 or np.max(site_ids) >= m.nsite:
+        raise ValueError("site ids must be in [0, %d)" % m.nsite)
+
+    nthread = _num_threads(nthreads, n)
+    scratch = np.empty((nthread, nscratch))
+    with wrap_mujoco_warning():
+        workers = _prepare_workers(sim, nthread)
+        with nogil:
+            for i in prange(n, schedule='dynamic', num_threads=nthread):
+                tid = threadid()
+                memcpy(workers[tid].qpos, qpos_ptr + i * nq, nq * sizeof(mjtNum))
+                iterations[i] = _ik_iterate(
+                    m, workers[tid], nsite, &site_ids_view[0],
+                    pos_ptr + i * nsite * 3,
+                    quat_ptr + i * nsite * 4 if quat_ptr != NULL else NULL,
+                    mask_ptr, tol, max_iter, damping, max_step,
+                    &scratch[tid, 0], &error[i])
+                memcpy(qpos_ptr + i * nq, workers[tid].qpos, nq * sizeof(mjtNum))
+    return np.asarray(error), np.asarray(iterations)
@@ -0,0 +1,100 @@
+# Jacobians and velocities of many bodies, geoms or sites at once, written
+# into reusable buffers (see PyMjData.jacobians and PyMjData.velocities).
+
+cdef enum _JacobianPart:
+    JAC_POS = 0,
+    JAC_ROT = 1,
+    JAC_BOTH = 2,
+
+
+cdef dict _JACOBIAN_PARTS = {'pos': JAC_POS, 'rot': JAC_ROT, 'both': JAC_BOTH}
+
+# mjtObj of each kind. Bodies use their frame (xpos), like mj_jacBody.
+cdef dict _VELOCITY_OBJ_TYPES = {
+    'body': mjtObj.mjOBJ_XBODY,
+    'geom': mjtObj.mjOBJ_GEOM,
+    'site': mjtObj.mjOBJ_SITE,
+}
+
+
+cdef np.ndarray _object_ids(PyMjData data, kind, ids):
+    """ Returns ``ids`` (ints or names) of objects of ``kind`` as int array. """
+    if kind not in _VELOCITY_OBJ_TYPES:
+        raise ValueError("kind must be 'body', 'geom' or 'site', got %r" % kind)
+    model = data._model
+    n = getattr(model, 'n' + kind)
+    if ids is None:
+        return np.arange(n, dtype=np.intc)
+    name2id = getattr(model, kind + '_name2id')
+    result = np.array([name2id(i) if isinstance(i, str) else i for i in ids],
+                      dtype=np.intc)
+    if result.size and (result.min() < 0 or result.max() >= n):
+        raise ValueError("%s ids must be in [0, %d)" % (kind, n))
+    return result
+
+
+cdef _jacobians(PyMjData data, kind, ids, part, out):
+    cdef const mjModel* m = data._model.ptr
+    cdef const mjData* d = data.ptr
+    cdef int nv = m.nv
+    cdef int i, n, rows
+    cdef int part_id
+    cdef int objtype
+    cdef int[::1] ids_view
+    cdef mjtNum* out_ptr
+    cdef mjtNum* jac
+    cdef mjtNum* jacp
+    cdef mjtNum* jacr
+
+    if part not in _JACOBIAN_PARTS:
+        raise ValueError("part must be 'pos', 'rot' or 'both', got %r" % part)
+    part_id = _JACOBIAN_PARTS[part]
+    ids_arr = _object_ids(data, kind, ids)
+    ids_view = ids_arr
+    n = ids_arr.shape[0]
+    objtype = _VELOCITY_OBJ_TYPES[kind]
+    rows = 6 if part_id == JAC_BOTH else 3
+    out = _out_array('out', out, (n, rows, nv))
+    if n == 0 or nv == 0:
+        return out
+    out_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> out)
+
+    with nogil:
+        for i in range(n):
+            jac = out_ptr + i * rows * nv
+            # Like mj_objectVelocity, the rotational part comes first.
+            jacp = jac if part_id == JAC_POS else NULL
+            jacr = jac if part_id == JAC_ROT else NULL
+            if part_id == JAC_BOTH:
+                jacp = jac + 3 * nv
+                jacr = jac
+            if objtype == mjtObj.mjOBJ_XBODY:
+                mj_jacBody(m, d, jacp, jacr, ids_view[i])
+            elif objtype == mjtObj.mjOBJ_GEOM:
+                mj_jacGeom(m, d, jacp, jacr, ids_view[i])
+            else:
+                mj_jacSite(m, d, jacp, jacr, ids_view[i])
+    return out
+
+
+cdef _velocities(PyMjData data, kind, ids, bint local, out):
+    cdef const mjModel* m = data._model.ptr
+    cdef const mjData* d = data.ptr
+    cdef int i, n
+    cdef int objtype
+    cdef int[::1] ids_view
+    cdef mjtNum* out_ptr
+
+    ids_arr = _object_ids(data, kind, ids)
+    ids_view = ids_arr
+    n = ids_arr.shape[0]
+    objtype = _VELOCITY_OBJ_TYPES[kind]
+    out = _out_array('out', out, (n, 6))
+    if n == 0:
+        return out
+    out_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> out)
+
+    with nogil:
+        for i in range(n):
+            mj_objectVelocity(m, d, objtype, ids_view[i], out_ptr + 6 * i, local)
+    return out
@@ -0,0 +1,103 @@
+import pickle
+from cpython.buffer cimport PyBuffer_FillInfo
+
+# Pickle helpers for PyMjModel, PyMjData and MjSim.
+#
+# With pickle protocol 5 the large payloads (the MJB of the model and the
+# main mjData buffer) are wrapped in ``pickle.PickleBuffer``, so they can be
+# sent out-of-band without extra copies. The reconstructors are module-level
+# functions of cymj, so unpickling requires ``mujoco_py`` to be imported.
+
+
+cdef class _RawBuffer(object):
+    """
+    Exposes a raw block of memory through the buffer protocol, while keeping
+    the object that owns the memory alive.
+    """
+    cdef object owner
+    cdef char* ptr
+    cdef Py_ssize_t size
+
+    def __cinit__(self, owner, uintptr_t ptr, Py_ssize_t size):
+        self.owner = owner
+        self.ptr = <char*>ptr
+        self.size = size
+
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        PyBuffer_FillInfo(buffer, self, self.ptr, self.size, 0, flags)
+
+    def __releasebuffer__(self, Py_buffer *buffer):
+        pass
+
+
+cdef _pickle_buffer(buf, int protocol):
+    """ Wraps ``buf`` for out-of-band pickling where the protocol allows it. """
+    if protocol >= 5 and hasattr(pickle, 'PickleBuffer'):
+        return pickle.PickleBuffer(buf)
+    return bytes(memoryview(buf))
+
+
+cdef size_t _mjdata_header_size(mjData* d):
+    # The info header (sizes, diagnostics, time) precedes the pointer fields.
+    return <char*>&d.buffer - <char*>d
+
+
+cdef _reduce_model(PyMjModel model, int protocol):
+    return (_unpickle_model,
+            (_pickle_buffer(model.get_mjb(), protocol), model.userdata_names))
+
+
+def _unpickle_model(mjb, userdata_names):
+    model = load_model_from_mjb(mjb)
+    if userdata_names:
+        model.set_userdata_names(userdata_names)
+    return model
+
+
+cdef _reduce_data(PyMjData data, int protocol):
+    cdef mjData* d = data.ptr
+    header = PyBytes_FromStringAndSize(<char*>d, _mjdata_header_size(d))
+    buf = _RawBuffer(data, <uintptr_t>d.buffer, d.nbuffer)
+    return (_unpickle_data, (data._model, header, _pickle_buffer(buf, protocol)))
+
+
+def _unpickle_data(PyMjModel model, header, buf):
+    cdef const unsigned char[::1] header_view = header
+    cdef const unsigned char[::1] buf_view = buf
+    cdef mjData* d
+    with wrap_mujoco_warning():
+        d = mj_makeData(model.ptr)
+    if d == NULL:
+        raise Exception('mj_makeData failed!')
+    if (header_view.shape[0] != _mjdata_header_size(d) or
+            buf_view.shape[0] != d.nbuffer):
+        mj_deleteData(d)
+        raise ValueError('Pickled data does not match the model')
+    # Sizes in the header are identical for the same model, and the buffer
+    # contains no pointers, so a plain copy restores the exact state.
+    memcpy(d, &header_view[0], header_view.shape[0])
+    memcpy(d.buffer, &buf_view[0], buf_view.shape[0])
+    return WrapMjData(d, model)
+
+
+def _unpickle_sim(model, data, nsubsteps, udd_callback, udd_state,
+                  substep_callback_src, render_callback, extras,
+                  reward_callback_src=None, udd_schema=None,
+                  udd_callback_src=None, substep_callbacks=()):
+    cdef MjSim sim = MjSim(model, data=data, nsubsteps=nsubsteps,
+                           substep_callback=substep_callback_src,
+                           render_callback=render_callback,
+                           reward_callback=reward_callback_src)
+    if udd_schema is not None:
+        sim.set_udd_schema(dict(udd_schema), udd_callback_src)
+        sim._set_udd_state(udd_state, True)
+    else:
+        # Set the callback directly, since the setter would run it and
+        # overwrite the pickled udd_state.
+        sim._udd_callback = udd_callback
+        sim.udd_state = udd_state
+    for name, stage, src, enabled in substep_callbacks:
+        sim.add_substep_callback(src, stage, name)
+        sim.enable_substep_callback(name, enabled)
+    sim.extras.update(extras)
+    return sim
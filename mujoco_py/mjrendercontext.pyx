@@ -137,6 +137,9 @@ cdef class MjRenderContext(object):
         if self.sim.render_callback is not None:
             self.sim.render_callback(self.sim, self)
 
+        if self.sim.auto_forward:
+            self.sim.forward(if_dirty=True)
+
         # Sometimes buffers are too small.
         if width > self._con.offWidth or height > self._con.offHeight:
             new_width = max(width, self._model_ptr.vis.global_.offwidth)
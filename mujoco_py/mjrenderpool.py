@@ -57,7 +57,8 @@ class MjRenderPool:
                 "device_ids must be list of integer")
 
         n_workers = n_workers or 1
-        self._max_batch_size = max_batch_size or (len(device_ids) * n_workers)
+        self._n_processes = len(device_ids) * n_workers
+        self._max_batch_size = max_batch_size or self._n_processes
         self._max_image_size = max_image_size
 
         array_size = self._max_image_size * self._max_batch_size
@@ -91,7 +92,7 @@ class MjRenderPool:
                 "    mp.set_start_method('spawn')\n")
 
         self.pool = Pool(
-            processes=len(device_ids) * n_workers,
+            processes=self._n_processes,
             initializer=MjRenderPool._worker_init,
             initargs=(
                 model.get_mjb(),
@@ -144,15 +145,12 @@ class MjRenderPool:
         """
         s = _render_pool_storage
 
-        forward = False
         if state is not None:
             s.sim.set_state(state)
-            forward = True
         if randomize and s.modder is not None:
             s.modder.randomize()
-            forward = True
-        if forward:
-            s.sim.forward()
+            s.sim.mark_dirty()
+        s.sim.forward(if_dirty=True)
 
         rgb_block = width * height * 3
         rgb_offset = rgb_block * worker_id
@@ -168,6 +166,17 @@ class MjRenderPool:
             width, height, camera_name=camera_name, depth=True,
             device_id=s.device_id)
 
+    @staticmethod
+    def _worker_render_batch(offset, states, width, height,
+                             camera_name, randomize):
+        """
+        Renders a slice of an MjSimStateBatch, received as a single
+        buffer, into the image slots starting at ``offset``.
+        """
+        for i in range(len(states)):
+            MjRenderPool._worker_render(offset + i, states[i], width, height,
+                                        camera_name, randomize)
+
     def render(self, width, height, states=None, camera_name=None,
                depth=False, randomize=False, copy=True):
         """
@@ -177,8 +186,10 @@ class MjRenderPool:
         Args:
         - width (int): width of image to render.
         - height (int): height of image to render.
-        - states (list): list of MjSimStates; updates the states before
-            rendering. Batch size will be number of states supplied.
+        - states (list): list of MjSimStates, or an MjSimStateBatch;
+            updates the states before rendering. Batch size will be number
+            of states supplied. A batch is sent to the workers as one
+            contiguous slice each rather than state by state.
         - camera_name (str): name of camera to render from.
         - depth (bool): if True, also return depth.
         - randomize (bool): calls modder.rand_all() before rendering.
@@ -208,10 +219,21 @@ class MjRenderPool:
                 "Requested batch size larger than max batch size. Create "
                 "a new RenderPool with a larger max batch size.")
 
-        self.pool.starmap(
-            MjRenderPool._worker_render,
-            [(i, state, width, height, camera_name, randomize)
-             for i, state in enumerate(states)])
+        # avoid a circular import
+        from mujoco_py import MjSimStateBatch
+        if isinstance(states, MjSimStateBatch):
+            n_slices = min(self._n_processes, batch_size)
+            bounds = np.linspace(0, batch_size, n_slices + 1).astype(int)
+            self.pool.starmap(
+                MjRenderPool._worker_render_batch,
+                [(start, states[start:stop], width, height, camera_name,
+                  randomize)
+                 for start, stop in zip(bounds[:-1], bounds[1:])])
+        else:
+            self.pool.starmap(
+                MjRenderPool._worker_render,
+                [(i, state, width, height, camera_name, randomize)
+                 for i, state in enumerate(states)])
 
         rgbs = self._shared_rgbs_array[:width * height * 3 * batch_size]
         rgbs = rgbs.reshape(batch_size, height, width, 3)
@@ -0,0 +1,265 @@
+from libc.math cimport cos, exp, fmax, fmin, log, sqrt, M_PI
+
+# Parallel open-loop rollouts on the private mjData of an MjSim, scored by a
+# compiled C function with the signature of reward callbacks (reward_fn_t):
+# the value of the state goes to out[0], and a non-zero out[1] ends the
+# rollout. MjSim.rollout and the MPPI update (see mujoco_py.planning) are
+# built on them.
+
+
+cdef inline unsigned long long _splitmix64(unsigned long long* state) nogil:
+    state[0] += 0x9E3779B97F4A7C15ULL
+    cdef unsigned long long z = state[0]
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL
+    return z ^ (z >> 31)
+
+
+cdef inline mjtNum _randn(unsigned long long* state) nogil:
+    # Box-Muller transform of two uniforms in (0, 1].
+    cdef mjtNum u1 = ((_splitmix64(state) >> 11) + 1) * (1.0 / 9007199254740992.0)
+    cdef mjtNum u2 = (_splitmix64(state) >> 11) * (1.0 / 9007199254740992.0)
+    return sqrt(-2 * log(u1)) * cos(2 * M_PI * u2)
+
+
+cdef void _restore_state(const mjModel* m, mjData* dst, const mjData* src) nogil:
+    # Copies the state and the inputs that mj_step or callbacks may change,
+    # so that a rollout doesn't depend on the previous one of the same
+    # worker. Everything else stays as it was copied by _prepare_workers.
+    dst.time = src.time
+    memcpy(dst.qpos, src.qpos, m.nq * sizeof(mjtNum))
+    memcpy(dst.qvel, src.qvel, m.nv * sizeof(mjtNum))
+    memcpy(dst.act, src.act, m.na * sizeof(mjtNum))
+    memcpy(dst.qacc_warmstart, src.qacc_warmstart, m.nv * sizeof(mjtNum))
+    memcpy(dst.userdata, src.userdata, m.nuserdata * sizeof(mjtNum))
+    memcpy(dst.ctrl, src.ctrl, m.nu * sizeof(mjtNum))
+    memcpy(dst.qfrc_applied, src.qfrc_applied, m.nv * sizeof(mjtNum))
+    memcpy(dst.xfrc_applied, src.xfrc_applied, 6 * m.nbody * sizeof(mjtNum))
+    memcpy(dst.mocap_pos, src.mocap_pos, 3 * m.nmocap * sizeof(mjtNum))
+    memcpy(dst.mocap_quat, src.mocap_quat, 4 * m.nmocap * sizeof(mjtNum))
+
+
+cdef int _rollout(const mjModel* m, mjData* w, const mjData* d,
+                  const mjtNum* ctrls, int horizon, int nsubsteps,
+                  const _SubstepPipeline* pipeline, reward_fn_t fn,
+                  mjtNum* out, mjtNum* values, mjtNum* total) nogil:
+    # Rolls out ctrls (horizon, nu) on w from the state of d, evaluating fn
+    # after every control step. Writes the values to values (horizon,),
+    # zero-filled after the end, and their sum to total; either may be NULL.
+    # In total, an ended rollout is charged its last value for the rest of
+    # the horizon, so that ending early doesn't make a rollout cheaper.
+    # Returns the number of steps taken.
+    cdef int nu = m.nu
+    cdef int t, s
+    cdef int steps = 0
+    cdef mjtNum value_sum = 0
+    _restore_state(m, w, d)
+    if values != NULL:
+        mju_zero(values, horizon)
+    for t in range(horizon):
+        memcpy(w.ctrl, ctrls + t * nu, nu * sizeof(mjtNum))
+        for s in range(nsubsteps):
+            _substep(m, w, pipeline)
+        out[0] = 0
+        out[1] = 0
+        fn(m, w, out)
+        steps += 1
+        value_sum += out[0]
+        if values != NULL:
+            values[t] = out[0]
+        if out[1] != 0:
+            value_sum += out[0] * (horizon - steps)
+            break
+    if total != NULL:
+        total[0] = value_sum
+    return steps
+
+
+cdef void _track_worker_sizes(MjSim sim, mjData** workers, int nthread):
+    # Rollouts count towards the size calibration of sim.
+    cdef int t
+    if sim._calibrating:
+        for t in range(nthread):
+            sim._update_size_peaks(workers[t])
+
+
+cdef _check_ctrls(name, array, int nu):
+    if (not isinstance(array, np.ndarray) or array.dtype != np.float64 or
+            array.ndim != 3 or array.shape[2] != nu or
+            not array.flags['C_CONTIGUOUS']):
+        raise ValueError("%s must be a C-contiguous float64 array of "
+                         "shape (n, horizon, %d)" % (name, nu))
+
+
+def _rollout_costs(MjSim sim, uintptr_t cost_fn, ctrls, costs=None,
+                   nthreads=None):
+    """
+    Rolls out every control sequence in ``ctrls`` (n, horizon, nu) from the
+    current state of ``sim`` and returns their summed costs (n,). Each
+    control is applied for the ``nsubsteps`` of one :meth:`MjSim.step`,
+    calling the substep callbacks of ``sim`` like it. Rollouts whose cost
+    function sets ``out[1]`` end early, and their last cost is charged for
+    the remaining steps.
+    """
+    cdef const mjModel* m = sim.model.ptr
+    cdef const mjData* d = sim.data.ptr
+    cdef int nu = m.nu
+    cdef int nsubsteps = sim.nsubsteps
+    cdef _SubstepPipeline pipeline = sim._substeps
+    cdef int n, horizon, i, tid, nthread
+    cdef mjData** workers
+    cdef mjtNum* ctrls_ptr
+    cdef mjtNum* costs_ptr
+    cdef mjtNum[:, ::1] scratch
+
+    if not cost_fn:
+        raise ValueError("cost_fn must be a function pointer")
+    _check_ctrls('ctrls', ctrls, nu)
+    n, horizon = ctrls.shape[0], ctrls.shape[1]
+    costs = _out_array('costs', costs, (n,))
+    if n == 0:
+        return costs
+    ctrls_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> ctrls)
+    costs_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> costs)
+
+    # The contact events of sim aren't recorded in rollouts.
+    pipeline.recorder = NULL
+    nthread = _num_threads(nthreads, n)
+    scratch = np.zeros((nthread, 2))
+    with wrap_mujoco_warning():
+        workers = _prepare_workers(sim, nthread)
+        with nogil:
+            for i in prange(n, schedule='dynamic', num_threads=nthread):
+                tid = threadid()
+                _rollout(m, workers[tid], d, ctrls_ptr + i * horizon * nu,
+                         horizon, nsubsteps, &pipeline, <reward_fn_t> cost_fn,
+                         &scratch[tid, 0], NULL, costs_ptr + i)
+        _track_worker_sizes(sim, workers, nthread)
+    return costs
+
+
+cdef _rollout_rewards(MjSim sim, ctrls, nthreads):
+    # See MjSim.rollout.
+    cdef const mjModel* m = sim.model.ptr
+    cdef const mjData* d = sim.data.ptr
+    cdef int nu = m.nu
+    cdef int nsubsteps = sim.nsubsteps
+    cdef _SubstepPipeline pipeline = sim._substeps
+    cdef uintptr_t reward_fn = sim.reward_callback_ptr
+    cdef int n, horizon, i, tid, nthread
+    cdef mjData** workers
+    cdef mjtNum* ctrls_ptr
+    cdef mjtNum* rewards_ptr
+    cdef int[::1] lengths
+    cdef mjtNum[:, ::1] scratch
+
+    _check_ctrls('ctrls', ctrls, nu)
+    n, horizon = ctrls.shape[0], ctrls.shape[1]
+    rewards = np.zeros((n, horizon))
+    lengths = np.zeros(n, dtype=np.intc)
+    if n == 0 or horizon == 0:
+        return rewards, np.asarray(lengths)
+    ctrls_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> ctrls)
+    rewards_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> rewards)
+
+    # The contact events of sim aren't recorded in rollouts.
+    pipeline.recorder = NULL
+    nthread = _num_threads(nthreads, n)
+    scratch = np.zeros((nthread, 2))
+    with wrap_mujoco_warning():
+        workers = _prepare_workers(sim, nthread)
+        with nogil:
+            for i in prange(n, schedule='dynamic', num_threads=nthread):
+                tid = threadid()
+                lengths[i] = _rollout(
+                    m, workers[tid], d, ctrls_ptr + i * horizon * nu, horizon,
+                    nsubsteps, &pipeline, <reward_fn_t> reward_fn,
+                    &scratch[tid, 0], rewards_ptr + i * horizon, NULL)
+        _track_worker_sizes(sim, workers, nthread)
+    return rewards, np.asarray(lengths)
+
+
+def _mppi_update(MjSim sim, uintptr_t cost_fn, nominal, samples, costs,
+                 mjtNum[::1] noise_sigma, mjtNum[::1] ctrl_low,
+                 mjtNum[::1] ctrl_high, mjtNum temperature,
+                 unsigned long long seed, nthreads=None):
+    """
+    One MPPI iteration from the current state of ``sim``.
+
+    Fills ``samples`` (n, horizon, nu) with ``nominal`` (horizon, nu) plus
+    Gaussian noise, clipped to the control range, rolls them out into
+    ``costs`` (n,) and replaces ``nominal`` with the average of the samples
+    weighted by ``exp(-(cost - min cost) / temperature)``. The first sample
+    is the nominal sequence without noise. Noise is drawn from a stream per
+    sample, so the result only depends on ``seed``, not on the threads.
+    Rollouts whose cost function sets ``out[1]`` end early, and their last
+    cost is charged for the remaining steps.
+    """
+    cdef const mjModel* m = sim.model.ptr
+    cdef const mjData* d = sim.data.ptr
+    cdef int nu = m.nu
+    cdef int nsubsteps = sim.nsubsteps
+    cdef _SubstepPipeline pipeline = sim._substeps
+    cdef int n, horizon, size, i, j, k, tid, nthread
+    cdef unsigned long long state
+    cdef mjData** workers
+    cdef mjtNum* nominal_ptr
+    cdef mjtNum* samples_ptr
+    cdef mjtNum* costs_ptr
+    cdef mjtNum* sample
+    cdef mjtNum[:, ::1] scratch
+    cdef mjtNum value, min_cost, weight, total_weight
+
+    if not cost_fn:
+        raise ValueError("cost_fn must be a function pointer")
+    if temperature <= 0:
+        raise ValueError("temperature must be positive")
+    _check_ctrls('samples', samples, nu)
+    n, horizon = samples.shape[0], samples.shape[1]
+    size = horizon * nu
+    nominal = _out_array('nominal', nominal, (horizon, nu))
+    costs = _out_array('costs', costs, (n,))
+    for name, array in (('noise_sigma', noise_sigma), ('ctrl_low', ctrl_low),
+                        ('ctrl_high', ctrl_high)):
+        if array.shape[0] != nu:
+            raise ValueError("%s must have length %d" % (name, nu))
+    if n == 0 or size == 0:
+        return costs
+    nominal_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> nominal)
+    samples_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> samples)
+    costs_ptr = <mjtNum*> np.PyArray_DATA(<np.ndarray> costs)
+
+    # The contact events of sim aren't recorded in rollouts.
+    pipeline.recorder = NULL
+    nthread = _num_threads(nthreads, n)
+    scratch = np.zeros((nthread, 2))
+    with wrap_mujoco_warning():
+        workers = _prepare_workers(sim, nthread)
+        with nogil:
+            for i in prange(n, schedule='dynamic', num_threads=nthread):
+                tid = threadid()
+                sample = samples_ptr + i * size
+                state = seed ^ (0xD1B54A32D192ED03ULL * <unsigned long long> (i + 1))
+                for j in range(size):
+                    k = j % nu
+                    value = nominal_ptr[j]
+                    if i > 0:
+                        value = value + noise_sigma[k] * _randn(&state)
+                    sample[j] = fmax(ctrl_low[k], fmin(ctrl_high[k], value))
+                _rollout(m, workers[tid], d, sample, horizon, nsubsteps,
+                         &pipeline, <reward_fn_t> cost_fn, &scratch[tid, 0],
+                         NULL, costs_ptr + i)
+        _track_worker_sizes(sim, workers, nthread)
+
+    with nogil:
+        min_cost = costs_ptr[0]
+        for i in range(1, n):
+            min_cost = fmin(min_cost, costs_ptr[i])
+        mju_zero(nominal_ptr, size)
+        total_weight = 0
+        for i in range(n):
+            weight = exp(-(costs_ptr[i] - min_cost) / temperature)
+            total_weight += weight
+            mju_addToScl(nominal_ptr, samples_ptr + i * size, weight, size)
+        mju_scl(nominal_ptr, nominal_ptr, 1 / total_weight, size)
+    return costs
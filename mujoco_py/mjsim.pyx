@@ -6,6 +6,60 @@ from threading import Lock
 _MjSim_render_lock = Lock()
 
 ctypedef void (*substep_udd_t)(const mjModel* m, mjData* d)
+# substep_udd_t, callable without the GIL like any compiled callback.
+ctypedef void (*substep_fn_t)(const mjModel* m, mjData* d) nogil
+# Compiled reward (or cost) function, see MjSim.set_reward_callback.
+ctypedef void (*reward_fn_t)(const mjModel* m, const mjData* d, mjtNum* out) nogil
+# Compiled update of a typed udd_state, see MjSim.set_udd_schema.
+ctypedef void (*udd_fn_t)(const mjModel* m, const mjData* d, mjtNum* udd) nogil
+
+# Number of mjData input arrays compared by the dirty tracking of MjSim.
+cdef enum:
+    N_FORWARD_INPUTS = 9
+
+# Stages of a substep at which callbacks run, see MjSim.add_substep_callback.
+cdef enum:
+    SUBSTEP_PRE = 0
+    SUBSTEP_BETWEEN = 1
+    SUBSTEP_POST = 2
+    N_SUBSTEP_STAGES = 3
+
+cdef dict _SUBSTEP_STAGES = {'pre': SUBSTEP_PRE,
+                             'between_step1_step2': SUBSTEP_BETWEEN,
+                             'post': SUBSTEP_POST}
+
+# Enabled substep callbacks: fns holds count[SUBSTEP_PRE] functions of the
+# first stage, then those of the second and third. Contact events are
+# recorded before the post stage if recorder isn't NULL.
+cdef struct _SubstepPipeline:
+    int count[N_SUBSTEP_STAGES]
+    substep_fn_t* fns
+    _ContactRecorder* recorder
+
+
+cdef void _substep(const mjModel* m, mjData* d,
+                   const _SubstepPipeline* pipeline) nogil:
+    # One mj_step with the callbacks of the pipeline. mj_step1 and mj_step2
+    # are only used if there are callbacks between them.
+    cdef const substep_fn_t* fn = pipeline.fns
+    cdef mjtNum time = d.time
+    cdef int i
+    for i in range(pipeline.count[SUBSTEP_PRE]):
+        fn[0](m, d)
+        fn += 1
+    if pipeline.count[SUBSTEP_BETWEEN]:
+        mj_step1(m, d)
+        for i in range(pipeline.count[SUBSTEP_BETWEEN]):
+            fn[0](m, d)
+            fn += 1
+        mj_step2(m, d)
+    else:
+        mj_step(m, d)
+    if pipeline.recorder != NULL:
+        _record_contacts(m, d, time, pipeline.recorder)
+    for i in range(pipeline.count[SUBSTEP_POST]):
+        fn[0](m, d)
+        fn += 1
 
 
 cdef class MjSim(object):
@@ -29,7 +83,8 @@ cdef class MjSim(object):
         current user-defined dynamics state in ``sim.udd_state``, and returns the
         next ``udd_state`` after applying the user-defined dynamics. This is
         useful e.g. for reward functions that operate over functions of historical
-        state.
+        state. See :meth:`.set_udd_schema` for a typed ``udd_state`` in a flat
+        buffer, optionally updated by a compiled C function instead.
     substep_callback : str or int or None
         This uses a compiled C function as user-defined dynamics in substeps.
         If given as a string, it's compiled as a C function and set as pointer.
@@ -39,6 +94,26 @@ cdef class MjSim(object):
         This is a convenience parameter which is just set on the model.
         Equivalent to calling ``model.set_userdata_names``
     render_callback : callback for rendering.
+    reward_callback : str or int or None
+        Compiled C function evaluated after every :meth:`.step` and in
+        :meth:`.rollout`. See :meth:`.set_reward_callback` for detailed info.
+
+    Substep callbacks
+    -----------------
+    Besides ``substep_callback``, any number of compiled callbacks can run
+    before, after, or between ``mj_step1`` and ``mj_step2`` of every substep,
+    see :meth:`.add_substep_callback`. All of them are called from C, and
+    the substeps of :meth:`.step` run without the GIL.
+
+    Dirty tracking
+    --------------
+    The inputs of ``mj_forward`` (``qpos``, ``qvel``, ``act``, ``ctrl``,
+    ``qfrc_applied``, ``xfrc_applied``, ``mocap_pos``, ``mocap_quat``,
+    ``userdata`` and ``model.opt``) are copied after every :meth:`.forward`.
+    :attr:`.dirty` compares them with a ``memcmp``, so ``forward(if_dirty=True)``
+    skips the computation if nothing was written since. Other changes to the
+    model, or calls into ``functions.*`` that modify the data, aren't
+    detected; call :meth:`.mark_dirty` after them.
     """
     # MjRenderContext for rendering camera views.
     cdef readonly list render_contexts
@@ -58,16 +133,55 @@ cdef class MjSim(object):
     cdef public dict udd_state
     # User defined dynamics callback
     cdef readonly object _udd_callback
+    # Typed udd_state: flat storage, (name, shape) of its entries in sorted
+    # order, and function pointer and C source of its update function
+    cdef readonly object udd_buffer
+    cdef readonly tuple udd_schema
+    cdef readonly uintptr_t udd_callback_ptr
+    cdef readonly str udd_callback_src
     # Allows to store extra information in MjSim.
     cdef readonly dict extras
     # Function pointer for substep callback, stored as uintptr
     cdef readonly uintptr_t substep_callback_ptr
+    # C source of the substep callback, if it was compiled from a string
+    cdef readonly str substep_callback_src
+    # Named substep callbacks as [name, stage, ptr, src, enabled] lists, and
+    # the pipeline of the enabled ones (after substep_callback_ptr)
+    cdef list _substep_callbacks
+    cdef _SubstepPipeline _substeps
+    # Contact events of the last step, see enable_contact_events
+    cdef readonly object contact_events
+    cdef readonly int contact_events_dropped
+    cdef object _contact_event_buffer
+    # Peak buffer usage, tracked after start_size_calibration
+    cdef bint _calibrating
+    cdef int _peak_efc
+    cdef int _peak_con
+    cdef int _peak_stack
+    # Function pointer and C source of the reward callback, like above
+    cdef readonly uintptr_t reward_callback_ptr
+    cdef readonly str reward_callback_src
+    # Reward and termination flag from the reward callback after the last step
+    cdef readonly mjtNum reward
+    cdef readonly bint done
     # Callback executed before rendering.
     cdef public object render_callback
+    # Fully forwarded copy of the data restored by fast_reset
+    cdef mjData* _reset_snapshot
+    cdef dict _reset_udd_state
+    # Copy of the forward inputs as of the last forward(), see `dirty`
+    cdef mjtNum* _forward_inputs
+    cdef mjOption _forward_opt
+    cdef bint _forward_clean
+    # If True, rendering calls forward(if_dirty=True) first
+    cdef public bint auto_forward
+    # Private mjData of the model for parallel computations
+    cdef mjData** _workers
+    cdef int _nworkers
 
     def __cinit__(self, PyMjModel model, PyMjData data=None, int nsubsteps=1,
                   udd_callback=None, substep_callback=None, userdata_names=None,
-                  render_callback=None):
+                  render_callback=None, reward_callback=None):
         self.nsubsteps = nsubsteps
         self.model = model
         if data is None:
@@ -83,27 +197,266 @@ cdef class MjSim(object):
         self._render_context_offscreen = None
         self._render_context_window = None
         self.udd_state = None
+        self.udd_buffer = None
+        self.udd_schema = None
+        self.udd_callback_ptr = 0
+        self.udd_callback_src = None
         self.udd_callback = udd_callback
         self.render_callback = render_callback
         self.extras = {}
+        self._reset_snapshot = NULL
+        self._reset_udd_state = None
+        self._forward_inputs = <mjtNum*> malloc(
+            max(self._forward_input_size(), 1) * sizeof(mjtNum))
+        if self._forward_inputs == NULL:
+            raise MemoryError()
+        self._forward_clean = False
+        self.auto_forward = False
+        self._workers = NULL
+        self._nworkers = 0
+        self._substep_callbacks = []
+        self._substeps.fns = NULL
+        self._substeps.recorder = NULL
+        self.contact_events = None
+        self.contact_events_dropped = 0
+        self._contact_event_buffer = None
+        self._calibrating = False
+        self._peak_efc = self._peak_con = self._peak_stack = 0
         self.set_substep_callback(substep_callback, userdata_names)
+        self.set_reward_callback(reward_callback)
+
+    def __dealloc__(self):
+        cdef int i
+        if self._reset_snapshot != NULL:
+            mj_deleteData(self._reset_snapshot)
+        free(self._forward_inputs)
+        for i in range(self._nworkers):
+            mj_deleteData(self._workers[i])
+        free(self._workers)
+        free(self._substeps.fns)
+        _free_contact_recorder(self._substeps.recorder)
+
+    cdef mjData** _get_workers(self, int n) except NULL:
+        # Returns (at least) n private mjData, allocated on first use and
+        # kept for later calls. Their contents are undefined.
+        cdef mjData** workers
+        if n > self._nworkers:
+            workers = <mjData**> realloc(self._workers, n * sizeof(mjData*))
+            if workers == NULL:
+                raise MemoryError()
+            self._workers = workers
+            while self._nworkers < n:
+                with wrap_mujoco_warning():
+                    workers[self._nworkers] = mj_makeData(self.model.ptr)
+                if workers[self._nworkers] == NULL:
+                    raise Exception('mj_makeData failed!')
+                self._nworkers += 1
+        return self._workers
+
+    cdef int _forward_input_size(self):
+        cdef mjModel* m = self.model.ptr
+        return (m.nq + 2 * m.nv + m.na + m.nu + 6 * m.nbody +
+                7 * m.nmocap + m.nuserdata)
+
+    cdef bint _sync_forward_inputs(self, bint compare):
+        # Compares (or, if not compare, saves) the forward inputs.
+        # Returns True if any of them differs from the saved copy.
+        cdef mjModel* m = self.model.ptr
+        cdef mjData* d = self.data.ptr
+        cdef mjtNum* arrays[N_FORWARD_INPUTS]
+        cdef int sizes[N_FORWARD_INPUTS]
+        cdef mjtNum* saved = self._forward_inputs
+        cdef size_t nbytes
+        cdef int k
+        arrays[0] = d.qpos; sizes[0] = m.nq
+        arrays[1] = d.qvel; sizes[1] = m.nv
+        arrays[2] = d.act; sizes[2] = m.na
+        arrays[3] = d.ctrl; sizes[3] = m.nu
+        arrays[4] = d.qfrc_applied; sizes[4] = m.nv
+        arrays[5] = d.xfrc_applied; sizes[5] = 6 * m.nbody
+        arrays[6] = d.mocap_pos; sizes[6] = 3 * m.nmocap
+        arrays[7] = d.mocap_quat; sizes[7] = 4 * m.nmocap
+        arrays[8] = d.userdata; sizes[8] = m.nuserdata
+        for k in range(N_FORWARD_INPUTS):
+            nbytes = sizes[k] * sizeof(mjtNum)
+            if compare:
+                if memcmp(saved, arrays[k], nbytes) != 0:
+                    return True
+            else:
+                memcpy(saved, arrays[k], nbytes)
+            saved += sizes[k]
+        if compare:
+            return memcmp(&self._forward_opt, &m.opt, sizeof(mjOption)) != 0
+        memcpy(&self._forward_opt, &m.opt, sizeof(mjOption))
+        return False
+
+    cdef void _mark_forwarded(self):
+        self._sync_forward_inputs(False)
+        self._forward_clean = True
+
+    @property
+    def dirty(self):
+        """
+        True if :meth:`.forward` hasn't been called since the last
+        :meth:`.step`, :meth:`.reset` or :meth:`.mark_dirty`, or if any
+        forward input in ``sim.data`` or ``model.opt`` was written since.
+        Other model parameters aren't compared.
+        """
+        return not self._forward_clean or self._sync_forward_inputs(True)
+
+    def mark_dirty(self):
+        """
+        Makes the next ``forward(if_dirty=True)`` run, e.g. after changing
+        model parameters that dirty tracking doesn't compare.
+        """
+        self._forward_clean = False
 
     def reset(self):
         """
         Resets the simulation data and clears buffers.
         """
+        if self._calibrating:
+            self._update_size_peaks(self.data.ptr)
         with wrap_mujoco_warning():
             mj_resetData(self.model.ptr, self.data.ptr)
 
-        self.udd_state = None
-        self.step_udd()
+        self._forward_clean = False
+        self.reward = 0
+        self.done = False
+        self._clear_contact_events()
+        if self.udd_buffer is not None:
+            self.udd_buffer[:] = 0
+        else:
+            self.udd_state = None
+            self.step_udd()
+
+    def set_reset_snapshot(self):
+        """
+        Captures the current state as the target of :meth:`fast_reset`.
 
-    def forward(self):
+        ``forward()`` is called first, so the snapshot includes consistent
+        derived quantities (kinematics, contacts, sensors). Set up the
+        initial pose, controls etc. before calling this. Take a new snapshot
+        if the model is modified afterwards.
+        """
+        self.forward()
+        if self._reset_snapshot == NULL:
+            with wrap_mujoco_warning():
+                self._reset_snapshot = mj_makeData(self.model.ptr)
+            if self._reset_snapshot == NULL:
+                raise Exception('mj_makeData failed!')
+        mj_copyData(self._reset_snapshot, self.model.ptr, self.data.ptr)
+        self._reset_udd_state = deepcopy(self.udd_state)
+
+    def fast_reset(self):
+        """
+        Restores the snapshot taken by :meth:`set_reset_snapshot`.
+
+        Unlike :meth:`reset`, this copies the whole forwarded ``mjData``
+        back with ``mj_copyData``, so no ``forward()`` is needed afterwards.
+        """
+        if self._reset_snapshot == NULL:
+            raise RuntimeError("No reset snapshot, call set_reset_snapshot() first")
+        if self._calibrating:
+            self._update_size_peaks(self.data.ptr)
+        mj_copyData(self.data.ptr, self.model.ptr, self._reset_snapshot)
+        self._mark_forwarded()
+        self.reward = 0
+        self.done = False
+        self._clear_contact_events()
+        self._set_udd_state(self._reset_udd_state, True)
+
+    def forward(self, if_dirty=False):
         """
         Computes the forward kinematics. Calls ``mj_forward`` internally.
+
+        If ``if_dirty`` is True, nothing is done unless :attr:`.dirty`.
+        Dirty tracking only compares the inputs in ``sim.data`` and
+        ``model.opt``: after writing other model parameters (e.g.
+        ``body_pos``, ``geom_size``, ``cam_pos``), call :meth:`.mark_dirty`.
+        The setters of :mod:`mujoco_py.modder` do.
         """
+        if if_dirty and not self.dirty:
+            return
         with wrap_mujoco_warning():
             mj_forward(self.model.ptr, self.data.ptr)
+        self._mark_forwarded()
+
+    def dynamics_derivatives(self, eps=1e-6, centered=True, transition=True,
+                             nthreads=None):
+        """
+        Computes derivatives of the dynamics at the current state by finite
+        differences. Calls :meth:`.forward` first.
+
+        Each dimension of qpos, qvel, act and ctrl is perturbed on private
+        copies of the data, in parallel, skipping the computation stages
+        that don't depend on it. qpos is perturbed in its tangent space
+        (with ``mj_integratePos``), so quaternions stay normalized and the
+        qpos derivatives have nv columns.
+
+        Args:
+        - eps (float): size of the perturbations.
+        - centered (bool): if True, use centered differences, which are
+            more accurate but take twice as long.
+        - transition (bool): if True, also compute the Jacobians of one
+            ``mj_step`` (without substep callbacks or udd_callback).
+        - nthreads (int): number of threads, defaults to OpenMP's maximum.
+
+        Returns a ``DynamicsDerivatives`` namedtuple with
+        - dqacc_dqpos (nv x nv), dqacc_dqvel (nv x nv), dqacc_dact (nv x na),
+            dqacc_dctrl (nv x nu): derivatives of ``qacc``.
+        - A ((2*nv+na) x (2*nv+na)), B ((2*nv+na) x nu): Jacobians of the next
+            state with respect to the state and ctrl, where states are
+            (qpos in tangent space, qvel, act). None if not ``transition``.
+        """
+        return _dynamics_derivatives(self, eps, centered, transition, nthreads)
+
+    def inverse_dynamics(self, qpos, qvel, qacc, out=None,
+                         constraint_forces=False, constraint_out=None,
+                         nthreads=None):
+        """
+        Computes the inverse dynamics (``mj_inverse``) of a batch of states,
+        e.g. a whole trajectory, in parallel on private copies of the data.
+        Fields that aren't given per state (e.g. mocap poses) are taken from
+        the current ``sim.data``, which isn't modified.
+
+        Args:
+        - qpos (array of shape (n, nq)), qvel (n, nv), qacc (n, nv): states
+            and accelerations.
+        - out (array of shape (n, nv)): optional output for ``qfrc_inverse``.
+        - constraint_forces (bool): if True, also return ``qfrc_constraint``.
+        - constraint_out (array of shape (n, nv)): optional output for it.
+        - nthreads (int): number of threads, defaults to OpenMP's maximum.
+
+        Returns:
+        - qfrc_inverse (array of shape (n, nv)), and ``qfrc_constraint``
+            (array of shape (n, nv)) if ``constraint_forces``.
+        """
+        return _inverse_dynamics(self, qpos, qvel, qacc, out,
+                                 constraint_forces, constraint_out, nthreads)
+
+    def kinematics_batch(self, qpos, fields=('body_xpos', 'body_xquat'),
+                         out=None, nthreads=None):
+        """
+        Computes the forward kinematics of many configurations in parallel,
+        with ``mj_kinematics`` (and ``mj_comPos`` and ``mj_camlight`` if
+        needed) only, skipping dynamics and collision detection. Mocap poses are taken from
+        ``sim.data``, which isn't modified.
+
+        Args:
+        - qpos (array of shape (n, nq)): configurations.
+        - fields (list of str): ``PyMjData`` fields to return, any of
+            body_xpos, body_xquat, body_xmat, xipos, ximat, xanchor, xaxis,
+            geom_xpos, geom_xmat, site_xpos, site_xmat, cam_xpos, cam_xmat,
+            light_xpos, light_xdir, subtree_com, cinert and cdof.
+        - out (dict): optional output arrays of shape (n,) + field shape,
+            by field name.
+        - nthreads (int): number of threads, defaults to OpenMP's maximum.
+
+        Returns:
+        - dict mapping the field names to arrays of shape (n,) + field shape.
+        """
+        return _kinematics_batch(self, qpos, fields, out, nthreads)
 
     def set_constants(self):
         """
@@ -111,6 +464,7 @@ cdef class MjSim(object):
         """
         with wrap_mujoco_warning():
             mj_setConst(self.model.ptr, self.data.ptr)
+        self._forward_clean = False
 
     def step(self, with_udd=True):
         """
@@ -119,14 +473,82 @@ cdef class MjSim(object):
         If ``qpos`` or ``qvel`` have been modified directly, the user is required to call
         :meth:`.forward` before :meth:`.step` if their ``udd_callback`` requires access to MuJoCo state
         set during the forward dynamics.
+
+        The substeps run without the GIL, unless a subclass overrides
+        :meth:`.substep_callback`: then the override is called before every
+        substep instead of ``substep_callback_ptr``. Rollouts only run the
+        compiled callbacks.
         """
+        cdef const mjModel* m = self.model.ptr
+        cdef mjData* d = self.data.ptr
+        cdef const _SubstepPipeline* pipeline = &self._substeps
+        cdef _SubstepPipeline overridden
+        cdef int nsubsteps = self.nsubsteps
+        cdef int i
+
         if with_udd:
             self.step_udd()
 
+        # mj_step leaves the derived quantities of the state before the
+        # final integration, so forward() is needed again.
+        self._forward_clean = False
         with wrap_mujoco_warning():
-            for _ in range(self.nsubsteps):
-                self.substep_callback()
-                mj_step(self.model.ptr, self.data.ptr)
+            if type(self).substep_callback is MjSim.substep_callback:
+                with nogil:
+                    for i in range(nsubsteps):
+                        _substep(m, d, pipeline)
+            else:
+                # The override replaces substep_callback_ptr, which comes
+                # first in the pipeline.
+                overridden = self._substeps
+                if self.substep_callback_ptr:
+                    overridden.fns += 1
+                    overridden.count[SUBSTEP_PRE] -= 1
+                for i in range(nsubsteps):
+                    self.substep_callback()
+                    _substep(m, d, &overridden)
+        if pipeline.recorder != NULL:
+            self._drain_contact_events()
+        if self._calibrating:
+            self._update_size_peaks(d)
+        if self.reward_callback_ptr:
+            self._evaluate_reward()
+
+    cdef void _evaluate_reward(self):
+        cdef mjtNum out[2]
+        out[0] = 0
+        out[1] = 0
+        (<reward_fn_t>self.reward_callback_ptr)(self.model.ptr, self.data.ptr, out)
+        self.reward = out[0]
+        self.done = out[1] != 0
+
+    def rollout(self, ctrls, nthreads=None):
+        """
+        Rolls out control sequences from the current state in parallel on
+        private copies of the data, evaluating the reward callback after
+        every step. ``sim.data`` isn't modified.
+
+        Each control is held for the ``nsubsteps`` of one :meth:`.step`,
+        calling the substep callbacks like it (but not ``udd_callback``). A
+        rollout ends early when the reward callback sets ``out[1]``.
+
+        Args:
+        - ctrls (array of shape (n, horizon, nu) or (horizon, nu)): controls.
+        - nthreads (int): number of threads, defaults to OpenMP's maximum.
+
+        Returns:
+        - rewards (array of shape (n, horizon) or (horizon,)): reward after
+            every step, 0 after the end of the rollout.
+        - lengths (int array of shape (n,), or int): number of steps until
+            the end of each rollout.
+        """
+        if not self.reward_callback_ptr:
+            raise RuntimeError("No reward callback, call set_reward_callback() first")
+        ctrls = np.ascontiguousarray(ctrls, dtype=np.float64)
+        if ctrls.ndim == 2:
+            rewards, lengths = _rollout_rewards(self, ctrls[np.newaxis], nthreads)
+            return rewards[0], int(lengths[0])
+        return _rollout_rewards(self, ctrls, nthreads)
 
     def render(self, width=None, height=None, *, camera_name=None, depth=False,
                mode='offscreen', device_id=-1):
@@ -189,7 +611,12 @@ cdef class MjSim(object):
 
     @udd_callback.setter
     def udd_callback(self, value):
+        # A Python callback replaces a typed udd_state.
         self._udd_callback = value
+        self.udd_buffer = None
+        self.udd_schema = None
+        self.udd_callback_ptr = 0
+        self.udd_callback_src = None
         self.udd_state = None
         self.step_udd()
 
@@ -215,16 +642,296 @@ cdef class MjSim(object):
             self.model.set_userdata_names(userdata_names)
         if substep_callback is None:
             self.substep_callback_ptr = 0
+            self.substep_callback_src = None
         elif isinstance(substep_callback, int):
             self.substep_callback_ptr = substep_callback
+            self.substep_callback_src = None
         elif isinstance(substep_callback, str):
             self.substep_callback_ptr = build_callback_fn(substep_callback,
                                                           self.model.userdata_names)
+            self.substep_callback_src = substep_callback
         else:
             raise TypeError('invalid: {}'.format(type(substep_callback)))
+        self._update_substeps()
+
+    def add_substep_callback(self, substep_callback, stage='pre', name=None,
+                             userdata_names=None):
+        '''
+        Add a named substep callback, run after `substep_callback`.
+
+        Callbacks are compiled like substep callbacks (see
+        `builder.build_callback_fn()`) and run in the order they were added
+        within their stage. With callbacks at the 'between_step1_step2'
+        stage, substeps call `mj_step1`, the callbacks and `mj_step2`
+        instead of `mj_step`, which always integrates with Euler's method.
+
+        Parameters :
+            substep_callback : str or int
+                C source to compile, or a function pointer.
+            stage : str
+                'pre' (before the step, e.g. to apply forces), 'post' (after
+                it, e.g. to collect contact statistics) or
+                'between_step1_step2' (after position and velocity dependent
+                computations, before the control dependent ones).
+            name : str or None
+                Name to enable, disable or remove the callback with. Defaults
+                to 'substep_<i>' with the smallest unused i.
+            userdata_names : list of strings or None
+                If not None, this is passed onto ``model.set_userdata_names()``.
+
+        Returns the name of the callback.
+        '''
+        if stage not in _SUBSTEP_STAGES:
+            raise ValueError("stage must be 'pre', 'post' or "
+                             "'between_step1_step2', got %r" % (stage,))
+        names = set(entry[0] for entry in self._substep_callbacks)
+        if name is None:
+            i = 0
+            while 'substep_%d' % i in names:
+                i += 1
+            name = 'substep_%d' % i
+        if name in names:
+            raise ValueError('A substep callback named %r exists already' % name)
+        if userdata_names is not None:
+            self.model.set_userdata_names(userdata_names)
+        if isinstance(substep_callback, int):
+            ptr, src = substep_callback, None
+        elif isinstance(substep_callback, str):
+            ptr = build_callback_fn(substep_callback, self.model.userdata_names)
+            src = substep_callback
+        else:
+            raise TypeError('invalid: {}'.format(type(substep_callback)))
+        self._substep_callbacks.append([name, stage, ptr, src, True])
+        self._update_substeps()
+        return name
+
+    def remove_substep_callback(self, name):
+        """ Removes the substep callback added with the given name. """
+        self._substep_callbacks.remove(self._substep_callback_entry(name))
+        self._update_substeps()
+
+    def enable_substep_callback(self, name, enabled=True):
+        """
+        Enables (or, if ``enabled`` is False, disables) the substep callback
+        added with the given name, without recompiling it.
+        """
+        self._substep_callback_entry(name)[4] = bool(enabled)
+        self._update_substeps()
+
+    def disable_substep_callback(self, name):
+        """ Disables the substep callback added with the given name. """
+        self.enable_substep_callback(name, False)
+
+    @property
+    def substep_callbacks(self):
+        """ List of (name, stage, enabled) of the added substep callbacks. """
+        return [(name, stage, enabled)
+                for name, stage, _, _, enabled in self._substep_callbacks]
+
+    def _substep_callback_entry(self, name):
+        for entry in self._substep_callbacks:
+            if entry[0] == name:
+                return entry
+        raise KeyError('No substep callback named %r' % (name,))
+
+    cdef _update_substeps(self):
+        # Rebuilds the pipeline from substep_callback_ptr and the enabled
+        # named callbacks.
+        stages = [[] for _ in range(N_SUBSTEP_STAGES)]
+        if self.substep_callback_ptr:
+            stages[SUBSTEP_PRE].append(self.substep_callback_ptr)
+        for _, stage, ptr, _, enabled in self._substep_callbacks:
+            if enabled:
+                stages[_SUBSTEP_STAGES[stage]].append(ptr)
+        ptrs = [ptr for stage_ptrs in stages for ptr in stage_ptrs]
+        cdef substep_fn_t* fns = <substep_fn_t*> realloc(
+            self._substeps.fns, max(len(ptrs), 1) * sizeof(substep_fn_t))
+        if fns == NULL:
+            raise MemoryError()
+        self._substeps.fns = fns
+        for i, ptr in enumerate(ptrs):
+            fns[i] = <substep_fn_t> <uintptr_t> ptr
+        for i in range(N_SUBSTEP_STAGES):
+            self._substeps.count[i] = len(stages[i])
+
+    def enable_contact_events(self, capacity=1024):
+        """
+        Records the beginning and end of contacts between geom pairs in every
+        substep, including contacts that start and end within one
+        :meth:`.step`.
+
+        After each substep, the pairs in contact are compared in C with
+        those of the previous substep. Every change is written to a ring
+        buffer as an event with the fields ``time`` (of the substep that
+        detected it), ``geom1`` < ``geom2``, ``begin`` (1 when the contact
+        starts, 0 when it ends), ``dist`` (smallest distance, negative for
+        penetration) and ``normal_force`` (sum over the contacts of the
+        pair). End events carry the values of the last substep in contact.
+
+        :meth:`.step` drains the buffer into :attr:`.contact_events`, a
+        structured array that is overwritten by the next step. If more than
+        ``capacity`` events happen in one step, the oldest are dropped and
+        counted in :attr:`.contact_events_dropped`. Resets start over with
+        no pairs in contact. Rollouts don't record events.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+        self.disable_contact_events()
+        self._substeps.recorder = _new_contact_recorder(
+            capacity, self.model.nconmax)
+        self._contact_event_buffer = np.zeros(capacity, CONTACT_EVENT_DTYPE)
+        self.contact_events = self._contact_event_buffer[:0]
+        self.contact_events_dropped = 0
+
+    def disable_contact_events(self):
+        """ Stops recording contact events. """
+        _free_contact_recorder(self._substeps.recorder)
+        self._substeps.recorder = NULL
+        self._contact_event_buffer = None
+        self.contact_events = None
+        self.contact_events_dropped = 0
+
+    cdef _drain_contact_events(self):
+        cdef _ContactRecorder* r = self._substeps.recorder
+        cdef _ContactEvent* out = <_ContactEvent*> np.PyArray_DATA(
+            <np.ndarray> self._contact_event_buffer)
+        cdef int first = min(r.count, r.capacity - r.start)
+        memcpy(out, r.events + r.start, first * sizeof(_ContactEvent))
+        memcpy(out + first, r.events, (r.count - first) * sizeof(_ContactEvent))
+        self.contact_events = self._contact_event_buffer[:r.count]
+        self.contact_events_dropped = r.dropped
+        r.start = r.count = r.dropped = 0
+
+    cdef _clear_contact_events(self):
+        cdef _ContactRecorder* r = self._substeps.recorder
+        if r != NULL:
+            r.start = r.count = r.dropped = r.npairs = 0
+            self.contact_events = self._contact_event_buffer[:0]
+            self.contact_events_dropped = 0
+
+    def start_size_calibration(self):
+        """
+        Starts tracking the peak number of contacts (``maxuse_con``),
+        constraint rows (``maxuse_efc``) and stack usage (``maxuse_stack``)
+        of the data over steps, resets and rollouts, for
+        :meth:`.size_recommendation`.
+        """
+        self._calibrating = True
+        self._peak_efc = self._peak_con = self._peak_stack = 0
+        self._update_size_peaks(self.data.ptr)
+
+    def stop_size_calibration(self):
+        """ Stops tracking the peak buffer usage, keeping the peaks. """
+        if self._calibrating:
+            self._update_size_peaks(self.data.ptr)
+        self._calibrating = False
+
+    cdef void _update_size_peaks(self, const mjData* d):
+        self._peak_efc = max(self._peak_efc, d.maxuse_efc)
+        self._peak_con = max(self._peak_con, d.maxuse_con)
+        self._peak_stack = max(self._peak_stack, d.maxuse_stack)
+
+    def size_recommendation(self, headroom=0.25):
+        """
+        Recommends ``njmax``, ``nconmax`` and ``nstack`` from the peak usage
+        since :meth:`.start_size_calibration`. Smaller buffers make ``mjData``
+        smaller, e.g. to fit more simulations per host, but overflowing them
+        raises the MuJoCo warnings that ask to increase them.
+
+        Args:
+        - headroom (float): relative margin above the peaks.
+
+        Returns a ``SizeRecommendation`` namedtuple with the recommended
+        njmax, nconmax and nstack, and the peak_nefc, peak_ncon and
+        peak_stack they are based on.
+        """
+        if self._calibrating:
+            self._update_size_peaks(self.data.ptr)
+        return _size_recommendation(self._peak_efc, self._peak_con,
+                                    self._peak_stack, headroom)
+
+    def resized_model(self, headroom=0.25):
+        """
+        Recompiles the model with the sizes of
+        :meth:`.size_recommendation`. Like :meth:`.save`, this uses the XML
+        of the last loaded model.
+
+        Returns the new :class:`.PyMjModel`.
+        """
+        return load_model_from_xml(_resized_model_xml(
+            self.model.get_xml(), self.size_recommendation(headroom)))
+
+    def set_reward_callback(self, reward_callback, userdata_names=None):
+        '''
+        Set a reward callback function.
+
+        The function is compiled like a substep callback (see
+        `builder.build_callback_fn()`) but has the signature:
+            void fun(const mjModel* m, const mjData* d, mjtNum* out);
+
+        It writes the reward to `out[0]` and, to end the episode, a
+        non-zero value to `out[1]`. Both start as 0. After every `step()` they
+        are available as `sim.reward` and `sim.done`, and `rollout()`
+        evaluates them without returning to Python. For example:
+            ```
+            """
+            void fun(const mjModel* m, const mjData* d, mjtNum* out) {
+                out[0] = d->qvel[0];
+                out[1] = d->qpos[2] < 0.5;
+            }
+            """
+            ```
+
+        Parameters :
+            reward_callback : str or int or None
+                C source to compile, a function pointer, or None to disable.
+            userdata_names : list of strings or None
+                If not None, this is passed onto ``model.set_userdata_names()``.
+        '''
+        if userdata_names is not None:
+            self.model.set_userdata_names(userdata_names)
+        if reward_callback is None:
+            self.reward_callback_ptr = 0
+            self.reward_callback_src = None
+        elif isinstance(reward_callback, int):
+            self.reward_callback_ptr = reward_callback
+            self.reward_callback_src = None
+        elif isinstance(reward_callback, str):
+            self.reward_callback_ptr = build_callback_fn(reward_callback,
+                                                         self.model.userdata_names)
+            self.reward_callback_src = reward_callback
+        else:
+            raise TypeError('invalid: {}'.format(type(reward_callback)))
+        self.reward = 0
+        self.done = False
+
+    def __reduce_ex__(self, protocol):
+        """
+        Pickles the model, the full ``mjData`` state, ``nsubsteps``,
+        ``udd_state`` and the callbacks. Render contexts are not pickled.
+        Substep and reward callbacks compiled from C source are recompiled on
+        unpickling; ones given as raw function pointers can't be pickled.
+        """
+        if ((self.substep_callback_ptr and self.substep_callback_src is None) or
+                (self.reward_callback_ptr and self.reward_callback_src is None) or
+                (self.udd_callback_ptr and self.udd_callback_src is None) or
+                any(src is None for _, _, _, src, _ in self._substep_callbacks)):
+            raise pickle.PicklingError(
+                "Can't pickle MjSim with a callback given as a "
+                "function pointer. Pass the C source instead.")
+        return (_unpickle_sim,
+                (self.model, self.data, self.nsubsteps, self._udd_callback,
+                 self.udd_state, self.substep_callback_src,
+                 self.render_callback, self.extras, self.reward_callback_src,
+                 self.udd_schema, self.udd_callback_src,
+                 [(name, stage, src, enabled) for name, stage, _, src, enabled
+                  in self._substep_callbacks]))
 
     def step_udd(self):
-        if self._udd_callback is None:
+        if self.udd_buffer is not None:
+            if self.udd_callback_ptr:
+                self._step_typed_udd()
+        elif self._udd_callback is None:
             self.udd_state = {}
         else:
             schema_example = self.udd_state
@@ -244,36 +951,210 @@ cdef class MjSim(object):
                         assert self.udd_state[key].shape == schema_example[key].shape, \
                             "Numpy array values in udd_state must keep the same dimension across steps."
 
-    def get_state(self):
-        """ Returns a copy of the simulator state. """
+    cdef void _step_typed_udd(self):
+        (<udd_fn_t>self.udd_callback_ptr)(
+            self.model.ptr, self.data.ptr,
+            <mjtNum*> np.PyArray_DATA(<np.ndarray> self.udd_buffer))
+
+    def set_udd_schema(self, schema, udd_callback=None):
+        '''
+        Switches to a typed ``udd_state``, stored in one flat float64 buffer.
+
+        ``udd_state`` becomes a dict of views into ``udd_buffer``, one per
+        entry of the schema, in sorted order like in flattened states. The
+        buffer is preallocated, so ``step()`` neither allocates nor validates
+        a new dict. Modify the entries in place, e.g.
+        ``sim.udd_state['count'][...] += 1``. States, checkpoints and
+        pickles include the buffer as usual. ``reset()`` zeros it.
+        Setting ``udd_callback`` switches back to a dict ``udd_state``.
+
+        Parameters :
+            schema : dict
+                Maps entry names to shapes: ``()`` for a scalar, an int or a
+                tuple for an array.
+            udd_callback : str or int or None
+                Optional compiled function that updates the buffer at the
+                start of every ``step()``, like a Python ``udd_callback``:
+                    void fun(const mjModel* m, const mjData* d, mjtNum* udd);
+                It's compiled like a substep callback (see
+                `builder.build_callback_fn()`). The source also gets a
+                `#define` for every entry, `udd[i]` for scalars and
+                `(udd + i)` for arrays, so history can be kept like:
+                    ```
+                    """
+                    void fun(const mjModel* m, const mjData* d, mjtNum* udd) {
+                        steps += 1;
+                        for (int i = 0; i < 3; i++) {
+                            max_vel[i] = mju_max(max_vel[i], d->qvel[i]);
+                        }
+                    }
+                    """
+                    ```
+                with the schema `{'steps': (), 'max_vel': 3}`.
+        '''
+        schema_list = []
+        defines = ''
+        offset = 0
+        for name in sorted(schema):
+            shape = schema[name]
+            shape = (int(shape),) if np.ndim(shape) == 0 else tuple(shape)
+            schema_list.append((name, shape))
+            if shape == ():
+                defines += '#define {} udd[{}]\n'.format(name, offset)
+            else:
+                defines += '#define {} (udd + {})\n'.format(name, offset)
+            offset += int(np.prod(shape))
+
+        if udd_callback is None:
+            ptr, src = 0, None
+        elif isinstance(udd_callback, int):
+            ptr, src = udd_callback, None
+        elif isinstance(udd_callback, str):
+            ptr = build_callback_fn(defines + udd_callback,
+                                    self.model.userdata_names)
+            src = udd_callback
+        else:
+            raise TypeError('invalid: {}'.format(type(udd_callback)))
+
+        self._udd_callback = None
+        self.udd_callback_ptr = ptr
+        self.udd_callback_src = src
+        self.udd_schema = tuple(schema_list)
+        self.udd_buffer = np.zeros(offset)
+        self.udd_state = self._udd_views(self.udd_buffer)
+
+    cdef dict _udd_views(self, buf):
+        # Entries of a typed udd_state as views into buf.
+        views = {}
+        offset = 0
+        for name, shape in self.udd_schema:
+            size = int(np.prod(shape))
+            views[name] = buf[offset:offset + size].reshape(shape)
+            offset += size
+        return views
+
+    cdef _set_udd_state(self, udd_state, bint copy):
+        # Sets udd_state like set_state. A typed udd_state is always copied
+        # into the buffer.
+        if self.udd_buffer is not None:
+            for name, _ in self.udd_schema:
+                self.udd_state[name][...] = udd_state[name]
+        elif copy:
+            self.udd_state = deepcopy(udd_state)
+        elif self.udd_state is not udd_state:
+            self.udd_state.clear()
+            self.udd_state.update(udd_state)
+
+    def get_state(self, warmstart=False):
+        """
+        Returns a copy of the simulator state.
+
+        If ``warmstart`` is True, this is an
+        :class:`MjSimStateWithWarmstart` that also carries a copy of
+        ``qacc_warmstart``, which :meth:`set_state` restores.
+        """
         qpos = np.copy(self.data.qpos)
         qvel = np.copy(self.data.qvel)
         if self.model.na == 0:
             act = None
         else:
             act = np.copy(self.data.act)
-        udd_state = copy.deepcopy(self.udd_state)
+        if self.udd_buffer is not None:
+            udd_state = self._udd_views(self.udd_buffer.copy())
+        else:
+            udd_state = deepcopy(self.udd_state)
 
+        if warmstart:
+            return MjSimStateWithWarmstart(
+                self.data.time, qpos, qvel, act, udd_state,
+                np.copy(self.data.qacc_warmstart))
         return MjSimState(self.data.time, qpos, qvel, act, udd_state)
 
-    def set_state(self, value):
+    def get_state_into(self, out, i=None):
+        """
+        Copies the simulator state into preallocated arrays, without
+        allocating new ones.
+
+        Args:
+        - out (MjSimState or MjSimStateBatch): destination. For an
+            MjSimState, its qpos/qvel/act and udd_state arrays are filled in
+            place and numeric udd_state values are replaced in its dict.
+            Its qacc_warmstart is filled too, if it isn't None.
+        - i (int): index of the state to fill if ``out`` is a batch.
+
+        Returns:
+        - for a batch, ``out`` itself. For an MjSimState, a state sharing
+            the arrays of ``out`` with the current time (MjSimState is an
+            immutable tuple, so the time can't be updated in place).
+        """
+        if i is not None:
+            out.time[i] = self.data.time
+            out.qpos[i] = self.data.qpos
+            out.qvel[i] = self.data.qvel
+            if self.model.na != 0:
+                out.act[i] = self.data.act
+            for k, v in out.udd_state.items():
+                v[i] = self.udd_state[k]
+            return out
+        out.qpos[:] = self.data.qpos
+        out.qvel[:] = self.data.qvel
+        if self.model.na != 0:
+            out.act[:] = self.data.act
+        if out.qacc_warmstart is not None:
+            out.qacc_warmstart[:] = self.data.qacc_warmstart
+        udd_state = out.udd_state
+        for k, v in self.udd_state.items():
+            if isinstance(v, Number):
+                udd_state[k] = v
+            else:
+                udd_state[k][...] = v
+        return out._replace(time=self.data.time)
+
+    def get_state_batch(self, n=1):
+        """
+        Returns an :class:`MjSimStateBatch` of ``n`` copies of the current
+        simulator state.
+        """
+        batch = MjSimStateBatch.empty(self, n)
+        batch.time[:] = self.data.time
+        batch.qpos[:] = self.data.qpos
+        batch.qvel[:] = self.data.qvel
+        if self.model.na != 0:
+            batch.act[:] = self.data.act
+        for k, v in batch.udd_state.items():
+            v[:] = self.udd_state[k]
+        return batch
+
+    def set_state(self, value, i=None, copy=True):
         """
         Sets the state from an MjSimState.
         If the MjSimState was previously unflattened from a numpy array, consider
         set_state_from_flattened, as the defensive copy is a substantial overhead
         in an inner loop.
 
+        qpos, qvel and act are always copied into the simulator's own
+        buffers, so later changes to ``value`` don't affect the simulation.
+        ``qacc_warmstart`` is restored too if the state carries it.
+
         Args:
-        - value (MjSimState): the desired state.
-        - call_forward: optionally call sim.forward(). Called by default if
-            the udd_callback is set.
+        - value (MjSimState or MjSimStateBatch): the desired state.
+        - i (int): index of the state to set if ``value`` is a batch.
+        - copy (bool): if True, ``udd_state`` is deep-copied. If False, the
+            simulator's ``udd_state`` dict is updated in place with the
+            entries of ``value.udd_state``, sharing any arrays with it. A
+            typed ``udd_state`` (see :meth:`.set_udd_schema`) is always
+            copied into its buffer.
         """
+        if i is not None:
+            value = value[i]
         self.data.time = value.time
-        self.data.qpos[:] = np.copy(value.qpos)
-        self.data.qvel[:] = np.copy(value.qvel)
+        self.data.qpos[:] = value.qpos
+        self.data.qvel[:] = value.qvel
         if self.model.na != 0:
-            self.data.act[:] = np.copy(value.act)
-        self.udd_state = copy.deepcopy(value.udd_state)
+            self.data.act[:] = value.act
+        if value.qacc_warmstart is not None:
+            self.data.qacc_warmstart[:] = value.qacc_warmstart
+        self._set_udd_state(value.udd_state, copy)
 
     def set_state_from_flattened(self, value):
         """ This helper method sets the state from an array without requiring a defensive copy."""
@@ -284,7 +1165,10 @@ cdef class MjSim(object):
         self.data.qvel[:] = state.qvel
         if self.model.na != 0:
             self.data.act[:] = state.act
-        self.udd_state = state.udd_state
+        if self.udd_buffer is not None:
+            self._set_udd_state(state.udd_state, False)
+        else:
+            self.udd_state = state.udd_state
 
     def save(self, file, format='xml', keep_inertials=False):
         """
@@ -366,6 +1250,9 @@ cdef class MjSim(object):
         cdef mjtNum[::view.contiguous] pnt_view = pnt
         cdef mjtNum[::view.contiguous] vec_view = vec
 
+        if self.auto_forward:
+            self.forward(if_dirty=True)
+
         if group_filter is None:
             return self.ray_fast_nogroup(
                 np.asarray(pnt, dtype=np.float64),
@@ -437,3 +1324,54 @@ cdef class MjSim(object):
                           bodyexclude,
                           &geomid)
         return (distance, geomid)
+
+
+def fast_reset_sims(sims, mask=None):
+    """
+    Calls :meth:`MjSim.fast_reset` on many sims at once.
+
+    The ``mjData`` copies run in parallel without the GIL. Every selected
+    sim must have a reset snapshot.
+
+    Args:
+    - sims (list of MjSim): simulations to reset.
+    - mask (array of bool): optional, only ``sims[i]`` with ``mask[i]`` set
+        are reset.
+    """
+    cdef MjSim sim
+    cdef int i, n
+    if mask is None:
+        selected = list(sims)
+    else:
+        if len(mask) != len(sims):
+            raise ValueError("mask must have the same length as sims")
+        selected = [sim for sim, m in zip(sims, mask) if m]
+    n = len(selected)
+    if n == 0:
+        return
+    cdef const mjModel** models = <const mjModel**> malloc(n * sizeof(mjModel*))
+    cdef mjData** dest = <mjData**> malloc(n * sizeof(mjData*))
+    cdef mjData** src = <mjData**> malloc(n * sizeof(mjData*))
+    try:
+        for i in range(n):
+            sim = selected[i]
+            if sim._reset_snapshot == NULL:
+                raise RuntimeError("No reset snapshot, call set_reset_snapshot() first")
+            models[i] = sim.model.ptr
+            dest[i] = sim.data.ptr
+            src[i] = sim._reset_snapshot
+            if sim._calibrating:
+                sim._update_size_peaks(sim.data.ptr)
+        with nogil:
+            for i in prange(n, schedule='static'):
+                mj_copyData(dest[i], models[i], src[i])
+    finally:
+        free(models)
+        free(dest)
+        free(src)
+    for sim in selected:
+        sim._mark_forwarded()
+        sim.reward = 0
+        sim.done = False
+        sim._clear_contact_events()
+        sim._set_udd_state(sim._reset_udd_state, True)
@@ -1,4 +1,3 @@
-
 class MjSimState(namedtuple('SimStateBase', 'time qpos qvel act udd_state')):
     """Represents a snapshot of the simulator's state.
 
@@ -6,6 +5,10 @@ class MjSimState(namedtuple('SimStateBase', 'time qpos qvel act udd_state')):
     """
     __slots__ = ()
 
+    #: Accelerations the constraint solver starts from, only carried by
+    #: :class:`MjSimStateWithWarmstart`.
+    qacc_warmstart = None
+
     # need to implement this because numpy doesn't support == on arrays
     def __eq__(self, other):
         if not isinstance(other, self.__class__):
@@ -87,3 +90,212 @@ class MjSimState(namedtuple('SimStateBase', 'time qpos qvel act udd_state')):
                 val = np.array(val_array).reshape(schema_val.shape)
                 d[k] = val
         return d
+
+
+class StateLayout(object):
+    """
+    Precomputed layout of a flattened :class:`MjSimState` for a given sim.
+
+    The layout matches :meth:`MjSimState.flatten`: time, qpos, qvel, act and
+    then the ``udd_state`` values in sorted key order. It's computed once from
+    the model sizes and the current ``udd_state`` schema, so that states can
+    be flattened into and viewed from preallocated buffers without building
+    lists, sorting keys or allocating arrays on every call.
+
+    Create a new layout if the sim's ``udd_state`` keys or shapes change.
+    """
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.nq = sim.model.nq
+        self.nv = sim.model.nv
+        self.na = sim.model.na
+        self.qpos_slice = slice(1, 1 + self.nq)
+        self.qvel_slice = slice(self.qpos_slice.stop, self.qpos_slice.stop + self.nv)
+        self.act_slice = slice(self.qvel_slice.stop, self.qvel_slice.stop + self.na)
+        # (key, slice, shape) per udd value; shape is None for numbers.
+        self.udd_layout = []
+        idx = self.act_slice.stop
+        for k in sorted(sim.udd_state.keys()):
+            v = sim.udd_state[k]
+            if isinstance(v, Number):
+                self.udd_layout.append((k, slice(idx, idx + 1), None))
+                idx += 1
+            else:
+                self.udd_layout.append((k, slice(idx, idx + v.size), v.shape))
+                idx += v.size
+        self.size = idx
+
+    def flatten_into(self, out, state=None):
+        """
+        Writes ``state`` into the 1-d float array ``out`` of length
+        ``self.size`` and returns it. If ``state`` is None, the current state
+        is read directly from the sim, without creating an MjSimState.
+        """
+        if state is None:
+            data = self.sim.data
+            time, qpos, qvel, act = data.time, data.qpos, data.qvel, data.act
+            udd_state = self.sim.udd_state
+        else:
+            time, qpos, qvel, act, udd_state = state
+        out[0] = time
+        out[self.qpos_slice] = qpos
+        out[self.qvel_slice] = qvel
+        if self.na != 0:
+            out[self.act_slice] = act
+        if state is None and self.sim.udd_buffer is not None:
+            # A typed udd_state is already stored in flattened order.
+            out[self.act_slice.stop:self.size] = self.sim.udd_buffer
+            return out
+        for k, s, shape in self.udd_layout:
+            if shape is None:
+                out[s.start] = udd_state[k]
+            else:
+                out[s].reshape(shape)[...] = udd_state[k]
+        return out
+
+    def unflatten_view(self, buf):
+        """
+        Returns an :class:`MjSimState` whose qpos, qvel, act and array-valued
+        ``udd_state`` entries are views into ``buf``, without copying.
+        """
+        udd_state = {}
+        for k, s, shape in self.udd_layout:
+            if shape is None:
+                udd_state[k] = buf[s.start]
+            else:
+                udd_state[k] = buf[s].reshape(shape)
+        act = buf[self.act_slice] if self.na != 0 else None
+        return MjSimState(buf[0], buf[self.qpos_slice], buf[self.qvel_slice],
+                          act, udd_state)
+
+
+class MjSimStateWithWarmstart(MjSimState):
+    """
+    An :class:`MjSimState` that also carries ``qacc_warmstart``, as returned
+    by ``sim.get_state(warmstart=True)``.
+
+    The warmstart isn't part of the physical state (it's ignored by ``==``
+    and :meth:`flatten`), but restoring it saves solver iterations after
+    :meth:`MjSim.set_state` and makes the restored trajectory identical to
+    the original one. It's an attribute rather than a tuple field, so the
+    state unpacks into the same five fields as any other.
+    """
+
+    def __new__(cls, time, qpos, qvel, act, udd_state, qacc_warmstart=None):
+        self = super().__new__(cls, time, qpos, qvel, act, udd_state)
+        self.qacc_warmstart = qacc_warmstart
+        return self
+
+    def _replace(self, **kwargs):
+        result = super()._replace(**kwargs)
+        result.qacc_warmstart = self.qacc_warmstart
+        return result
+
+
+class MjSimStateBatch(object):
+    """
+    A batch of N simulator states stored as arrays.
+
+    ``time`` has shape ``(N,)``, ``qpos``/``qvel``/``act`` have shapes
+    ``(N, nq)``/``(N, nv)``/``(N, na)`` (``act`` is None if ``na == 0``) and
+    ``udd_state`` maps each key to an array with a leading batch axis. Like
+    in :meth:`MjSimState.flatten`, udd values are stored as floats.
+
+    Integer indexing returns an :class:`MjSimState` whose arrays are views
+    into the batch; slices and index arrays return a new batch. A batch
+    pickles as a single contiguous buffer rather than N separate states.
+    """
+
+    def __init__(self, time, qpos, qvel, act, udd_state):
+        self.time = time
+        self.qpos = qpos
+        self.qvel = qvel
+        self.act = act
+        self.udd_state = udd_state
+
+    @classmethod
+    def empty(cls, sim, n):
+        """
+        Returns an uninitialized batch of ``n`` states for ``sim``. All
+        fields are contiguous views into one buffer.
+        """
+        layout = StateLayout(sim)
+        return _unpack_state_batch(np.empty(n * layout.size), n, layout.nq,
+                                   layout.nv, layout.na,
+                                   [(k, shape) for k, _, shape in layout.udd_layout])
+
+    @classmethod
+    def from_states(cls, states):
+        """ Stacks a sequence of MjSimStates into a batch. """
+        states = list(states)
+        act = None
+        if states[0].act is not None:
+            act = np.stack([s.act for s in states])
+        udd_state = {k: np.array([s.udd_state[k] for s in states], dtype=np.float64)
+                     for k in states[0].udd_state}
+        return cls(np.array([s.time for s in states], dtype=np.float64),
+                   np.stack([s.qpos for s in states]),
+                   np.stack([s.qvel for s in states]),
+                   act, udd_state)
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, idx):
+        act = None if self.act is None else self.act[idx]
+        udd_state = {k: v[idx] for k, v in self.udd_state.items()}
+        if isinstance(idx, (int, np.integer)):
+            return MjSimState(self.time[idx], self.qpos[idx], self.qvel[idx],
+                              act, udd_state)
+        return MjSimStateBatch(self.time[idx], self.qpos[idx], self.qvel[idx],
+                               act, udd_state)
+
+    def __setitem__(self, idx, state):
+        self.time[idx] = state.time
+        self.qpos[idx] = state.qpos
+        self.qvel[idx] = state.qvel
+        if self.act is not None:
+            self.act[idx] = state.act
+        for k, v in self.udd_state.items():
+            v[idx] = state.udd_state[k]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def _fields(self):
+        fields = [self.time, self.qpos, self.qvel]
+        if self.act is not None:
+            fields.append(self.act)
+        fields.extend(self.udd_state[k] for k in sorted(self.udd_state))
+        return fields
+
+    def __reduce_ex__(self, protocol):
+        buf = np.concatenate([np.ravel(f) for f in self._fields()]).astype(
+            np.float64, copy=False)
+        if protocol >= 5 and hasattr(pickle, 'PickleBuffer'):
+            buf = pickle.PickleBuffer(buf)
+        na = 0 if self.act is None else self.act.shape[1]
+        udd_schema = [(k, self.udd_state[k].shape[1:] or None)
+                      for k in sorted(self.udd_state)]
+        return (_unpack_state_batch,
+                (buf, len(self), self.qpos.shape[1], self.qvel.shape[1], na,
+                 udd_schema))
+
+
+def _unpack_state_batch(buf, n, nq, nv, na, udd_schema):
+    """
+    Builds an MjSimStateBatch whose fields are views into the flat float
+    buffer ``buf``, laid out field after field.
+    """
+    buf = np.frombuffer(buf, dtype=np.float64) if not isinstance(buf, np.ndarray) else buf
+    idx = 0
+    fields = []
+    for shape in [(), (nq,), (nv,), (na,)] + [shape or () for _, shape in udd_schema]:
+        size = n * int(np.prod(shape))
+        fields.append(buf[idx:idx + size].reshape((n,) + tuple(shape)))
+        idx += size
+    time, qpos, qvel, act = fields[:4]
+    udd_state = {k: f for (k, _), f in zip(udd_schema, fields[4:])}
+    return MjSimStateBatch(time, qpos, qvel, act if na != 0 else None, udd_state)
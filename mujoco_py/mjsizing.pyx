@@ -0,0 +1,39 @@
+from libc.math cimport ceil
+
+# Right-sizing of the preallocated mjData buffers (njmax, nconmax, nstack)
+# from the peak usage observed by MjSim.start_size_calibration.
+
+SizeRecommendation = namedtuple('SizeRecommendation', [
+    'njmax', 'nconmax', 'nstack', 'peak_nefc', 'peak_ncon', 'peak_stack'])
+
+
+cdef int _with_headroom(int peak, mjtNum headroom):
+    # Smallest size above the peak with the given relative headroom.
+    return max(peak + 1, <int> ceil(peak * (1 + headroom)))
+
+
+cdef _size_recommendation(int peak_efc, int peak_con, int peak_stack,
+                          mjtNum headroom):
+    if headroom < 0:
+        raise ValueError("headroom must be non-negative")
+    return SizeRecommendation(
+        _with_headroom(peak_efc, headroom), _with_headroom(peak_con, headroom),
+        _with_headroom(peak_stack, headroom), peak_efc, peak_con, peak_stack)
+
+
+cdef str _resized_model_xml(str xml_str, recommendation):
+    """ Sets njmax, nconmax and nstack of the <size> element of a model. """
+    dom = minidom.parseString(xml_str)
+    mujoco_node = dom.childNodes[0]
+    assert mujoco_node.tagName == 'mujoco'
+    size_elements = [node for node in mujoco_node.childNodes
+                     if getattr(node, 'tagName', None) == 'size']
+    if size_elements:
+        size_el = size_elements[0]
+    else:
+        size_el = dom.createElement('size')
+        mujoco_node.insertBefore(size_el, mujoco_node.firstChild)
+    size_el.setAttribute('njmax', str(recommendation.njmax))
+    size_el.setAttribute('nconmax', str(recommendation.nconmax))
+    size_el.setAttribute('nstack', str(recommendation.nstack))
+    return remove_empty_lines(dom.toprettyxml(indent=" " * 4))
@@ -0,0 +1,143 @@
+# Sparse (CSR) export of the mass matrix and the constraint Jacobian,
+# see PyMjData.mass_matrix and PyMjData.constraint_jacobian.
+#
+# CSR matrices are returned as (data, indices, indptr) tuples, which
+# scipy.sparse.csr_matrix accepts without copying:
+#
+#     M = scipy.sparse.csr_matrix(sim.data.mass_matrix(), shape=(nv, nv))
+
+
+cdef tuple _mass_matrix_structure(PyMjModel model):
+    """
+    Returns the CSR structure (indptr, indices) of the full mass matrix and
+    the index in ``qM`` of every nonzero. Computed once per model.
+
+    qM stores, for every dof i starting at dof_Madr[i], the entries of row i
+    in the columns of i and its ancestors along dof_parentid. The full
+    matrix is symmetric, so each off-diagonal entry appears twice.
+    """
+    cdef int nv = model.nv
+    cdef int i, j, adr
+    if model._qM_csr_structure is not None:
+        return model._qM_csr_structure
+    rows = [[] for _ in range(nv)]
+    for i in range(nv):
+        adr = model.dof_Madr[i]
+        j = i
+        while j >= 0:
+            rows[i].append((j, adr))
+            if j != i:
+                rows[j].append((i, adr))
+            j = model.dof_parentid[j]
+            adr += 1
+    indptr = np.zeros(nv + 1, dtype=np.intc)
+    indices = []
+    qM_index = []
+    for i in range(nv):
+        for j, adr in sorted(rows[i]):
+            indices.append(j)
+            qM_index.append(adr)
+        indptr[i + 1] = len(indices)
+    indices = np.array(indices, dtype=np.intc)
+    qM_index = np.array(qM_index, dtype=np.intc)
+    # The structure is shared by all calls, so protect it from changes.
+    for array in (indptr, indices, qM_index):
+        array.flags.writeable = False
+    model._qM_csr_structure = (indptr, indices, qM_index)
+    return model._qM_csr_structure
+
+
+cdef _mass_matrix(PyMjData data, format, out):
+    cdef const mjModel* m = data._model.ptr
+    cdef const mjData* d = data.ptr
+    cdef int nv = m.nv
+    cdef int k, nnz
+    cdef const int[::1] qM_index
+    cdef mjtNum* values
+
+    if format == 'dense':
+        out = _out_array('out', out, (nv, nv))
+        if nv > 0:
+            mj_fullM(m, <mjtNum*> np.PyArray_DATA(<np.ndarray> out), d.qM)
+        return out
+    if format != 'csr':
+        raise ValueError("format must be 'csr' or 'dense', got %r" % format)
+
+    indptr, indices, qM_index_arr = _mass_matrix_structure(data._model)
+    nnz = indices.shape[0]
+    out = _out_array('out', out, (nnz,))
+    if nnz > 0:
+        qM_index = qM_index_arr
+        values = <mjtNum*> np.PyArray_DATA(<np.ndarray> out)
+        with nogil:
+            for k in range(nnz):
+                values[k] = d.qM[qM_index[k]]
+    return out, indices, indptr
+
+
+cdef _constraint_jacobian(PyMjData data, format, out):
+    cdef const mjModel* m = data._model.ptr
+    cdef const mjData* d = data.ptr
+    cdef int nv = m.nv
+    cdef int nefc = d.nefc
+    cdef bint sparse = mj_isSparse(m)
+    cdef int r, c, k, adr, nnz
+    cdef mjtNum* dense
+    cdef mjtNum* values
+    cdef int* indices_ptr
+    cdef int* indptr_ptr
+
+    if format == 'dense':
+        out = _out_array('out', out, (nefc, nv))
+        if nefc == 0 or nv == 0:
+            return out
+        dense = <mjtNum*> np.PyArray_DATA(<np.ndarray> out)
+        if not sparse:
+            memcpy(dense, d.efc_J, nefc * nv * sizeof(mjtNum))
+            return out
+        with nogil:
+            mju_zero(dense, nefc * nv)
+            for r in range(nefc):
+                adr = d.efc_J_rowadr[r]
+                for k in range(d.efc_J_rownnz[r]):
+                    dense[r * nv + d.efc_J_colind[adr + k]] = d.efc_J[adr + k]
+        return out
+    if format != 'csr':
+        raise ValueError("format must be 'csr' or 'dense', got %r" % format)
+    if out is not None:
+        raise ValueError("out is only supported for format='dense', since "
+                         "the number of nonzeros changes between steps")
+
+    indptr = np.zeros(nefc + 1, dtype=np.intc)
+    indptr_ptr = <int*> np.PyArray_DATA(<np.ndarray> indptr)
+    nnz = 0
+    for r in range(nefc):
+        if sparse:
+            nnz += d.efc_J_rownnz[r]
+        else:
+            for c in range(nv):
+                if d.efc_J[r * nv + c] != 0:
+                    nnz += 1
+        indptr_ptr[r + 1] = nnz
+    values_arr = np.empty(nnz)
+    indices = np.empty(nnz, dtype=np.intc)
+    if nnz == 0:
+        return values_arr, indices, indptr
+    values = <mjtNum*> np.PyArray_DATA(<np.ndarray> values_arr)
+    indices_ptr = <int*> np.PyArray_DATA(<np.ndarray> indices)
+    with nogil:
+        k = 0
+        for r in range(nefc):
+            if sparse:
+                adr = d.efc_J_rowadr[r]
+                memcpy(values + k, d.efc_J + adr, d.efc_J_rownnz[r] * sizeof(mjtNum))
+                memcpy(indices_ptr + k, d.efc_J_colind + adr,
+                       d.efc_J_rownnz[r] * sizeof(int))
+                k += d.efc_J_rownnz[r]
+            else:
+                for c in range(nv):
+                    if d.efc_J[r * nv + c] != 0:
+                        values[k] = d.efc_J[r * nv + c]
+                        indices_ptr[k] = c
+                        k += 1
+    return values_arr, indices, indptr
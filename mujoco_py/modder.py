@@ -8,6 +8,11 @@ from mujoco_py import cymj
 
 
 class BaseModder():
+    """
+    Base class of the modders. Every setter calls ``sim.mark_dirty()``:
+    dirty tracking doesn't compare model parameters, so
+    ``sim.forward(if_dirty=True)`` wouldn't see the change otherwise.
+    """
 
     def __init__(self, sim, random_state=None):
         self.sim = sim
@@ -38,6 +43,7 @@ class LightModder(BaseModder):
         assert len(value) == 3, "Expected 3-dim value, got %s" % value
 
         self.model.light_pos[lightid] = value
+        self.sim.mark_dirty()
 
     def set_dir(self, name, value):
         lightid = self.get_lightid(name)
@@ -47,12 +53,14 @@ class LightModder(BaseModder):
         assert len(value) == 3, "Expected 3-dim value, got %s" % value
 
         self.model.light_dir[lightid] = value
+        self.sim.mark_dirty()
 
     def set_active(self, name, value):
         lightid = self.get_lightid(name)
         assert lightid > -1, "Unkwnown light %s" % name
 
         self.model.light_active[lightid] = value
+        self.sim.mark_dirty()
 
     def set_specular(self, name, value):
         lightid = self.get_lightid(name)
@@ -62,6 +70,7 @@ class LightModder(BaseModder):
         assert len(value) == 3, "Expected 3-dim value, got %s" % value
 
         self.model.light_specular[lightid] = value
+        self.sim.mark_dirty()
 
     def set_ambient(self, name, value):
         lightid = self.get_lightid(name)
@@ -71,6 +80,7 @@ class LightModder(BaseModder):
         assert len(value) == 3, "Expected 3-dim value, got %s" % value
 
         self.model.light_ambient[lightid] = value
+        self.sim.mark_dirty()
 
     def set_diffuse(self, name, value):
         lightid = self.get_lightid(name)
@@ -80,11 +90,13 @@ class LightModder(BaseModder):
         assert len(value) == 3, "Expected 3-dim value, got %s" % value
 
         self.model.light_diffuse[lightid] = value
+        self.sim.mark_dirty()
 
     def set_castshadow(self, name, value):
         lightid = self.get_lightid(name)
         assert lightid > -1, "Unkwnown light %s" % name
         self.model.light_castshadow[lightid] = value
+        self.sim.mark_dirty()
 
     def get_lightid(self, name):
         return self.model.light_name2id(name)
@@ -100,6 +112,7 @@ class CameraModder(BaseModder):
         assert 0 < value < 180
         assert camid > -1, "Unknown camera %s" % name
         self.model.cam_fovy[camid] = value
+        self.sim.mark_dirty()
 
     def get_quat(self, name):
         camid = self.get_camid(name)
@@ -113,6 +126,7 @@ class CameraModder(BaseModder):
         camid = self.get_camid(name)
         assert camid > -1, "Unknown camera %s" % name
         self.model.cam_quat[camid] = value
+        self.sim.mark_dirty()
 
     def get_pos(self, name):
         camid = self.get_camid(name)
@@ -126,6 +140,7 @@ class CameraModder(BaseModder):
         camid = self.get_camid(name)
         assert camid > -1
         self.model.cam_pos[camid] = value
+        self.sim.mark_dirty()
 
     def get_camid(self, name):
         return self.model.camera_name2id(name)
@@ -149,16 +164,19 @@ class MaterialModder(BaseModder):
         assert 0 <= value <= 1.0
         mat_id = self.get_mat_id(name)
         self.model.mat_specular[mat_id] = value
+        self.sim.mark_dirty()
 
     def set_shininess(self, name, value):
         assert 0 <= value <= 1.0
         mat_id = self.get_mat_id(name)
         self.model.mat_shininess[mat_id] = value
+        self.sim.mark_dirty()
 
     def set_reflectance(self, name, value):
         assert 0 <= value <= 1.0
         mat_id = self.get_mat_id(name)
         self.model.mat_reflectance[mat_id] = value
+        self.sim.mark_dirty()
 
     def set_texrepeat(self, name, repeat_x, repeat_y):
         mat_id = self.get_mat_id(name)
@@ -166,6 +184,7 @@ class MaterialModder(BaseModder):
         # relative to the extent of the body.
         self.model.mat_texuniform[mat_id] = 0
         self.model.mat_texrepeat[mat_id, :] = [repeat_x, repeat_y]
+        self.sim.mark_dirty()
 
     def rand_all(self, name):
         self.rand_specularity(name)
@@ -348,6 +367,7 @@ class TextureModder(BaseModder):
         Uploads the texture to the GPU so it's available in the rendering.
         """
         texture = self.get_texture(name)
+        self.sim.mark_dirty()
         if not self.sim.render_contexts:
             cymj.MjRenderContextOffscreen(self.sim)
         for render_context in self.sim.render_contexts:
@@ -370,6 +390,7 @@ class TextureModder(BaseModder):
                 self.model.mat_rgba[mat_id, :] = 1.0
         else:
             self.model.mat_rgba[:] = 1.0
+        self.sim.mark_dirty()
 
     def get_rand_rgb(self, n=1):
         def _rand_rgb():
@@ -0,0 +1,193 @@
+"""
+On-disk cache of compiled models, keyed by the content of the MJCF source.
+
+Compiling large XML models (especially ones with many meshes) is slow, while
+loading the equivalent MJB is almost free. ``ModelCache`` stores the MJB of
+every compiled model under a hash of the XML and all the asset files it
+references, so recompiling an unchanged model becomes a file read.
+"""
+import hashlib
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+from os.path import abspath, basename, dirname, exists, join
+
+import fasteners
+
+from mujoco_py.version import get_version
+
+
+class ModelCache:
+    """
+    Content-addressed cache of compiled models.
+
+    Entries are MJB files named by the hash of the XML source and all
+    referenced asset files (meshes, textures, height fields, skins and
+    included XML). The cache is safe to share between processes: entries
+    are written to a temporary file and atomically renamed into place, and
+    eviction runs under an inter-process lock.
+
+    Pass an instance as ``cache`` to :func:`mujoco_py.load_model_from_path`
+    or :func:`mujoco_py.load_model_from_xml`.
+
+    Args:
+    - path (str): directory holding the cache entries. Created if missing.
+    - max_bytes (int): total size the cache is trimmed to after a write,
+        evicting least recently used entries first. None means unbounded.
+    """
+
+    SUFFIX = '.mjb'
+
+    def __init__(self, path, max_bytes=1024 ** 3):
+        self.path = abspath(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.path, exist_ok=True)
+        self._lock = fasteners.InterProcessLock(
+            join(self.path, 'mujocopy-cachelock'))
+
+    def key_for_xml(self, xml_str, base_dir=None, assets=None):
+        """
+        Returns the cache key for an XML string, or None if the XML cannot
+        be parsed (the caller should then compile without the cache).
+
+        Args:
+        - xml_str (str): MJCF source.
+        - base_dir (str): directory that relative asset paths are resolved
+            against. Defaults to the current working directory.
+        - assets (dict): in-memory assets, mapping file names to contents.
+            These take precedence over files on disk, like in the VFS.
+        """
+        h = hashlib.sha256()
+        h.update(get_version().encode())
+        h.update(b'\0')
+        try:
+            self._hash_xml(h, xml_str.encode(), base_dir or os.getcwd(),
+                           assets or {}, {}, set())
+        except ET.ParseError:
+            return None
+        return h.hexdigest()
+
+    def key_for_path(self, path, assets=None):
+        """ Returns the cache key for an XML file on disk. """
+        with open(path) as f:
+            xml_str = f.read()
+        return self.key_for_xml(xml_str, dirname(abspath(path)), assets)
+
+    def _hash_xml(self, h, xml_bytes, base_dir, assets, dirs, seen):
+        h.update(xml_bytes)
+        root = ET.fromstring(xml_bytes)
+        # Asset directories are set by <compiler> and, like in MuJoCo,
+        # apply to the whole model including included files.
+        for compiler in root.iter('compiler'):
+            for attr in ('meshdir', 'texturedir'):
+                if attr in compiler.attrib:
+                    dirs[attr] = compiler.attrib[attr]
+        for el in root.iter():
+            for attr, filename in sorted(el.attrib.items()):
+                if not attr.startswith('file'):
+                    continue
+                if el.tag == 'include':
+                    asset_dir = base_dir
+                elif el.tag in ('mesh', 'skin'):
+                    asset_dir = join(base_dir, dirs.get('meshdir', ''))
+                else:
+                    asset_dir = join(base_dir, dirs.get('texturedir', ''))
+                h.update(b'\0' + filename.encode() + b'\0')
+                content = self._read_asset(join(asset_dir, filename), assets)
+                if content is None:
+                    continue
+                if el.tag == 'include' and filename not in seen:
+                    seen.add(filename)
+                    self._hash_xml(h, content, base_dir, assets, dirs, seen)
+                else:
+                    h.update(hashlib.sha256(content).digest())
+
+    @staticmethod
+    def _read_asset(path, assets):
+        # The VFS matches file names without their directory.
+        name = basename(path)
+        if name in assets:
+            content = assets[name]
+            return content.encode() if isinstance(content, str) else bytes(content)
+        if exists(path):
+            with open(path, 'rb') as f:
+                return f.read()
+        return None
+
+    def _entry_path(self, key):
+        return join(self.path, key + self.SUFFIX)
+
+    def get(self, key):
+        """ Returns the cached MJB bytes for ``key``, or None on a miss. """
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                mjb = f.read()
+            # Bump the modification time, which serves as LRU timestamp.
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return mjb
+
+    def put(self, key, mjb):
+        """ Stores MJB bytes under ``key`` and trims the cache to size. """
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(mjb)
+            os.replace(tmp_path, self._entry_path(key))
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(self.SUFFIX):
+                continue
+            try:
+                st = os.stat(join(self.path, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        return entries
+
+    def evict(self, max_bytes):
+        """ Removes least recently used entries until at most ``max_bytes`` remain. """
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in entries:
+                if total <= max_bytes:
+                    break
+                try:
+                    os.remove(join(self.path, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def clear(self):
+        """ Removes all entries and resets the statistics. """
+        self.evict(0)
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """
+        Returns a dict with the hit/miss counts of this instance and the
+        number and total size of entries currently in the cache.
+        """
+        entries = self._entries()
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries)}
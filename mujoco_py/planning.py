@@ -0,0 +1,103 @@
+"""
+Sampling-based model predictive control.
+
+:class:`MPPI` plans by rolling out many noisy copies of a nominal control
+sequence in parallel on private copies of the simulation data, scoring them
+with a compiled C cost function. Sampling, rollouts, cost accumulation and
+the importance-weighted update all run in C without the GIL.
+"""
+import numpy as np
+from mujoco_py import cymj
+from mujoco_py.builder import build_callback_fn
+
+
+class MPPI(object):
+    """
+    Model predictive path integral controller.
+
+    Args:
+    - sim (MjSim): simulation to plan for. Rollouts start from the current
+        state of ``sim.data``, which is left untouched, and use its
+        ``nsubsteps`` and substep callbacks: every control of the plan is held
+        for one :meth:`MjSim.step`.
+    - cost_fn (str or int): running cost as C source, or a function pointer
+        from :func:`mujoco_py.builder.build_callback_fn`. The function must
+        be named ``fun`` and write the cost of the state after each step to
+        ``out[0]``::
+
+            void fun(const mjModel* m, const mjData* d, mjtNum* out) {
+                out[0] = d->qpos[0] * d->qpos[0];
+            }
+
+        This is the signature of reward callbacks (see
+        :meth:`MjSim.set_reward_callback`), and likewise a non-zero
+        ``out[1]`` ends the rollout. The cost it ends with is charged for
+        the rest of the horizon, so a failure state should have a high
+        cost. Like substep callbacks, the source can use the userdata names
+        of the model.
+    - horizon (int): number of steps of the plan.
+    - num_samples (int): number of rollouts per :meth:`plan`.
+    - noise_sigma (float or array of shape (nu,)): standard deviation of the
+        control noise.
+    - temperature (float): lower values weight the best rollouts more.
+    - nthreads (int): number of threads, defaults to OpenMP's maximum.
+    - seed (int): seed of the noise.
+
+    Controls are clipped to ``actuator_ctrlrange`` of limited actuators.
+
+    Example::
+
+        mppi = MPPI(sim, cost_src, horizon=30, num_samples=256)
+        while True:
+            sim.data.ctrl[:] = mppi.plan()[0]
+            sim.step()
+            mppi.shift()
+    """
+
+    def __init__(self, sim, cost_fn, horizon, num_samples=256,
+                 noise_sigma=0.1, temperature=1.0, nthreads=None, seed=None):
+        model = sim.model
+        if isinstance(cost_fn, str):
+            cost_fn = build_callback_fn(cost_fn, model.userdata_names)
+        if not isinstance(cost_fn, int):
+            raise TypeError('cost_fn must be C source or a function pointer')
+        self.sim = sim
+        self.cost_fn_ptr = cost_fn
+        self.temperature = temperature
+        self.nthreads = nthreads
+        self.noise_sigma = np.array(np.broadcast_to(noise_sigma, (model.nu,)),
+                                    dtype=np.float64)
+        limited = model.actuator_ctrllimited.astype(bool)
+        self.ctrl_low = np.where(limited, model.actuator_ctrlrange[:, 0], -np.inf)
+        self.ctrl_high = np.where(limited, model.actuator_ctrlrange[:, 1], np.inf)
+        #: Nominal control sequence of shape (horizon, nu), updated by plan().
+        self.nominal = np.zeros((horizon, model.nu))
+        #: Controls of all rollouts of the last plan(), of shape
+        #: (num_samples, horizon, nu). The first is the previous nominal.
+        self.samples = np.zeros((num_samples, horizon, model.nu))
+        #: Costs of the rollouts of the last plan().
+        self.costs = np.zeros(num_samples)
+        self._rng = np.random.RandomState(seed)
+
+    def plan(self):
+        """
+        Runs one MPPI iteration from the current state of the simulation and
+        returns the updated nominal control sequence.
+        """
+        cymj._mppi_update(self.sim, self.cost_fn_ptr, self.nominal,
+                          self.samples, self.costs, self.noise_sigma,
+                          self.ctrl_low, self.ctrl_high, self.temperature,
+                          self._rng.randint(2 ** 63, dtype=np.uint64),
+                          self.nthreads)
+        return self.nominal
+
+    def shift(self):
+        """
+        Drops the first control of the nominal sequence, after it has been
+        applied, and repeats the last one to keep the horizon.
+        """
+        self.nominal[:-1] = self.nominal[1:]
+
+    def reset(self):
+        """ Resets the nominal control sequence to zeros. """
+        self.nominal[:] = 0
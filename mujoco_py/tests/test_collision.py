@@ -0,0 +1,62 @@
+import numpy as np
+
+from mujoco_py import load_model_from_xml, MjSim
+from mujoco_py.collision import (candidate_body_pairs, find_prunable_pairs,
+                                 prune_collision_pairs, sample_joint_qpos)
+
+# Three spheres on a common base: a and b slide along y on either side of
+# the base and can't reach each other, while c slides along x and can reach
+# both. The floor is in another tree than the spheres.
+TREE_XML = """
+<mujoco>
+    <worldbody>
+        <geom name="floor" type="plane" size="5 5 .1"/>
+        <body name="base" pos="0 0 1">
+            <joint type="slide" axis="0 0 1" limited="true" range="0 .2"/>
+            <geom type="sphere" size=".05"/>
+            <body name="a" pos=".5 0 0">
+                <joint type="slide" axis="0 1 0" limited="true" range="-1 1"/>
+                <geom type="sphere" size=".1"/>
+            </body>
+            <body name="b" pos="-.5 0 0">
+                <joint type="slide" axis="0 1 0" limited="true" range="-1 1"/>
+                <geom type="sphere" size=".1"/>
+            </body>
+            <body name="c" pos=".5 .5 0">
+                <joint type="slide" axis="1 0 0" limited="true" range="-1 1"/>
+                <geom type="sphere" size=".1"/>
+            </body>
+        </body>
+    </worldbody>
+</mujoco>
+"""
+
+
+def test_prune_collision_pairs():
+    model = load_model_from_xml(TREE_XML)
+    sim = MjSim(model)
+    a, b, c = (model.body_name2id(name) for name in 'abc')
+    # Children of base are filtered as its children
+    assert candidate_body_pairs(model) == [(a, b), (a, c), (b, c)]
+    assert len(candidate_body_pairs(model, self_collisions_only=False)) == 7
+
+    qpos = sample_joint_qpos(model, 500, seed=0)
+    assert qpos.shape == (500, model.nq)
+    assert np.all(np.abs(qpos[:, 1:]) <= 1)
+    assert np.all((qpos[:, 0] >= 0) & (qpos[:, 0] <= .2))
+
+    assert find_prunable_pairs(sim, qpos, nthreads=2) == [(a, b)]
+    assert find_prunable_pairs(sim, qpos, nthreads=1) == [(a, b)]
+    # The floor is never within reach of the spheres either
+    pairs = find_prunable_pairs(sim, qpos, self_collisions_only=False)
+    assert len(pairs) == 5
+    assert (a, b) in pairs
+    # A margin wider than the gap between a and b keeps them
+    assert find_prunable_pairs(sim, qpos, margin=1.5) == []
+
+    result = prune_collision_pairs(sim, num_samples=500, seed=0, nsteps=100)
+    assert result.pairs == [('a', 'b')]
+    assert result.model.nexclude == 1
+    assert candidate_body_pairs(result.model) == [(a, c), (b, c)]
+    assert result.step_time > 0 and result.pruned_step_time > 0
+    assert result.speedup == result.step_time / result.pruned_step_time
@@ -1,5 +1,6 @@
 import glob
 import os
+import pickle
 import shutil
 import sys
 import time
@@ -16,7 +17,8 @@ from numpy.testing import assert_array_equal, assert_array_almost_equal
 
 from mujoco_py import (
     MjSim, load_model_from_xml,
-    load_model_from_path, MjSimState,
+    load_model_from_path, MjSimState, MjSimStateWithWarmstart, StateLayout,
+    MjSimStateBatch,
     ignore_mujoco_warnings,
     load_model_from_mjb
 )
@@ -101,6 +103,11 @@ def test_model_save_load():
     mjb_from_model = model.get_mjb()
     model_from_mjb = load_model_from_mjb(mjb_from_model)
     assert(mjb_from_model == model_from_mjb.get_mjb())
+    buf = bytearray(functions.mj_sizeModel(model) + 10)
+    written = model.get_mjb(out=buf)
+    assert(bytes(written) == mjb_from_model)
+    with pytest.raises(ValueError):
+        model.get_mjb(out=bytearray(10))
 
 
 def test_sim_save():
@@ -124,6 +131,49 @@ def test_sim_save():
         assert loaded_model.nkey == 1
 
 
+def _udd_counter(sim):
+    count = sim.udd_state.get("count", 0) if sim.udd_state else 0
+    return {"count": count + 1, "arr": np.ones(2) * count}
+
+
+def test_pickle():
+    xml = BASIC_MODEL_XML.replace("<mujoco>", '<mujoco><size nuserdata="1"/>')
+    model = load_model_from_xml(xml)
+    sim = MjSim(model, nsubsteps=3, udd_callback=_udd_counter,
+                userdata_names=["foo"])
+    for _ in range(5):
+        sim.step()
+
+    for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+        sim2 = pickle.loads(pickle.dumps(sim, protocol=protocol))
+        assert sim2.nsubsteps == 3
+        assert sim2.model.userdata_names == ("foo",)
+        assert sim2.get_state() == sim.get_state()
+        assert sim2.model.get_mjb() == sim.model.get_mjb()
+        assert_array_equal(sim2.data.xpos, sim.data.xpos)
+        assert sim2.data.ncon == sim.data.ncon
+        sim.step()
+        sim2.step()
+        assert sim2.get_state() == sim.get_state()
+
+    if pickle.HIGHEST_PROTOCOL >= 5:
+        buffers = []
+        payload = pickle.dumps(sim, protocol=5,
+                               buffer_callback=buffers.append)
+        assert len(buffers) == 2
+        sim2 = pickle.loads(payload, buffers=buffers)
+        assert sim2.get_state() == sim.get_state()
+
+    data = pickle.loads(pickle.dumps(sim.data))
+    assert_array_equal(data.qpos, sim.data.qpos)
+
+    # A raw function pointer is never called here, only refused by pickle
+    sim.set_substep_callback(1)
+    with pytest.raises(pickle.PicklingError):
+        pickle.dumps(sim)
+    sim.set_substep_callback(None)
+
+
 def test_mj_sim_buffers():
     model = load_model_from_xml(BASIC_MODEL_XML)
 
@@ -339,6 +389,495 @@ def test_sim_state():
     assert state.udd_state == sim.udd_state
 
 
+def test_state_layout():
+    model = load_model_from_xml(BASIC_MODEL_XML)
+    d = {"foo": 10, "foo_2darray": np.arange(4.0).reshape((2, 2))}
+    sim = MjSim(model, udd_callback=lambda sim: d)
+    sim.data.qpos[:] = np.arange(sim.model.nq)
+    state = sim.get_state()
+
+    layout = StateLayout(sim)
+    assert layout.size == len(state.flatten())
+    buf = np.zeros(layout.size)
+    assert layout.flatten_into(buf, state) is buf
+    assert_array_equal(buf, state.flatten())
+    buf[:] = 0
+    layout.flatten_into(buf)
+    assert_array_equal(buf, state.flatten())
+
+    view = layout.unflatten_view(buf)
+    assert view == state
+    buf[layout.qpos_slice] = -1
+    assert_array_equal(view.qpos, -1)
+    buf[-1] = 42
+    assert view.udd_state["foo_2darray"][1, 1] == 42
+
+
+def test_state_batch():
+    model = load_model_from_xml(BASIC_MODEL_XML)
+    d = {"foo": 10, "foo_array": np.arange(3.0)}
+    sim = MjSim(model, udd_callback=lambda sim: d)
+    states = []
+    for _ in range(4):
+        sim.step()
+        states.append(sim.get_state())
+
+    batch = MjSimStateBatch.from_states(states)
+    assert len(batch) == 4
+    assert batch.qpos.shape == (4, sim.model.nq)
+    assert batch[2] == states[2]
+    assert len(batch[1:3]) == 2
+    assert batch[1:3][0] == states[1]
+
+    batch2 = sim.get_state_batch(4)
+    assert batch2[3] == states[3]
+    batch2[0] = states[0]
+    sim.set_state(batch2, 0)
+    assert sim.get_state() == states[0]
+
+    for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+        batch3 = pickle.loads(pickle.dumps(batch, protocol=protocol))
+        assert all(a == b for a, b in zip(batch3, states))
+
+
+def test_get_state_into_set_state_no_copy():
+    model = load_model_from_xml(BASIC_MODEL_XML)
+    d = {"foo": 10, "foo_array": np.arange(3.0)}
+    sim = MjSim(model, udd_callback=lambda sim: d)
+    sim.step()
+    out = sim.get_state()
+    qpos = out.qpos
+    sim.step()
+    d["foo"] = 11
+    sim.step()
+    out = sim.get_state_into(out)
+    assert out.qpos is qpos
+    assert out == sim.get_state()
+    assert out.udd_state["foo"] == 11
+
+    batch = MjSimStateBatch.empty(sim, 2)
+    sim.get_state_into(batch, 1)
+    assert batch[1] == sim.get_state()
+
+    state = sim.get_state()
+    sim.step()
+    sim.set_state(state, copy=False)
+    assert sim.get_state() == state
+    assert sim.udd_state["foo_array"] is state.udd_state["foo_array"]
+    state.qpos[0] = -1
+    assert sim.data.qpos[0] != -1
+
+
+def test_warmstart_state():
+    model = load_model_from_xml(BASIC_MODEL_XML)
+    sim = MjSim(model)
+    for _ in range(10):
+        sim.step()
+    assert sim.get_state().qacc_warmstart is None
+    state = sim.get_state(warmstart=True)
+    assert_array_equal(state.qacc_warmstart, sim.data.qacc_warmstart)
+    sim.step()
+    qpos = sim.data.qpos.copy()
+
+    sim.data.qacc_warmstart[:] = 0
+    sim.set_state(state)
+    assert_array_equal(sim.data.qacc_warmstart, state.qacc_warmstart)
+    sim.step()
+    assert_array_equal(sim.data.qpos, qpos)
+    assert len(state.flatten()) == len(sim.get_state().flatten())
+
+    # Still a five-field MjSimState
+    time, qpos, qvel, act, udd_state = state
+    assert len(state) == 5 and isinstance(state, MjSimState)
+    assert state == MjSimState(*state)
+    replaced = state._replace(time=0)
+    assert replaced.time == 0 and isinstance(replaced, MjSimStateWithWarmstart)
+    assert replaced.qacc_warmstart is state.qacc_warmstart
+    assert_array_equal(pickle.loads(pickle.dumps(state)).qacc_warmstart,
+                       state.qacc_warmstart)
+
+
+def test_typed_udd_state():
+    model = load_model_from_xml(BASIC_MODEL_XML)
+    sim = MjSim(model)
+    fn = """
+        void fun(const mjModel* m, const mjData* d, mjtNum* udd) {
+            steps += 1;
+            for (int i = 0; i < 3; i++) {
+                min_vel[i] = mju_min(min_vel[i], d->qvel[i]);
+            }
+        }
+    """
+    sim.set_udd_schema({'steps': (), 'min_vel': 3}, fn)
+    assert sim.udd_schema == (('min_vel', (3,)), ('steps', ()))
+    assert sim.udd_buffer.shape == (4,)
+    for _ in range(10):
+        sim.step()
+    assert sim.udd_state['steps'] == 10
+    assert sim.udd_buffer[3] == 10
+    assert sim.udd_state['min_vel'][2] < 0
+
+    # States and flattening carry a copy of the buffer
+    state = sim.get_state()
+    assert_array_equal(state.flatten()[-4:], sim.udd_buffer)
+    sim.step()
+    assert sim.udd_state['steps'] == 11
+    sim.set_state(state)
+    assert sim.udd_state['steps'] == 10
+    sim.set_state_from_flattened(state.flatten())
+    assert sim.get_state() == state
+    layout = StateLayout(sim)
+    assert_array_equal(layout.flatten_into(np.empty(layout.size))[-4:],
+                       sim.udd_buffer)
+
+    sim2 = pickle.loads(pickle.dumps(sim))
+    assert sim2.get_state() == state
+    sim2.step()
+    assert sim2.udd_state['steps'] == 11
+
+    sim.reset()
+    assert_array_equal(sim.udd_buffer, 0)
+    # The views stay attached to the buffer
+    sim.udd_state['steps'][...] = 5
+    assert sim.udd_buffer[3] == 5
+
+    sim.udd_callback = None
+    assert sim.udd_buffer is None
+    assert sim.udd_state == {}
+
+
+def test_contact_events():
+    xml = """
+        <mujoco>
+            <worldbody>
+                <geom name="floor" type="plane" size="1 1 .1"/>
+                <body name="ball" pos="0 0 .2">
+                    <joint type="free"/>
+                    <geom name="ball" size=".1"/>
+                </body>
+            </worldbody>
+        </mujoco>
+    """
+    model = load_model_from_xml(xml)
+    sim = MjSim(model, nsubsteps=100)
+    assert sim.contact_events is None
+    sim.enable_contact_events()
+    sim.data.qvel[2] = -1
+    sim.step()
+    events = sim.contact_events.copy()
+    assert len(events) == 1
+    event = events[0]
+    assert event['begin'] == 1
+    assert (event['geom1'], event['geom2']) == (model.geom_name2id('floor'),
+                                                model.geom_name2id('ball'))
+    assert 0 < event['time'] < sim.data.time
+    assert event['dist'] < 0.01
+    assert event['normal_force'] > 0
+    sim.step()
+    assert len(sim.contact_events) == 0
+
+    # Lift off within one step
+    sim.data.qvel[2] = 5
+    sim.step()
+    assert len(sim.contact_events) == 1
+    assert sim.contact_events[0]['begin'] == 0
+
+    # Contacts existing at the reset begin in the first step
+    sim.reset()
+    sim.data.qpos[2] = .09
+    sim.step()
+    assert list(sim.contact_events['begin']) == [1]
+
+    # Overflowing events drop the oldest
+    sim.enable_contact_events(capacity=1)
+    sim.data.qpos[2] = .09
+    sim.data.qvel[2] = 5
+    sim.step()
+    assert sim.contact_events_dropped == 1
+    assert list(sim.contact_events['begin']) == [0]
+
+    sim.disable_contact_events()
+    sim.step()
+    assert sim.contact_events is None
+
+
+def test_size_calibration():
+    model = load_model_from_xml(BASIC_MODEL_XML)
+    sim = MjSim(model)
+    sim.start_size_calibration()
+    for _ in range(400):
+        sim.step()
+    ncon = sim.data.ncon
+    assert ncon > 0
+    sim.reset()  # peaks are kept over resets
+    rec = sim.size_recommendation(headroom=0.5)
+    assert rec.peak_ncon >= ncon
+    assert rec.peak_nefc > 0
+    assert rec.nconmax >= 1.5 * rec.peak_ncon
+    assert rec.njmax >= 1.5 * rec.peak_nefc
+    assert rec.nstack >= 1.5 * rec.peak_stack
+    assert rec.njmax < model.njmax
+
+    resized = sim.resized_model(headroom=0.5)
+    assert (resized.njmax, resized.nconmax, resized.nstack) == rec[:3]
+    # The smaller buffers don't change the simulation
+    sim2 = MjSim(resized)
+    for _ in range(400):
+        sim.step()
+        sim2.step()
+    assert_array_almost_equal(sim2.data.qpos, sim.data.qpos)
+
+
+def test_fast_reset():
+    model = load_model_from_xml(BASIC_MODEL_XML)
+    sim = MjSim(model)
+    with pytest.raises(RuntimeError):
+        sim.fast_reset()
+    sim.data.qpos[:3] = [1, 2, 3]
+    sim.set_reset_snapshot()
+    state = sim.get_state()
+    xpos = sim.data.body_xpos.copy()
+    for _ in range(10):
+        sim.step()
+    assert sim.get_state() != state
+    sim.fast_reset()
+    assert sim.get_state() == state
+    assert_array_equal(sim.data.body_xpos, xpos)
+
+    sims = [MjSim(model) for _ in range(3)]
+    for s in sims:
+        s.set_reset_snapshot()
+        s.step()
+    cymj.fast_reset_sims(sims, mask=[True, False, True])
+    assert sims[0].data.time == 0
+    assert sims[1].data.time > 0
+    assert sims[2].data.time == 0
+
+
+def test_dirty_tracking():
+    model = load_model_from_xml(BASIC_MODEL_XML)
+    sim = MjSim(model)
+    assert sim.dirty
+    sim.forward()
+    assert not sim.dirty
+    sim.data.qpos[0] = 1
+    assert sim.dirty
+    sim.forward(if_dirty=True)
+    assert not sim.dirty
+    assert sim.data.body_xpos[1][0] == 1
+
+    # Writes of the same values don't dirty the data
+    sim.set_state(sim.get_state())
+    assert not sim.dirty
+    # Skipped forward leaves stale derived quantities alone
+    sim.data.body_xpos[1][0] = 5
+    sim.forward(if_dirty=True)
+    assert sim.data.body_xpos[1][0] == 5
+    sim.forward()
+    assert sim.data.body_xpos[1][0] == 1
+
+    sim.model.opt.timestep *= 2
+    assert sim.dirty
+    sim.forward()
+    sim.model.body_pos[1][0] = 1
+    assert not sim.dirty
+    sim.mark_dirty()
+    assert sim.dirty
+    sim.forward()
+    sim.step()
+    assert sim.dirty
+
+
+DOUBLE_PENDULUM_XML = """
+<mujoco>
+    <worldbody>
+        <body name="link1" pos="0 0 1">
+            <joint name="hinge" type="hinge" axis="0 1 0" damping=".1"/>
+            <geom type="capsule" fromto="0 0 0 .5 0 0" size=".05"/>
+            <body name="link2" pos=".5 0 0">
+                <joint name="ball" type="ball" damping=".1"/>
+                <geom type="capsule" fromto="0 0 0 .5 0 0" size=".05"/>
+                <site name="tip" pos=".5 0 0"/>
+            </body>
+            <camera name="follow" pos="0 -1 0" mode="targetbodycom" target="link2"/>
+        </body>
+    </worldbody>
+    <actuator>
+        <motor joint="hinge" gear="2"/>
+    </actuator>
+</mujoco>
+"""
+
+
+def test_dynamics_derivatives():
+    model = load_model_from_xml(DOUBLE_PENDULUM_XML)
+    sim = MjSim(model)
+    nv = model.nv
+    sim.data.qpos[1:] = [np.cos(.2), 0, np.sin(.2), 0]
+    sim.data.qvel[:] = [.3, .1, -.2, .4]
+    state = sim.get_state()
+    deriv = sim.dynamics_derivatives(eps=1e-6)
+    assert sim.get_state() == state
+    assert deriv.dqacc_dqpos.shape == (nv, nv)
+    assert deriv.dqacc_dqvel.shape == (nv, nv)
+    assert deriv.dqacc_dact.shape == (nv, 0)
+    assert deriv.dqacc_dctrl.shape == (nv, 1)
+    assert deriv.A.shape == (2 * nv, 2 * nv)
+    assert deriv.B.shape == (2 * nv, 1)
+
+    M = np.zeros(nv * nv)
+    functions.mj_fullM(model, M, sim.data.qM)
+    expected = np.linalg.solve(M.reshape(nv, nv), [2, 0, 0, 0])
+    assert_array_almost_equal(deriv.dqacc_dctrl[:, 0], expected, decimal=4)
+    dt = model.opt.timestep
+    assert_array_almost_equal(deriv.B[nv:, 0], dt * expected, decimal=5)
+
+    eps = 1e-6
+    for j in range(nv):
+        qacc = []
+        for sign in (1, -1):
+            sim.set_state(state)
+            sim.data.qvel[j] += sign * eps
+            sim.forward()
+            qacc.append(sim.data.qacc.copy())
+        assert_array_almost_equal(deriv.dqacc_dqvel[:, j],
+                                  (qacc[0] - qacc[1]) / (2 * eps), decimal=4)
+
+    sim.set_state(state)
+    forward_deriv = sim.dynamics_derivatives(eps=1e-6, centered=False,
+                                             transition=False, nthreads=1)
+    assert forward_deriv.A is None
+    assert_array_almost_equal(forward_deriv.dqacc_dqpos, deriv.dqacc_dqpos, decimal=3)
+
+
+def test_inverse_dynamics():
+    model = load_model_from_xml(DOUBLE_PENDULUM_XML)
+    sim = MjSim(model)
+    sim.data.ctrl[0] = 1
+    qpos, qvel, qacc = [], [], []
+    for _ in range(20):
+        sim.step()
+        qpos.append(sim.data.qpos.copy())
+        qvel.append(sim.data.qvel.copy())
+        qacc.append(sim.data.qacc.copy())
+
+    qfrc, qfrc_constraint = sim.inverse_dynamics(qpos, qvel, qacc,
+                                                 constraint_forces=True)
+    assert qfrc.shape == (20, model.nv)
+    assert qfrc_constraint.shape == (20, model.nv)
+    for i in (0, 19):
+        sim.data.qpos[:] = qpos[i]
+        sim.data.qvel[:] = qvel[i]
+        sim.data.qacc[:] = qacc[i]
+        functions.mj_inverse(model, sim.data)
+        assert_array_almost_equal(qfrc[i], sim.data.qfrc_inverse)
+
+    out = np.zeros((20, model.nv))
+    assert sim.inverse_dynamics(qpos, qvel, qacc, out=out, nthreads=2) is out
+    assert_array_almost_equal(out, qfrc)
+    with pytest.raises(ValueError):
+        sim.inverse_dynamics(qpos, qvel[1:], qacc)
+
+
+def test_kinematics_batch():
+    model = load_model_from_xml(DOUBLE_PENDULUM_XML)
+    sim = MjSim(model)
+    qpos = np.random.RandomState(0).uniform(-1, 1, size=(50, model.nq))
+    site_xpos = np.zeros((50, 1, 3))
+    result = sim.kinematics_batch(qpos, ('site_xpos', 'body_xquat', 'subtree_com'),
+                                  out={'site_xpos': site_xpos}, nthreads=3)
+    assert result['site_xpos'] is site_xpos
+    assert result['body_xquat'].shape == (50, model.nbody, 4)
+    for i in (0, 17, 49):
+        sim.data.qpos[:] = qpos[i]
+        sim.forward()
+        assert_array_almost_equal(site_xpos[i], sim.data.site_xpos)
+        assert_array_almost_equal(result['body_xquat'][i], sim.data.body_xquat)
+        assert_array_almost_equal(result['subtree_com'][i], sim.data.subtree_com)
+    with pytest.raises(ValueError):
+        sim.kinematics_batch(qpos, ['qacc'])
+
+    # Cameras come from mj_camlight, not from the pose copied from sim.data
+    result = sim.kinematics_batch(qpos[:2], ('cam_xpos', 'cam_xmat'))
+    for i in (0, 1):
+        sim.data.qpos[:] = qpos[i]
+        sim.forward()
+        assert_array_almost_equal(result['cam_xpos'][i], sim.data.cam_xpos)
+        assert_array_almost_equal(result['cam_xmat'][i], sim.data.cam_xmat)
+    assert not np.allclose(result['cam_xmat'][0], result['cam_xmat'][1])
+
+
+def test_jacobians_velocities():
+    model = load_model_from_xml(DOUBLE_PENDULUM_XML)
+    sim = MjSim(model)
+    nv = model.nv
+    sim.data.qpos[1:] = [np.cos(.2), 0, np.sin(.2), 0]
+    sim.data.qvel[:] = [.3, .1, -.2, .4]
+    sim.forward()
+
+    jac = sim.data.jacobians('site', ['tip'], part='both')
+    assert jac.shape == (1, 6, nv)
+    assert_array_almost_equal(jac[0, 3:], sim.data.get_site_jacp('tip').reshape(3, nv))
+    assert_array_almost_equal(jac[0, :3], sim.data.get_site_jacr('tip').reshape(3, nv))
+    vel = sim.data.velocities('site', ['tip'])
+    assert_array_almost_equal(vel[0], jac[0].dot(sim.data.qvel))
+    assert_array_almost_equal(vel[0, 3:], sim.data.get_site_xvelp('tip'))
+
+    out = np.zeros((model.nbody, 3, nv))
+    assert sim.data.jacobians('body', out=out) is out
+    assert_array_almost_equal(out.reshape(model.nbody, -1), sim.data.body_jacp)
+    body_ids = [model.body_name2id('link1'), model.body_name2id('link2')]
+    vel = sim.data.velocities('body', body_ids, out=np.zeros((2, 6)))
+    assert_array_almost_equal(vel[:, :3], sim.data.body_xvelr[1:])
+    assert_array_almost_equal(vel[:, 3:], sim.data.body_xvelp[1:])
+    with pytest.raises(ValueError):
+        sim.data.jacobians('joint')
+    with pytest.raises(ValueError):
+        sim.data.velocities('site', out=np.zeros(6))
+
+
+def _csr_to_dense(csr, shape):
+    values, indices, indptr = csr
+    dense = np.zeros(shape)
+    for row in range(shape[0]):
+        cols = indices[indptr[row]:indptr[row + 1]]
+        dense[row, cols] = values[indptr[row]:indptr[row + 1]]
+    return dense
+
+
+def test_sparse_matrices():
+    model = load_model_from_xml(DOUBLE_PENDULUM_XML)
+    sim = MjSim(model)
+    nv = model.nv
+    sim.data.qpos[1:] = [np.cos(.2), 0, np.sin(.2), 0]
+    sim.forward()
+    M = sim.data.mass_matrix('dense')
+    csr = sim.data.mass_matrix()
+    assert_array_almost_equal(_csr_to_dense(csr, (nv, nv)), M)
+    assert_array_almost_equal(M, M.T)
+    # The structure is cached and only the values are refreshed.
+    values = np.zeros_like(csr[0])
+    csr2 = sim.data.mass_matrix(out=values)
+    assert csr2[0] is values
+    assert csr2[1] is csr[1] and csr2[2] is csr[2]
+
+    model = load_model_from_xml(BASIC_MODEL_XML)
+    sim = MjSim(model)
+    for _ in range(500):
+        sim.step()
+    assert sim.data.nefc > 0
+    shape = (sim.data.nefc, model.nv)
+    model.opt.jacobian = const.JAC_DENSE
+    sim.forward()
+    J = sim.data.constraint_jacobian('dense')
+    assert_array_almost_equal(J, sim.data.efc_J[:sim.data.nefc])
+    assert_array_almost_equal(_csr_to_dense(sim.data.constraint_jacobian(), shape), J)
+    model.opt.jacobian = const.JAC_SPARSE
+    sim.forward()
+    assert_array_almost_equal(sim.data.constraint_jacobian('dense'), J)
+    assert_array_almost_equal(_csr_to_dense(sim.data.constraint_jacobian(), shape), J)
+
+
 def test_mj_warning_raises():
     ''' Test that MuJoCo warnings cause exceptions. '''
     # Two boxes on a plane need more than 1 contact (nconmax)
@@ -664,6 +1203,20 @@ def test_xml_from_path():
         1, "include should be parsed and not present"
 
 
+def test_load_from_memory_assets():
+    with open("mujoco_py/tests/test.xml") as f:
+        xml = f.read()
+    with open("mujoco_py/tests/include.xml", "rb") as f:
+        assets = {"include.xml": f.read()}
+    model = load_model_from_xml(xml, assets=assets)
+    assert "blabla" in model.body_names
+    mjb = model.get_mjb()
+    model_from_mjb = load_model_from_mjb(memoryview(bytearray(mjb)))
+    assert model_from_mjb.body_names == model.body_names
+    with pytest.raises(Exception):
+        load_model_from_xml(xml, assets={})
+
+
 def test_sensors():
     model = load_model_from_xml(BASIC_MODEL_XML)
     sim = MjSim(model)
@@ -0,0 +1,60 @@
+import numpy as np
+from numpy.testing import assert_array_almost_equal
+
+from mujoco_py import load_model_from_xml, MjSim
+from mujoco_py import ik
+
+ARM_XML = """
+<mujoco>
+    <worldbody>
+        <body name="link1" pos="0 0 0">
+            <joint name="j1" type="hinge" axis="0 0 1"/>
+            <geom type="capsule" fromto="0 0 0 0 0 .4" size=".05"/>
+            <body name="link2" pos="0 0 .4">
+                <joint name="j2" type="hinge" axis="0 1 0" limited="true" range="-2 2"/>
+                <geom type="capsule" fromto="0 0 0 .4 0 0" size=".05"/>
+                <body name="link3" pos=".4 0 0">
+                    <joint name="j3" type="hinge" axis="0 1 0" limited="true" range="-2 2"/>
+                    <geom type="capsule" fromto="0 0 0 .3 0 0" size=".05"/>
+                    <site name="tip" pos=".3 0 0"/>
+                </body>
+            </body>
+        </body>
+    </worldbody>
+</mujoco>
+"""
+
+
+def test_solve():
+    sim = MjSim(load_model_from_xml(ARM_XML))
+    sim.data.qpos[:] = [.3, -.5, .8]
+    sim.forward()
+    target = sim.data.get_site_xpos('tip').copy()
+    sim.data.qpos[:] = 0
+    sim.forward()
+
+    result = ik.solve(sim, ['tip'], target)
+    assert result.success
+    # sim.data isn't modified
+    assert_array_almost_equal(sim.data.qpos, np.zeros(3))
+    sim.data.qpos[:] = result.qpos
+    sim.forward()
+    assert_array_almost_equal(sim.data.get_site_xpos('tip'), target)
+    assert np.all(np.abs(result.qpos[1:]) <= 2)
+
+    # Without j1, targets off the arm's plane can't be reached
+    result = ik.solve(sim, ['tip'], target, joint_names=['j2', 'j3'])
+    assert not result.success
+    assert result.qpos[0] == 0
+
+
+def test_solve_batch():
+    sim = MjSim(load_model_from_xml(ARM_XML))
+    qpos = np.random.RandomState(0).uniform(-1.5, 1.5, size=(20, 3))
+    targets = sim.kinematics_batch(qpos, ['site_xpos'])['site_xpos']
+    result = ik.solve_batch(sim, ['tip'], targets, max_iter=200)
+    assert result.qpos.shape == (20, 3)
+    # Local solvers can get stuck at joint limits, but rarely
+    assert result.success.mean() > .9
+    solved = sim.kinematics_batch(result.qpos, ['site_xpos'])['site_xpos']
+    assert_array_almost_equal(solved[result.success], targets[result.success])
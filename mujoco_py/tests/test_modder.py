@@ -1,6 +1,6 @@
 import pytest
 from mujoco_py import MjSim, load_model_from_xml
-from mujoco_py.modder import MaterialModder, TextureModder
+from mujoco_py.modder import CameraModder, MaterialModder, TextureModder
 from mujoco_py.tests.utils import compare_imgs
 import numpy as np
 
@@ -108,6 +108,22 @@ def test_materials():
     compare_imgs(sim.render(201, 205, camera_name="topcam"),
                  'test_materials.rand_all.png')
 
+
+def test_setters_mark_dirty():
+    # Dirty tracking doesn't compare model parameters, so the modders
+    # mark the sim dirty themselves.
+    sim = MjSim(load_model_from_xml(BASIC_MODEL_XML))
+    sim.forward()
+    assert not sim.dirty
+    CameraModder(sim).set_pos('topcam', [0, 0, 3])
+    assert sim.dirty
+    sim.forward(if_dirty=True)
+    assert not sim.dirty
+    assert sim.data.cam_xpos[0, 2] == 3
+    MaterialModder(sim).set_shininess('g1', 0.5)
+    assert sim.dirty
+
+
 @pytest.mark.requires_rendering
 def test_multiple_sims():
     # Ensure that creating new simulators still produces good renderings.
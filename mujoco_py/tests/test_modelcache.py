@@ -0,0 +1,44 @@
+import os
+
+from mujoco_py import load_model_from_path, load_model_from_xml
+from mujoco_py.modelcache import ModelCache
+
+
+def test_cache_hit_miss(tmpdir):
+    cache = ModelCache(str(tmpdir.join('cache')))
+    model = load_model_from_path("mujoco_py/tests/test.xml", cache=cache)
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['entries'] == 1
+    cached = load_model_from_path("mujoco_py/tests/test.xml", cache=cache)
+    assert cache.stats()['hits'] == 1
+    assert cached.body_names == model.body_names
+    assert cached.get_mjb() == model.get_mjb()
+
+
+def test_cache_key_includes_assets(tmpdir):
+    cache = ModelCache(str(tmpdir.join('cache')))
+    with open("mujoco_py/tests/test.xml") as f:
+        xml = f.read()
+    with open("mujoco_py/tests/include.xml") as f:
+        include = f.read()
+    key = cache.key_for_xml(xml, assets={'include.xml': include})
+    assert key == cache.key_for_path("mujoco_py/tests/test.xml")
+    changed = include.replace('blabla', 'other')
+    assert key != cache.key_for_xml(xml, assets={'include.xml': changed})
+    model = load_model_from_xml(xml, assets={'include.xml': changed}, cache=cache)
+    assert 'other' in model.body_names
+
+
+def test_cache_eviction(tmpdir):
+    cache = ModelCache(str(tmpdir.join('cache')), max_bytes=None)
+    cache.put('a', b'x' * 100)
+    cache.put('b', b'x' * 100)
+    # Make 'a' the most recently used entry
+    os.utime(os.path.join(cache.path, 'b.mjb'), (0, 0))
+    assert cache.get('a') is not None
+    cache.evict(150)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'entries': 1, 'bytes': 100}
+    cache.clear()
+    assert cache.stats()['entries'] == 0
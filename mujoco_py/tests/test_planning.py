@@ -0,0 +1,108 @@
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+
+from mujoco_py import cymj, load_model_from_xml, MjSim
+from mujoco_py.builder import build_callback_fn
+from mujoco_py.planning import MPPI
+
+SLIDER_XML = """
+<mujoco>
+    <option timestep="0.01" gravity="0 0 0"/>
+    <worldbody>
+        <body>
+            <joint name="x" type="slide" axis="1 0 0" damping=".1"/>
+            <geom type="sphere" size=".1" mass="1"/>
+        </body>
+    </worldbody>
+    <actuator>
+        <motor joint="x" ctrllimited="true" ctrlrange="-2 2"/>
+    </actuator>
+</mujoco>
+"""
+
+# Distance of the slider to x = 1, with a small penalty on velocity.
+COST_FN = """
+    void fun(const mjModel* m, const mjData* d, mjtNum* out) {
+        mjtNum err = d->qpos[0] - 1;
+        out[0] = err * err + 0.01 * d->qvel[0] * d->qvel[0];
+    }
+"""
+
+
+def test_rollout_costs():
+    sim = MjSim(load_model_from_xml(SLIDER_XML), nsubsteps=2)
+    cost_fn = build_callback_fn(COST_FN)
+    ctrls = np.random.RandomState(0).uniform(-2, 2, (20, 15, 1))
+    costs = cymj._rollout_costs(sim, cost_fn, ctrls, nthreads=4)
+    assert_array_equal(cymj._rollout_costs(sim, cost_fn, ctrls, nthreads=1),
+                       costs)
+
+    # Same as stepping sim itself
+    state = sim.get_state()
+    expected = 0
+    for ctrl in ctrls[3]:
+        sim.data.ctrl[:] = ctrl
+        sim.step()
+        expected += (sim.data.qpos[0] - 1) ** 2 + 0.01 * sim.data.qvel[0] ** 2
+    assert abs(costs[3] - expected) < 1e-10
+    sim.set_state(state)
+    assert sim.data.qpos[0] == 0
+
+
+def test_rollouts_restore_inputs():
+    # A callback that accumulates applied forces mustn't leak into the
+    # next rollout of the same thread.
+    sim = MjSim(load_model_from_xml(SLIDER_XML))
+    sim.add_substep_callback('''
+        void fun(const mjModel* m, mjData* d) {
+            d->qfrc_applied[0] += 1;
+        }
+    ''')
+    ctrls = np.zeros((16, 5, 1))
+    costs = cymj._rollout_costs(sim, build_callback_fn(COST_FN), ctrls,
+                                nthreads=3)
+    assert_array_equal(costs, np.full(16, costs[0]))
+    assert sim.data.qfrc_applied[0] == 0
+
+
+def test_ended_rollout_costs():
+    # Ending early doesn't make a rollout cheaper than staying in the state
+    # it ended in.
+    sim = MjSim(load_model_from_xml(SLIDER_XML))
+    constant_cost = '''
+        void fun(const mjModel* m, const mjData* d, mjtNum* out) {
+            out[0] = 1;
+            out[1] = %s;
+        }
+    '''
+    ctrls = np.zeros((1, 10, 1))
+    ended = cymj._rollout_costs(
+        sim, build_callback_fn(constant_cost % 'd->time > 0.045'), ctrls)
+    continued = cymj._rollout_costs(
+        sim, build_callback_fn(constant_cost % '0'), ctrls)
+    assert continued[0] == 10
+    assert ended[0] >= continued[0]
+
+
+def test_mppi():
+    sim = MjSim(load_model_from_xml(SLIDER_XML))
+    mppi = MPPI(sim, COST_FN, horizon=40, num_samples=64, noise_sigma=1,
+                temperature=0.1, seed=0)
+    for _ in range(150):
+        nominal = mppi.plan()
+        assert nominal.shape == (40, 1)
+        assert np.all(np.abs(mppi.samples) <= 2)
+        sim.data.ctrl[:] = nominal[0]
+        sim.step()
+        mppi.shift()
+    assert abs(sim.data.qpos[0] - 1) < 0.1
+    assert abs(sim.data.qvel[0]) < 0.5
+
+    # Noise only depends on the seed
+    sim.reset()
+    plans = []
+    for nthreads in (1, 3):
+        mppi = MPPI(sim, mppi.cost_fn_ptr, horizon=10, num_samples=16,
+                    seed=1, nthreads=nthreads)
+        plans.append(mppi.plan().copy())
+    assert_array_almost_equal(plans[0], plans[1])
@@ -7,7 +7,8 @@ from os.path import abspath, dirname, join
 import numpy as np
 import pytest
 
-from mujoco_py import MjSim, MjRenderPool, load_model_from_xml
+from mujoco_py import (MjSim, MjSimStateBatch, MjRenderPool,
+                       load_model_from_xml)
 from mujoco_py.modder import TextureModder
 from mujoco_py.tests.utils import compare_imgs
 
@@ -156,6 +157,10 @@ def mp_test_states():
     compare_imgs(images[1], 'test_render_pool.mp_test_states.4.png')
     compare_imgs(images[2], 'test_render_pool.mp_test_states.5.png')
 
+    batch_images = pool.render(100, 100,
+                               states=MjSimStateBatch.from_states(states))
+    assert np.all(batch_images == images)
+
 
 if __name__ == '__main__':
     mp.freeze_support()
@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import pickle
 import unittest
 import numpy as np
 from mujoco_py import load_model_from_xml, MjSim, functions
@@ -151,6 +152,115 @@ class TestSubstep(unittest.TestCase):
         functions.mju_quat2Mat(mat, sim.data.body_xquat[2])
         np.testing.assert_array_equal(sim.data.userdata, mat)
 
+    def test_substep_pipeline(self):
+        sim = MjSim(load_model_from_xml(XML.format(nuserdata=3)), nsubsteps=3,
+                    substep_callback=INCREMENT_FN)
+        sim.add_substep_callback('''
+            void fun(const mjModel* m, mjData* d) {
+                d->userdata[1] = 10 * d->userdata[0];
+            }
+        ''', stage='post', name='copy')
+        sim.add_substep_callback('''
+            void fun(const mjModel* m, mjData* d) {
+                d->userdata[2] += 1;
+            }
+        ''', stage='between_step1_step2', name='between')
+        self.assertEqual(sim.substep_callbacks,
+                         [('copy', 'post', True),
+                          ('between', 'between_step1_step2', True)])
+        sim.data.ctrl[:] = [1, 0]
+        sim.step()
+        np.testing.assert_array_equal(sim.data.userdata[:3], [3, 30, 3])
+
+        sim.disable_substep_callback('copy')
+        sim.step()
+        np.testing.assert_array_equal(sim.data.userdata[:3], [6, 30, 6])
+        sim.enable_substep_callback('copy')
+        sim.remove_substep_callback('between')
+        sim.step()
+        np.testing.assert_array_equal(sim.data.userdata[:3], [9, 90, 6])
+
+        with self.assertRaises(ValueError):
+            sim.add_substep_callback(INCREMENT_FN, name='copy')
+        with self.assertRaises(ValueError):
+            sim.add_substep_callback(INCREMENT_FN, stage='during')
+        with self.assertRaises(KeyError):
+            sim.disable_substep_callback('between')
+
+        sim2 = pickle.loads(pickle.dumps(sim))
+        self.assertEqual(sim2.substep_callbacks, sim.substep_callbacks)
+        sim2.step()
+        np.testing.assert_array_equal(sim2.data.userdata[:2], [12, 120])
+
+    def test_default_substep_callback_names(self):
+        sim = MjSim(load_model_from_xml(XML.format(nuserdata=1)))
+        self.assertEqual(sim.add_substep_callback(INCREMENT_FN), 'substep_0')
+        self.assertEqual(sim.add_substep_callback(INCREMENT_FN), 'substep_1')
+        sim.remove_substep_callback('substep_0')
+        self.assertEqual(sim.add_substep_callback(INCREMENT_FN), 'substep_0')
+        self.assertEqual(sim.add_substep_callback(INCREMENT_FN), 'substep_2')
+
+    def test_overridden_substep_callback(self):
+        class CountingSim(MjSim):
+            def substep_callback(self):
+                self.calls += 1
+                super().substep_callback()
+
+        sim = CountingSim(load_model_from_xml(XML.format(nuserdata=2)),
+                          nsubsteps=4, substep_callback=INCREMENT_FN)
+        sim.calls = 0
+        sim.add_substep_callback('''
+            void fun(const mjModel* m, mjData* d) {
+                d->userdata[1] = 10 * d->userdata[0];
+            }
+        ''', stage='post')
+        sim.step()
+        self.assertEqual(sim.calls, 4)
+        # The compiled callback only runs through the override.
+        np.testing.assert_array_equal(sim.data.userdata, [4, 40])
+
+    def test_reward_callback(self):
+        # Reward is the angle of j1, the episode ends once it exceeds 1
+        fn = '''
+            void fun(const mjModel* m, const mjData* d, mjtNum* out) {
+                out[0] = d->qpos[0];
+                out[1] = d->qpos[0] > 1;
+            }
+        '''
+        sim = MjSim(load_model_from_xml(XML.format(nuserdata=0)),
+                    nsubsteps=5, reward_callback=fn)
+        sim.data.ctrl[:] = [2, 0]
+        ctrls = np.tile(sim.data.ctrl, (100, 1))
+        rewards, length = sim.rollout(ctrls)
+        self.assertEqual(sim.data.time, 0)  # sim.data isn't modified
+        self.assertLess(length, 100)
+        self.assertGreater(rewards[length - 1], 1)
+        np.testing.assert_array_equal(rewards[length:], 0)
+
+        for i in range(length):
+            self.assertFalse(sim.done)
+            sim.step()
+            self.assertEqual(sim.reward, rewards[i])
+        self.assertTrue(sim.done)
+        sim.reset()
+        self.assertFalse(sim.done)
+
+        # Batched rollouts, some of which never end
+        ctrls = np.random.RandomState(0).uniform(-2, 2, (10, 100, 2))
+        ctrls[:5] = [-2, 0]
+        rewards, lengths = sim.rollout(ctrls, nthreads=3)
+        self.assertEqual(rewards.shape, (10, 100))
+        np.testing.assert_array_equal(lengths[:5], 100)
+        for i in range(10):
+            r, n = sim.rollout(ctrls[i])
+            self.assertEqual(n, lengths[i])
+            np.testing.assert_array_equal(r, rewards[i])
+
+        sim2 = pickle.loads(pickle.dumps(sim))
+        self.assertEqual(sim2.reward_callback_src, fn)
+        self.assertEqual(sim2.rollout(ctrls[0])[1], lengths[0])
+
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from mujoco_py import load_model_from_xml, MjSim
+from mujoco_py.trajectory import TrajectoryRecorder, TrajectoryReplayer
+from mujoco_py.tests.test_cymj import BASIC_MODEL_XML
+
+
+def test_recorder(tmpdir):
+    sim = MjSim(load_model_from_xml(BASIC_MODEL_XML))
+    path = str(tmpdir)
+    qpos = []
+    with TrajectoryRecorder(sim, ['time', 'qpos', 'qvel'], path,
+                            chunk_steps=7) as recorder:
+        for _ in range(30):
+            sim.step()
+            recorder.record()
+            qpos.append(sim.data.qpos.copy())
+        recorder.flush()
+        assert np.load(os.path.join(path, 'qpos.npy')).shape == (30, sim.model.nq)
+        sim.step()
+        recorder.record()
+        qpos.append(sim.data.qpos.copy())
+    assert recorder.steps == 31
+    time = np.load(os.path.join(path, 'time.npy'), mmap_mode='r')
+    assert time.shape == (31,)
+    assert time[-1] == sim.data.time
+    assert_array_equal(np.load(os.path.join(path, 'qpos.npy'), mmap_mode='r'), qpos)
+
+
+def test_replayer(tmpdir):
+    sim = MjSim(load_model_from_xml(BASIC_MODEL_XML))
+    path = str(tmpdir)
+    states = []
+    with TrajectoryRecorder(sim, ['time', 'qpos', 'qvel'], path,
+                            chunk_steps=4) as recorder:
+        for _ in range(10):
+            sim.step()
+            recorder.record()
+            states.append(sim.get_state())
+
+    replayer = TrajectoryReplayer(path)
+    assert len(replayer) == 10
+    assert replayer.get_state(3) == states[3]
+    batch = replayer.get_state_batch(2, 6)
+    assert len(batch) == 4
+    assert batch[1] == states[3]
+    sim2 = MjSim(sim.model)
+    for i in replayer.replay(sim2, start=5):
+        assert sim2.get_state() == states[i]
@@ -0,0 +1,283 @@
+"""
+Recording and replaying of simulation trajectories on disk.
+
+Fields of ``PyMjData`` are copied every step into preallocated chunk buffers,
+which a background thread appends to one ``.npy`` file per field. The files
+are valid at all times and can be opened with ``np.load(path, mmap_mode='r')``,
+which is how :class:`TrajectoryReplayer` streams them back.
+"""
+import os
+import queue
+import struct
+from os.path import exists, join
+from threading import Thread
+
+import numpy as np
+from mujoco_py import cymj
+
+
+class _NpyAppendWriter:
+    """
+    Writes a ``.npy`` file that grows along its first axis. The header is
+    reserved with a fixed size and rewritten after every append, so the file
+    can be memory-mapped while it is still being written.
+    """
+
+    HEADER_SIZE = 128
+
+    def __init__(self, path, dtype, shape):
+        self.descr = np.lib.format.dtype_to_descr(np.dtype(dtype))
+        self.shape = tuple(shape)
+        self.count = 0
+        self.f = open(path, 'wb')
+        self._write_header()
+
+    def _write_header(self):
+        header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (
+            self.descr, (self.count,) + self.shape)
+        # Magic string (6), version (2) and header length (2) come first,
+        # and the header ends with a newline.
+        header_len = self.HEADER_SIZE - 10
+        if len(header) >= header_len:
+            raise ValueError('Shape %s too large for .npy header' % (self.shape,))
+        self.f.seek(0)
+        self.f.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', header_len) +
+                     (header.ljust(header_len - 1) + '\n').encode('latin1'))
+        self.f.seek(0, os.SEEK_END)
+
+    def append(self, array):
+        self.f.write(memoryview(np.ascontiguousarray(array)).cast('B'))
+        self.count += len(array)
+        self._write_header()
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class TrajectoryRecorder:
+    """
+    Streams selected ``PyMjData`` fields of a simulation to disk.
+
+    Every call to :meth:`record` copies the fields into the current chunk
+    buffer. Full chunks are handed to a background thread which appends them
+    to ``<path>/<field>.npy``, so the step loop doesn't wait on the disk.
+    Memory is bounded to ``max_pending + 1`` chunks regardless of the
+    trajectory length; :meth:`record` only blocks if the writer falls behind
+    by more than ``max_pending`` chunks.
+
+    Example::
+
+        with TrajectoryRecorder(sim, ['time', 'qpos', 'qvel'], 'traj') as rec:
+            for _ in range(n):
+                sim.step()
+                rec.record()
+
+    Args:
+    - sim (MjSim): simulation to record.
+    - fields (list): names of ``sim.data`` attributes, e.g. ``'time'``,
+        ``'qpos'``, ``'sensordata'``.
+    - path (str): directory for the output files. Created if missing;
+        existing files of the same fields are overwritten.
+    - chunk_steps (int): number of steps per chunk.
+    - max_pending (int): number of full chunks that may wait for the writer.
+    """
+
+    def __init__(self, sim, fields, path, chunk_steps=1000, max_pending=2):
+        self.sim = sim
+        self.fields = tuple(fields)
+        self.path = path
+        self.chunk_steps = chunk_steps
+        os.makedirs(path, exist_ok=True)
+
+        self._writers = []
+        examples = []
+        for name in self.fields:
+            value = getattr(sim.data, name)
+            if value is None:
+                raise ValueError("Field %s is empty for this model" % name)
+            value = np.asarray(value)
+            examples.append(value)
+            self._writers.append(_NpyAppendWriter(
+                join(path, name + '.npy'), value.dtype, value.shape))
+
+        self._free = queue.Queue()
+        for _ in range(max_pending + 1):
+            self._free.put([np.empty((chunk_steps,) + v.shape, dtype=v.dtype)
+                            for v in examples])
+        self._pending = queue.Queue()
+        self._chunk = self._free.get()
+        self._n = 0
+        self._steps = 0
+        self._error = None
+        self._closed = False
+        self._thread = Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    @property
+    def steps(self):
+        """ Number of steps recorded so far (including unflushed ones). """
+        return self._steps
+
+    def record(self):
+        """ Appends the current values of the fields. """
+        data = self.sim.data
+        i = self._n
+        for name, buf in zip(self.fields, self._chunk):
+            buf[i] = getattr(data, name)
+        self._n += 1
+        self._steps += 1
+        if self._n == self.chunk_steps:
+            self._submit()
+
+    def _submit(self):
+        if self._error is not None:
+            raise self._error
+        self._pending.put((self._chunk, self._n))
+        self._chunk = self._free.get()
+        self._n = 0
+
+    def _write_loop(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                self._pending.task_done()
+                return
+            chunk, n = item
+            try:
+                if self._error is None:
+                    for writer, buf in zip(self._writers, chunk):
+                        writer.append(buf[:n])
+            except Exception as e:
+                self._error = e
+            self._free.put(chunk)
+            self._pending.task_done()
+
+    def flush(self):
+        """ Writes all recorded steps, including a partial chunk, and waits. """
+        if self._n > 0:
+            self._submit()
+        self._pending.join()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        """ Flushes the remaining steps and closes the files. """
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.flush()
+        finally:
+            self._pending.put(None)
+            self._thread.join()
+            for writer in self._writers:
+                writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class TrajectoryReplayer:
+    """
+    Replays a trajectory saved by :class:`TrajectoryRecorder`.
+
+    The ``time``, ``qpos``, ``qvel`` and (if present) ``act`` files in
+    ``path`` are memory-mapped, so only the states that are accessed are
+    read from disk, and memory use doesn't depend on the trajectory length.
+
+    Args:
+    - path (str): directory with the recorded ``.npy`` files. ``qpos`` and
+        ``qvel`` are required; a missing ``time`` is treated as zero.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.time = self._load('time')
+        self.qpos = self._load('qpos')
+        self.qvel = self._load('qvel')
+        self.act = self._load('act')
+        if self.qpos is None or self.qvel is None:
+            raise ValueError("qpos.npy and qvel.npy are required in %s" % path)
+
+    def _load(self, name):
+        filename = join(self.path, name + '.npy')
+        if not exists(filename):
+            return None
+        return np.load(filename, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.qpos)
+
+    def set_sim_state(self, sim, i, forward=True):
+        """
+        Writes state ``i`` directly into ``sim.data`` and, by default, calls
+        ``sim.forward()`` to recompute the derived quantities.
+        """
+        data = sim.data
+        data.time = 0.0 if self.time is None else self.time[i]
+        data.qpos[:] = self.qpos[i]
+        data.qvel[:] = self.qvel[i]
+        if self.act is not None:
+            data.act[:] = self.act[i]
+        if forward:
+            sim.forward()
+
+    def replay(self, sim, start=0, stop=None, forward=True):
+        """
+        Generator that sets ``sim`` to each state in ``[start, stop)`` in
+        turn and yields its index.
+        """
+        for i in range(*slice(start, stop).indices(len(self))):
+            self.set_sim_state(sim, i, forward=forward)
+            yield i
+
+    def get_state(self, i):
+        """ Returns state ``i`` as an :class:`mujoco_py.MjSimState`. """
+        time = 0.0 if self.time is None else float(self.time[i])
+        qpos = np.array(self.qpos[i])
+        qvel = np.array(self.qvel[i])
+        act = None if self.act is None else np.array(self.act[i])
+        return cymj.MjSimState(time, qpos, qvel, act, {})
+
+    def get_state_batch(self, start=0, stop=None):
+        """
+        Returns the states in ``[start, stop)`` as an
+        :class:`mujoco_py.MjSimStateBatch` whose arrays are views into the
+        memory-mapped files, without creating a state per step.
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        stop = max(start, stop)
+        if self.time is None:
+            time = np.zeros(stop - start)
+        else:
+            time = self.time[start:stop]
+        act = None if self.act is None else self.act[start:stop]
+        return cymj.MjSimStateBatch(time, self.qpos[start:stop],
+                                    self.qvel[start:stop], act, {})
+
+    def render(self, pool, width, height, start=0, stop=None,
+               camera_name=None, depth=False, batch_size=None):
+        """
+        Generator that re-renders the states in ``[start, stop)`` with an
+        :class:`mujoco_py.MjRenderPool`, one batch at a time. Yields
+        ``(indices, rgbs)``, or ``(indices, rgbs, depths)`` if ``depth``.
+
+        Only one batch of states is read from disk at a time, so whole
+        datasets can be re-rendered at a new resolution or from a new camera
+        in constant memory.
+        """
+        batch_size = batch_size or pool._max_batch_size
+        indices = range(*slice(start, stop).indices(len(self)))
+        for batch_start in range(0, len(indices), batch_size):
+            batch = indices[batch_start:batch_start + batch_size]
+            states = self.get_state_batch(batch.start, batch.stop)
+            result = pool.render(width, height, states=states,
+                                 camera_name=camera_name, depth=depth)
+            if depth:
+                yield (batch,) + tuple(result)
+            else:
+                yield batch, result